@@ -0,0 +1,128 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from app.vector_index import normalize_rows, top_k
+
+
+ANN_IVF = "ivf"
+DEFAULT_ANN_MIN_CHUNKS = 20000
+DEFAULT_KMEANS_ITERS = 10
+# k-means trains on at most this many points per list
+TRAIN_POINTS_PER_LIST = 64
+ASSIGN_BLOCK_ROWS = 8192
+
+
+def default_nlist(n: int) -> int:
+    return max(1, min(n, int(4 * math.sqrt(n))))
+
+
+def default_nprobe(nlist: int) -> int:
+    return max(1, min(nlist, int(round(nlist / 16)) or 1))
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(x.shape[0], dtype=np.int32)
+    for start in range(0, x.shape[0], ASSIGN_BLOCK_ROWS):
+        block = np.asarray(x[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        out[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def _spherical_kmeans(x: np.ndarray, k: int, iters: int, rng: np.random.Generator) -> np.ndarray:
+    n = x.shape[0]
+    centroids = x[rng.choice(n, size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        present = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+        sums[present] = np.add.reduceat(x[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            # Re-seed empty lists from random points so every list stays useful
+            sums[empty] = x[rng.choice(n, size=empty.size, replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file ANN index over a normalized embedding matrix.
+
+    Rows are clustered into ``nlist`` lists around spherical k-means
+    centroids. A query only scores the rows of its ``nprobe`` closest
+    lists, so larger ``nprobe`` trades speed for recall.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        order: np.ndarray,
+        offsets: np.ndarray,
+        nprobe: Optional[int] = None,
+    ) -> None:
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe or default_nprobe(self.nlist)
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        nlist: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        iters: int = DEFAULT_KMEANS_ITERS,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        n = matrix.shape[0]
+        if n == 0:
+            raise ValueError("Cannot build an IVF index over an empty matrix")
+        nlist = max(1, min(nlist or default_nlist(n), n))
+        rng = np.random.default_rng(seed)
+
+        train_size = min(n, nlist * TRAIN_POINTS_PER_LIST)
+        if train_size < n:
+            train = np.asarray(matrix[np.sort(rng.choice(n, size=train_size, replace=False))])
+        else:
+            train = np.asarray(matrix)
+        centroids = _spherical_kmeans(train.astype(np.float32, copy=False), nlist, iters, rng)
+
+        assign = _assign(matrix, centroids)
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        return cls(centroids, order, offsets, nprobe=nprobe)
+
+    def candidates(self, q: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        lists = top_k(self.centroids @ q, nprobe)
+        parts = [self.order[self.offsets[j]:self.offsets[j + 1]] for j in lists]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate(parts))
+
+    def search(
+        self,
+        matrix: np.ndarray,
+        q: np.ndarray,
+        topk: int,
+        nprobe: Optional[int] = None,
+        quant=None,
+    ):
+        rows = self.candidates(q, nprobe)
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        if quant is not None:
+            # Candidates are shortlisted on the codes; only the shortlist reads float32 rows
+            return quant.search(matrix, q, topk, rows=rows)
+        scores = np.asarray(matrix[rows]) @ q
+        best = top_k(scores, topk)
+        return rows[best], scores[best]
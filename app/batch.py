@@ -0,0 +1,158 @@
+import asyncio
+import random
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, Sequence
+
+from app.pipeline import process_text, process_text_async
+from app.rate_limiter import is_retryable
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 2
+RETRY_BASE_SECONDS = 0.5
+ERROR_MESSAGE_MAX = 500
+
+
+@dataclass
+class BatchItemResult:
+    index: int
+    text: str
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[Exception] = None
+    error_trace: Optional[str] = None
+    attempts: int = 0
+    duration_ms: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_json(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "index": self.index,
+            "status": "success" if self.ok else "error",
+            "attempts": self.attempts,
+            "duration_ms": self.duration_ms,
+            **self.extra,
+        }
+        if self.ok:
+            data["result"] = self.result
+        else:
+            data["error"] = {
+                "type": type(self.error).__name__,
+                "message": str(self.error)[:ERROR_MESSAGE_MAX],
+            }
+        return data
+
+
+def _retry_delay(attempt: int) -> float:
+    # Upstream errors are retried by the shared limiter; this only spaces out other failures
+    return RETRY_BASE_SECONDS * (2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def _run_one(index: int, text: str, fn: Callable[[str], Dict], max_retries: int) -> BatchItemResult:
+    item = BatchItemResult(index=index, text=text)
+    start = time.perf_counter()
+    while True:
+        item.attempts += 1
+        try:
+            item.result = fn(text)
+            item.error = None
+            break
+        except Exception as exc:
+            item.error = exc
+            item.error_trace = traceback.format_exc()
+            # Upstream errors were already retried by the shared limiter
+            if item.attempts > max_retries or is_retryable(exc):
+                break
+            time.sleep(_retry_delay(item.attempts - 1))
+    item.duration_ms = int((time.perf_counter() - start) * 1000)
+    return item
+
+
+def process_many(
+    texts: Sequence[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    fn: Callable[[str], Dict] = process_text,
+) -> Iterator[BatchItemResult]:
+    """Process ``texts`` with at most ``concurrency`` calls in flight.
+
+    Results are yielded as they complete (use ``index`` to match inputs);
+    failed items are retried up to ``max_retries`` times and then yielded
+    with ``error`` set instead of aborting the batch.
+    """
+    if not texts:
+        return
+    pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(texts))))
+    try:
+        pending = set()
+        todo = iter(enumerate(texts))
+        for index, text in todo:
+            pending.add(pool.submit(_run_one, index, text, fn, max_retries))
+            if len(pending) >= concurrency:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                nxt = next(todo, None)
+                if nxt is not None:
+                    pending.add(pool.submit(_run_one, nxt[0], nxt[1], fn, max_retries))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+async def _run_one_async(
+    index: int,
+    text: str,
+    fn: Callable[[str], Awaitable[Dict]],
+    max_retries: int,
+) -> BatchItemResult:
+    item = BatchItemResult(index=index, text=text)
+    start = time.perf_counter()
+    while True:
+        item.attempts += 1
+        try:
+            item.result = await fn(text)
+            item.error = None
+            break
+        except Exception as exc:
+            item.error = exc
+            item.error_trace = traceback.format_exc()
+            # Upstream errors were already retried by the shared limiter
+            if item.attempts > max_retries or is_retryable(exc):
+                break
+            await asyncio.sleep(_retry_delay(item.attempts - 1))
+    item.duration_ms = int((time.perf_counter() - start) * 1000)
+    return item
+
+
+async def process_many_async(
+    texts: Sequence[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    fn: Callable[[str], Awaitable[Dict]] = process_text_async,
+) -> AsyncIterator[BatchItemResult]:
+    """Async counterpart of :func:`process_many`; unfinished items are cancelled if the consumer stops."""
+    todo = iter(enumerate(texts))
+    pending = set()
+    try:
+        for index, text in todo:
+            pending.add(asyncio.ensure_future(_run_one_async(index, text, fn, max_retries)))
+            if len(pending) >= concurrency:
+                break
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+                nxt = next(todo, None)
+                if nxt is not None:
+                    pending.add(asyncio.ensure_future(_run_one_async(nxt[0], nxt[1], fn, max_retries)))
+    finally:
+        for task in pending:
+            task.cancel()
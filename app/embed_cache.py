@@ -0,0 +1,163 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.sqlite_local import LocalConnections
+
+
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parents[1] / "data" / "embed_cache.db"
+DEFAULT_MAX_ENTRIES = 200000
+# On overflow, evict down to this fraction of max_entries so eviction is amortized
+EVICT_TO_RATIO = 0.9
+SQLITE_MAX_VARS = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    text_sha TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    last_used_ts INTEGER NOT NULL,
+    PRIMARY KEY (model, text_sha)
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used
+    ON embeddings (last_used_ts);
+"""
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model, sha256(chunk text)).
+
+    Shared by every KB and rebuild on this machine; least recently used
+    vectors are evicted once the entry cap is exceeded.
+    """
+
+    def __init__(self, path: Path, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._conns = LocalConnections(self.path, _SCHEMA)
+        # Rows in the file as of the last exact count plus puts since; None until first put
+        self._approx_count: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [text_key(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        now = int(time.time())
+        conn = self._conns.get()
+        for i in range(0, len(unique), SQLITE_MAX_VARS):
+            part = unique[i:i + SQLITE_MAX_VARS]
+            marks = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT text_sha, vector FROM embeddings WHERE model = ? AND text_sha IN ({marks})",
+                (model, *part),
+            ).fetchall()
+            for sha, blob in rows:
+                found[sha] = np.frombuffer(blob, dtype=np.float32)
+        if found:
+            conn.executemany(
+                "UPDATE embeddings SET last_used_ts = ? WHERE model = ? AND text_sha = ?",
+                [(now, model, sha) for sha in found],
+            )
+            conn.commit()
+        out = [found.get(k) for k in keys]
+        hits = sum(1 for v in out if v is not None)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(out) - hits
+        return out
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        if not texts or self.max_entries <= 0:
+            return
+        now = int(time.time())
+        rows = []
+        for text, vec in zip(texts, vectors):
+            arr = np.asarray(vec, dtype=np.float32)
+            rows.append((model, text_key(text), int(arr.shape[0]), arr.tobytes(), now))
+        conn = self._conns.get()
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO embeddings (model, text_sha, dim, vector, last_used_ts)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        conn.commit()
+        with self._lock:
+            if self._approx_count is None:
+                self._approx_count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            else:
+                # Counts replaced rows too, so it only ever overestimates
+                self._approx_count += len(rows)
+            if self._approx_count <= self.max_entries:
+                return
+            self._approx_count = self._evict(conn)
+
+    def _evict(self, conn) -> int:
+        """Exact count and eviction, run only once the approximate count passes the cap."""
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - int(self.max_entries * EVICT_TO_RATIO)
+        if count > self.max_entries and excess > 0:
+            conn.execute(
+                """
+                DELETE FROM embeddings WHERE rowid IN (
+                    SELECT rowid FROM embeddings ORDER BY last_used_ts ASC LIMIT ?
+                )
+                """,
+                (excess,),
+            )
+            conn.commit()
+            self.evictions += excess
+            count -= excess
+        return count
+
+    def close(self) -> None:
+        self._conns.close()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide cache from EMBED_CACHE_PATH / EMBED_CACHE_MAX_ENTRIES (0 disables)."""
+    raw_max = os.getenv("EMBED_CACHE_MAX_ENTRIES")
+    try:
+        max_entries = int(raw_max) if raw_max else DEFAULT_MAX_ENTRIES
+    except ValueError:
+        max_entries = DEFAULT_MAX_ENTRIES
+    if max_entries <= 0:
+        return None
+    path = os.getenv("EMBED_CACHE_PATH") or str(DEFAULT_CACHE_PATH)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = EmbeddingCache(Path(path), max_entries=max_entries)
+            _caches[path] = cache
+        cache.max_entries = max_entries
+        return cache
@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_MAX_BATCH_TOKENS = 8000
+DEFAULT_MAX_BATCH_ITEMS = 256
+# Backoff for rate-limited calls without a Retry-After header (used by app.rate_limiter)
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+EmbedFn = Callable[[List[str], str], List[List[float]]]
+BatchCallback = Callable[[List[str], List[List[float]]], None]
+
+
+def estimate_tokens(text: str) -> int:
+    # CJK text is roughly one token per character, other scripts ~4 chars per token
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af")
+    return max(1, cjk + (len(text) - cjk + 3) // 4)
+
+
+def make_batches(
+    texts: Sequence[str],
+    max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+    max_batch_items: int = DEFAULT_MAX_BATCH_ITEMS,
+) -> List[List[int]]:
+    """Group text positions into batches bounded by estimated tokens and item count."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for pos, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        full = current and (
+            current_tokens + tokens > max_batch_tokens or len(current) >= max_batch_items
+        )
+        if full:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(pos)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    raw_ms = headers.get("retry-after-ms")
+    if raw_ms:
+        try:
+            return max(float(raw_ms) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    raw = headers.get("retry-after")
+    if raw:
+        try:
+            return max(float(raw), 0.0)
+        except ValueError:
+            return None
+    return None
+
+
+def embed_concurrent(
+    texts: Sequence[str],
+    model: str,
+    embed_fn: EmbedFn,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+    max_batch_items: int = DEFAULT_MAX_BATCH_ITEMS,
+    on_batch: Optional[BatchCallback] = None,
+) -> List[List[float]]:
+    """Embed ``texts`` with up to ``max_in_flight`` concurrent batch requests.
+
+    The result is in input order regardless of completion order. Rate
+    limits are not retried here: ``embed_fn`` goes through the shared
+    limiter, whose ``Retry-After`` pause already holds back every worker.
+    """
+    batches = make_batches(texts, max_batch_tokens=max_batch_tokens, max_batch_items=max_batch_items)
+    results: List[Optional[List[float]]] = [None] * len(texts)
+
+    def run(batch: List[int]) -> None:
+        batch_texts = [texts[pos] for pos in batch]
+        vectors = embed_fn(batch_texts, model)
+        if len(vectors) != len(batch):
+            raise ValueError(f"Embeddings endpoint returned {len(vectors)} vectors for {len(batch)} inputs")
+        for pos, vec in zip(batch, vectors):
+            results[pos] = vec
+        if on_batch:
+            on_batch(batch_texts, vectors)
+
+    if max_in_flight <= 1 or len(batches) <= 1:
+        for batch in batches:
+            run(batch)
+    else:
+        pool = ThreadPoolExecutor(max_workers=min(max_in_flight, len(batches)))
+        try:
+            for future in [pool.submit(run, b) for b in batches]:
+                future.result()
+        finally:
+            # On failure, drop batches that have not started yet
+            pool.shutdown(wait=True, cancel_futures=True)
+    return results  # type: ignore[return-value]
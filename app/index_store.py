@@ -0,0 +1,471 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from app.ann import ANN_IVF, IVFIndex
+from app.lexical_index import DEFAULT_B, DEFAULT_K1, LEXICAL_BM25, LexicalIndex
+from app.quantize import QUANT_INT8, QUANT_TYPES, QuantizedIndex
+from app.vector_index import VectorIndex, normalize_rows
+
+
+INDEX_FORMAT = "llmproj-index"
+INDEX_FORMAT_VERSION = 1
+
+HEADER_FILE = "header.json"
+MATRIX_FILE = "embeddings.npy"
+IDS_FILE = "chunk_ids.npy"
+LEGACY_FILE = "embeddings.jsonl"
+MANIFEST_FILE = "files.json"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_ORDER_FILE = "ivf_order.npy"
+IVF_OFFSETS_FILE = "ivf_offsets.npy"
+LEX_TERMS_FILE = "lex_terms.npy"
+LEX_OFFSETS_FILE = "lex_offsets.npy"
+LEX_POSTINGS_FILE = "lex_postings.npy"
+LEX_TFS_FILE = "lex_tfs.npy"
+LEX_DOC_LEN_FILE = "lex_doc_len.npy"
+_LEX_FILES = (LEX_TERMS_FILE, LEX_OFFSETS_FILE, LEX_POSTINGS_FILE, LEX_TFS_FILE, LEX_DOC_LEN_FILE)
+QUANT_CODES_FILE = "quant_codes.npy"
+QUANT_SCALE_FILE = "quant_scale.npy"
+CHUNKS_FILE = "chunks.json"
+# Files of an index written straight into its root (before versioned publishing)
+_FLAT_FILES = (
+    HEADER_FILE, MATRIX_FILE, IDS_FILE, LEGACY_FILE, MANIFEST_FILE,
+    IVF_CENTROIDS_FILE, IVF_ORDER_FILE, IVF_OFFSETS_FILE, *_LEX_FILES, QUANT_CODES_FILE, QUANT_SCALE_FILE,
+)
+
+# Versioned layout: every build goes to versions/<build_id>/ and CURRENT names the live one
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+STAGING_SUFFIX = ".staging"
+# Superseded versions kept for readers in other processes that resolved CURRENT earlier
+DEFAULT_KEEP_VERSIONS = 1
+# Staging dirs older than this were left by a crashed build
+STAGING_MAX_AGE_SECONDS = 6 * 3600
+
+FORMAT_BINARY = "binary"
+FORMAT_JSONL = "jsonl"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _replace_atomic(tmp: Path, dest: Path) -> None:
+    os.replace(str(tmp), str(dest))
+
+
+def _save_npy(path: Path, arr: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        np.save(f, arr, allow_pickle=False)
+    _replace_atomic(tmp, path)
+
+
+def _encode_ids(ids: Sequence[str]) -> np.ndarray:
+    if not ids:
+        return np.zeros(0, dtype="S1")
+    return np.array([cid.encode("utf-8") for cid in ids])
+
+
+def _decode_ids(arr: np.ndarray) -> List[str]:
+    return [b.decode("utf-8") for b in arr.tolist()]
+
+
+# Versions pinned by readers in this process: path -> open count
+_pins: Dict[str, int] = {}
+_pins_lock = threading.Lock()
+
+
+def current_build_id(index_dir: str) -> Optional[str]:
+    try:
+        return (Path(index_dir) / CURRENT_FILE).read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_index_dir(index_dir: str) -> Path:
+    """Directory holding the live index: the CURRENT version, or the root itself for flat indexes."""
+    root = Path(index_dir)
+    build_id = current_build_id(index_dir)
+    if build_id is None:
+        return root
+    return root / VERSIONS_DIR / build_id
+
+
+def _pin_key(path: Path) -> str:
+    return os.path.abspath(str(path))
+
+
+def acquire_index(index_dir: str) -> Path:
+    """Resolve the live version and pin it; pair with release_index()."""
+    for _ in range(3):
+        path = resolve_index_dir(index_dir)
+        key = _pin_key(path)
+        with _pins_lock:
+            _pins[key] = _pins.get(key, 0) + 1
+        # GC may have removed the version between resolving and pinning; resolve again
+        if path == Path(index_dir) or (path / HEADER_FILE).exists():
+            return path
+        _unpin(key)
+    raise FileNotFoundError(f"Index version named by {CURRENT_FILE} is missing: {path}")
+
+
+def pin_version(path: Path) -> None:
+    """Add a pin to a version this process already holds pinned (e.g. a cached index)."""
+    key = _pin_key(path)
+    with _pins_lock:
+        if key not in _pins:
+            raise ValueError(f"Index version is not pinned: {path}")
+        _pins[key] += 1
+
+
+def release_index(index_dir: str, path: Path) -> None:
+    released = _unpin(_pin_key(path))
+    # The last reader of a version superseded meanwhile collects what GC had to skip
+    if released and path != Path(index_dir) and current_build_id(index_dir) != path.name:
+        gc_versions(index_dir)
+
+
+@contextmanager
+def pin_index(index_dir: str) -> Iterator[Path]:
+    """Resolve the live version and keep it from being garbage-collected while in use."""
+    path = acquire_index(index_dir)
+    try:
+        yield path
+    finally:
+        release_index(index_dir, path)
+
+
+def _unpin(key: str) -> bool:
+    with _pins_lock:
+        count = _pins.get(key, 0) - 1
+        if count > 0:
+            _pins[key] = count
+            return False
+        _pins.pop(key, None)
+        return True
+
+
+def staging_dir(index_dir: str) -> Path:
+    """Fresh private directory for a build; publish_version() makes it live."""
+    path = Path(index_dir) / VERSIONS_DIR / (uuid.uuid4().hex + STAGING_SUFFIX)
+    path.mkdir(parents=True)
+    return path
+
+
+def publish_version(
+    index_dir: str,
+    staged: Path,
+    keep: int = DEFAULT_KEEP_VERSIONS,
+    legacy_chunks: Optional[str] = None,
+) -> Path:
+    """Move a finished staging dir into place and switch CURRENT to it atomically.
+
+    ``legacy_chunks`` is the chunk table a flat-layout index kept outside its
+    dir. It is removed with the other flat files, but only if this root held a
+    flat index: the path may be a default shared with other indexes.
+    """
+    root = Path(index_dir)
+    if not any((root / name).exists() for name in _FLAT_FILES):
+        legacy_chunks = None
+    header = read_header(str(staged))
+    final = root / VERSIONS_DIR / header["build_id"]
+    os.replace(str(staged), str(final))
+    tmp = root / (CURRENT_FILE + ".tmp")
+    tmp.write_text(header["build_id"], encoding="utf-8")
+    _replace_atomic(tmp, root / CURRENT_FILE)
+    gc_versions(index_dir, keep=keep, legacy_chunks=legacy_chunks)
+    return final
+
+
+def gc_versions(
+    index_dir: str,
+    keep: int = DEFAULT_KEEP_VERSIONS,
+    legacy_chunks: Optional[str] = None,
+) -> List[str]:
+    """Delete superseded versions that no reader in this process has pinned.
+
+    The ``keep`` newest superseded versions survive as well, so readers in
+    other processes that resolved CURRENT just before a switch can finish.
+    """
+    root = Path(index_dir)
+    versions = root / VERSIONS_DIR
+    live = current_build_id(index_dir)
+    if live is None or not versions.is_dir():
+        return []
+    now = time.time()
+    removed: List[str] = []
+    old: List[Path] = []
+    for path in versions.iterdir():
+        if path.name.endswith(STAGING_SUFFIX):
+            if now - path.stat().st_mtime > STAGING_MAX_AGE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        if path.name != live and path.is_dir():
+            old.append(path)
+    old.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    with _pins_lock:
+        for path in old[max(0, keep):]:
+            if _pin_key(path) in _pins:
+                continue
+            # ignore_errors: a file still mapped on Windows is retried by the next GC
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path.name)
+        if _pin_key(root) not in _pins:
+            # Leftovers of the flat layout this root used before its first versioned build
+            for name in _FLAT_FILES:
+                (root / name).unlink(missing_ok=True)
+            if legacy_chunks:
+                Path(legacy_chunks).unlink(missing_ok=True)
+    return removed
+
+
+def detect_format(index_dir: str) -> Optional[str]:
+    root = resolve_index_dir(index_dir)
+    if (root / HEADER_FILE).exists():
+        return FORMAT_BINARY
+    if (root / LEGACY_FILE).exists():
+        return FORMAT_JSONL
+    return None
+
+
+def read_header(index_dir: str) -> Dict[str, Any]:
+    header = json.loads((resolve_index_dir(index_dir) / HEADER_FILE).read_text(encoding="utf-8"))
+    if header.get("format") != INDEX_FORMAT:
+        raise ValueError(f"Not an index header: {index_dir}")
+    version = int(header.get("version", 0))
+    if version > INDEX_FORMAT_VERSION:
+        raise ValueError(
+            f"Index format version {version} is newer than supported ({INDEX_FORMAT_VERSION})"
+        )
+    return header
+
+
+def write_index(
+    index_dir: str,
+    ids: Sequence[str],
+    embeddings: Any,
+    *,
+    embedding_model: str,
+    max_len: Optional[int],
+    overlap: Optional[int],
+    normalized: bool = False,
+    ann: Optional[IVFIndex] = None,
+    lexical: Optional[LexicalIndex] = None,
+    quant: Optional[QuantizedIndex] = None,
+    build_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    root = Path(index_dir)
+    root.mkdir(parents=True, exist_ok=True)
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.size == 0:
+        matrix = matrix.reshape(len(ids), 0)
+    if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+        raise ValueError("Embeddings must be a (chunks, dim) matrix aligned with ids")
+    if not normalized:
+        matrix = normalize_rows(matrix)
+
+    header = {
+        "format": INDEX_FORMAT,
+        "version": INDEX_FORMAT_VERSION,
+        "build_id": build_id or uuid.uuid4().hex,
+        "created_at": _now_iso(),
+        "embedding_model": embedding_model,
+        "dim": int(matrix.shape[1]),
+        "count": int(matrix.shape[0]),
+        "dtype": "float32",
+        "normalized": True,
+        "chunking": {"max_len": max_len, "overlap": overlap},
+        "files": {"matrix": MATRIX_FILE, "ids": IDS_FILE},
+        "ann": None,
+        "lexical": None,
+        "quantization": None,
+    }
+
+    # Data files first, header last: a reader only trusts a dir with a header
+    _save_npy(root / MATRIX_FILE, matrix)
+    _save_npy(root / IDS_FILE, _encode_ids(ids))
+    if ann is not None:
+        _save_npy(root / IVF_CENTROIDS_FILE, ann.centroids)
+        _save_npy(root / IVF_ORDER_FILE, ann.order)
+        _save_npy(root / IVF_OFFSETS_FILE, ann.offsets)
+        header["ann"] = {"type": ANN_IVF, "nlist": ann.nlist, "nprobe": ann.nprobe}
+        header["files"].update({
+            "ivf_centroids": IVF_CENTROIDS_FILE,
+            "ivf_order": IVF_ORDER_FILE,
+            "ivf_offsets": IVF_OFFSETS_FILE,
+        })
+    else:
+        for name in (IVF_CENTROIDS_FILE, IVF_ORDER_FILE, IVF_OFFSETS_FILE):
+            (root / name).unlink(missing_ok=True)
+    if lexical is not None:
+        if len(lexical) != len(ids):
+            raise ValueError("Lexical index must cover the same rows as the embeddings")
+        _save_npy(root / LEX_TERMS_FILE, _encode_ids(lexical.terms))
+        _save_npy(root / LEX_OFFSETS_FILE, lexical.offsets)
+        _save_npy(root / LEX_POSTINGS_FILE, lexical.postings)
+        _save_npy(root / LEX_TFS_FILE, lexical.tfs)
+        _save_npy(root / LEX_DOC_LEN_FILE, lexical.doc_len)
+        header["lexical"] = {"type": LEXICAL_BM25, "k1": lexical.k1, "b": lexical.b, "terms": len(lexical.terms)}
+        header["files"].update({
+            "lex_terms": LEX_TERMS_FILE,
+            "lex_offsets": LEX_OFFSETS_FILE,
+            "lex_postings": LEX_POSTINGS_FILE,
+            "lex_tfs": LEX_TFS_FILE,
+            "lex_doc_len": LEX_DOC_LEN_FILE,
+        })
+    else:
+        for name in _LEX_FILES:
+            (root / name).unlink(missing_ok=True)
+    if quant is not None:
+        if len(quant) != len(ids):
+            raise ValueError("Quantized codes must cover the same rows as the embeddings")
+        _save_npy(root / QUANT_CODES_FILE, quant.codes)
+        header["files"]["quant_codes"] = QUANT_CODES_FILE
+        if quant.scale is not None:
+            _save_npy(root / QUANT_SCALE_FILE, quant.scale)
+            header["files"]["quant_scale"] = QUANT_SCALE_FILE
+        else:
+            (root / QUANT_SCALE_FILE).unlink(missing_ok=True)
+        header["quantization"] = {"type": quant.kind, "rescore": quant.rescore, "bytes": quant.nbytes}
+    else:
+        for name in (QUANT_CODES_FILE, QUANT_SCALE_FILE):
+            (root / name).unlink(missing_ok=True)
+    tmp = root / (HEADER_FILE + ".tmp")
+    tmp.write_text(json.dumps(header, ensure_ascii=False, indent=2), encoding="utf-8")
+    _replace_atomic(tmp, root / HEADER_FILE)
+    return header
+
+
+def open_index(index_dir: str, mmap: bool = True) -> VectorIndex:
+    root = resolve_index_dir(index_dir)
+    header = read_header(str(root))
+    files = header.get("files") or {}
+    mmap_mode = "r" if mmap and header.get("count") else None
+    matrix = np.load(str(root / files.get("matrix", MATRIX_FILE)), mmap_mode=mmap_mode, allow_pickle=False)
+    ids = _decode_ids(np.load(str(root / files.get("ids", IDS_FILE)), allow_pickle=False))
+    index = VectorIndex(ids, matrix, meta=header)
+
+    ann = header.get("ann") or {}
+    if ann.get("type") == ANN_IVF:
+        index.ann = IVFIndex(
+            centroids=np.load(str(root / files["ivf_centroids"]), allow_pickle=False),
+            order=np.load(str(root / files["ivf_order"]), allow_pickle=False),
+            offsets=np.load(str(root / files["ivf_offsets"]), allow_pickle=False),
+            nprobe=ann.get("nprobe"),
+        )
+
+    lexical = header.get("lexical") or {}
+    if lexical.get("type") == LEXICAL_BM25:
+        index.lexical = LexicalIndex(
+            terms=_decode_ids(np.load(str(root / files["lex_terms"]), allow_pickle=False)),
+            offsets=np.load(str(root / files["lex_offsets"]), allow_pickle=False),
+            postings=np.load(str(root / files["lex_postings"]), allow_pickle=False),
+            tfs=np.load(str(root / files["lex_tfs"]), allow_pickle=False),
+            doc_len=np.load(str(root / files["lex_doc_len"]), allow_pickle=False),
+            k1=lexical.get("k1", DEFAULT_K1),
+            b=lexical.get("b", DEFAULT_B),
+        )
+
+    quant = header.get("quantization") or {}
+    if quant.get("type") in QUANT_TYPES:
+        # The codes are scanned on every query, so they are read into memory;
+        # the float32 matrix stays mapped and is only touched for re-scoring
+        index.quant = QuantizedIndex(
+            quant["type"],
+            codes=np.load(str(root / files["quant_codes"]), allow_pickle=False),
+            scale=np.load(str(root / files["quant_scale"]), allow_pickle=False) if quant["type"] == QUANT_INT8 else None,
+            rescore=quant.get("rescore"),
+        )
+    return index
+
+
+def read_manifest(index_dir: str) -> Optional[Dict[str, Any]]:
+    path = resolve_index_dir(index_dir) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def write_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    root = Path(index_dir)
+    tmp = root / (MANIFEST_FILE + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    _replace_atomic(tmp, root / MANIFEST_FILE)
+
+
+def read_jsonl_embeddings(index_dir: str) -> Dict[str, List[float]]:
+    emb_path = Path(index_dir) / LEGACY_FILE
+    embeddings: Dict[str, List[float]] = {}
+    with emb_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            embeddings[row["chunk_id"]] = row["embedding"]
+    return embeddings
+
+
+def load_vectors(index_dir: str, mmap: bool = True) -> VectorIndex:
+    with pin_index(index_dir) as path:
+        fmt = detect_format(str(path))
+        if fmt == FORMAT_BINARY:
+            return open_index(str(path), mmap=mmap)
+        if fmt == FORMAT_JSONL:
+            return VectorIndex.from_embeddings(read_jsonl_embeddings(str(path)))
+    raise FileNotFoundError(f"No index found in: {index_dir}")
+
+
+def convert_jsonl_index(
+    index_dir: str,
+    *,
+    embedding_model: str = "unknown",
+    max_len: Optional[int] = None,
+    overlap: Optional[int] = None,
+    remove_jsonl: bool = False,
+) -> Dict[str, Any]:
+    embeddings = read_jsonl_embeddings(index_dir)
+    index = VectorIndex.from_embeddings(embeddings)
+    header = write_index(
+        index_dir,
+        index.ids,
+        index.matrix,
+        embedding_model=embedding_model,
+        max_len=max_len,
+        overlap=overlap,
+        normalized=True,
+    )
+    if remove_jsonl:
+        (Path(index_dir) / LEGACY_FILE).unlink(missing_ok=True)
+    return header
+
+
+def migrate_tree(
+    root: str,
+    *,
+    embedding_model: str = "unknown",
+    remove_jsonl: bool = False,
+) -> List[str]:
+    """Convert every legacy ``*/index`` dir under ``root`` (e.g. data/kbs) in place."""
+    converted: List[str] = []
+    for emb_path in sorted(Path(root).rglob(LEGACY_FILE)):
+        index_dir = str(emb_path.parent)
+        if detect_format(index_dir) != FORMAT_JSONL:
+            continue
+        convert_jsonl_index(index_dir, embedding_model=embedding_model, remove_jsonl=remove_jsonl)
+        converted.append(index_dir)
+    return converted
@@ -0,0 +1,150 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.vector_index import top_k
+
+
+LEXICAL_BM25 = "bm25"
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+# ASCII words keep joined identifiers (ERR-1042, v2.3.1, order_id) whole;
+# runs of CJK characters have no spaces and are split into bigrams
+_TOKEN_RE = re.compile(
+    r"[0-9a-z]+(?:[-_./:#][0-9a-z]+)*"
+    r"|[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+"
+)
+_PART_RE = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens for ASCII, character bigrams for CJK runs.
+
+    A joined identifier also yields its parts, so ``ERR-1042`` matches
+    queries for ``err-1042``, ``err`` or ``1042``.
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    out: List[str] = []
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group(0)
+        if token[0].isascii():
+            out.append(token)
+            parts = _PART_RE.findall(token)
+            if len(parts) > 1:
+                out.extend(parts)
+        elif len(token) == 1:
+            out.append(token)
+        else:
+            out.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return out
+
+
+class LexicalIndex:
+    """BM25 inverted index over the chunks of a KB.
+
+    Postings are stored as CSR arrays: the documents (matrix rows) of term
+    ``t`` are ``postings[offsets[t]:offsets[t + 1]]`` with term frequencies
+    in ``tfs`` at the same positions. Rows line up with the VectorIndex
+    built from the same chunks, so both indexes speak in row numbers.
+    """
+
+    def __init__(
+        self,
+        terms: Sequence[str],
+        offsets: np.ndarray,
+        postings: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = DEFAULT_K1,
+        b: float = DEFAULT_B,
+    ) -> None:
+        if offsets.shape[0] != len(terms) + 1:
+            raise ValueError("Lexical offsets must have one entry per term plus one")
+        self.terms: List[str] = list(terms)
+        self.offsets = offsets
+        self.postings = postings
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = float(k1)
+        self.b = float(b)
+        self._vocab: Dict[str, int] = {t: i for i, t in enumerate(self.terms)}
+        n = doc_len.shape[0]
+        avgdl = float(doc_len.mean()) if n else 0.0
+        # Per-document part of the BM25 denominator, computed once
+        if avgdl > 0:
+            self._norm = (self.k1 * (1.0 - self.b + self.b * doc_len / avgdl)).astype(np.float32)
+        else:
+            self._norm = np.full(n, self.k1, dtype=np.float32)
+
+    @classmethod
+    def build(cls, texts: Sequence[str], k1: float = DEFAULT_K1, b: float = DEFAULT_B) -> "LexicalIndex":
+        vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        docs: List[int] = []
+        freqs: List[int] = []
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                docs.append(doc)
+                freqs.append(tf)
+
+        tid = np.asarray(term_ids, dtype=np.int64)
+        # Stable sort keeps each posting list in ascending row order
+        order = np.argsort(tid, kind="stable")
+        counts = np.bincount(tid, minlength=len(vocab)) if tid.size else np.zeros(len(vocab), dtype=np.int64)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(
+            list(vocab),
+            offsets,
+            np.asarray(docs, dtype=np.int32)[order],
+            np.asarray(freqs, dtype=np.float32)[order],
+            doc_len,
+            k1=k1,
+            b=b,
+        )
+
+    def __len__(self) -> int:
+        return int(self.doc_len.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        term_bytes = sum(len(t) for t in self.terms) * 2
+        arrays = (self.offsets, self.postings, self.tfs, self.doc_len, self._norm)
+        return int(sum(a.nbytes for a in arrays)) + term_bytes
+
+    def scores(self, query: str) -> Optional[np.ndarray]:
+        """BM25 score of every row, or None when no query term is in the index."""
+        n = len(self)
+        scores: Optional[np.ndarray] = None
+        for term, qtf in Counter(tokenize(query)).items():
+            t = self._vocab.get(term)
+            if t is None:
+                continue
+            start, end = int(self.offsets[t]), int(self.offsets[t + 1])
+            docs = self.postings[start:end]
+            tf = self.tfs[start:end]
+            df = end - start
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            if scores is None:
+                scores = np.zeros(n, dtype=np.float32)
+            # Rows are unique within a posting list, so plain fancy-index add is safe
+            scores[docs] += np.float32(qtf * idf) * tf * (self.k1 + 1.0) / (tf + self._norm[docs])
+        return scores
+
+    def search(self, query: str, topk: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and scores of the best ``topk`` matches; rows that match no term are left out."""
+        scores = self.scores(query)
+        if scores is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = top_k(scores, max(1, topk))
+        rows = rows[scores[rows] > 0]
+        return rows, scores[rows]
@@ -1,6 +1,6 @@
 import json
 import re
-from client import get_client
+from client import get_async_client, get_client
 
 def safe_json_loads(text: str) -> dict:
     if text is None:
@@ -26,21 +26,252 @@ def safe_json_loads(text: str) -> dict:
 
     raise ValueError("No valid JSON found")
 
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from app.embedder import estimate_tokens
 from app.prompt_loader import load_prompt, render_prompt
+from app.rag import split_sections, split_with_overlap
+from app.rate_limiter import DEFAULT_OUTPUT_TOKENS, get_rate_limiter
+from app.result_cache import get_result_cache, prompt_hash
 # ... 你原来的 safe_json_loads 和 client 保持不变
 
-def process_text(text: str) -> dict:
-    client = get_client()
+TEXT_MODEL = "gpt-4o-mini"
+
+# 长文本（map-reduce）模式参数，可用环境变量覆盖
+DEFAULT_LONG_THRESHOLD = 8000
+DEFAULT_CHUNK_CHARS = 4000
+DEFAULT_CHUNK_OVERLAP = 200
+DEFAULT_MAP_WORKERS = 4
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        return default
+
+
+def _build_prompt(text: str) -> str:
     tpl = load_prompt("extract_all.json.md")
-    prompt = render_prompt(tpl, TEXT=text)
+    return render_prompt(tpl, TEXT=text)
 
-    r = client.responses.create(
-        model="gpt-4o-mini",
-        input=prompt
+
+def _complete(prompt: str) -> str:
+    client = get_client(max_retries=0)
+    r = get_rate_limiter().call(
+        TEXT_MODEL,
+        estimate_tokens(prompt) + DEFAULT_OUTPUT_TOKENS,
+        lambda: client.responses.create(
+            model=TEXT_MODEL,
+            input=prompt
+        ),
+    )
+    return r.output_text
+
+
+async def _complete_async(prompt: str) -> str:
+    client = get_async_client(max_retries=0)
+    r = await get_rate_limiter().call_async(
+        TEXT_MODEL,
+        estimate_tokens(prompt) + DEFAULT_OUTPUT_TOKENS,
+        lambda: client.responses.create(
+            model=TEXT_MODEL,
+            input=prompt
+        ),
     )
+    return r.output_text
+
+
+def split_long_text(text: str, chunk_chars: int, overlap: int) -> List[str]:
+    """按章节切分，超长章节再按字符窗口切分，随后把相邻小段合并到 chunk_chars 以内。"""
+    pieces: List[str] = []
+    for section in split_sections(text):
+        pieces.extend(split_with_overlap(section, max_len=chunk_chars, overlap=overlap))
+
+    chunks: List[str] = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + 2 + len(piece) <= chunk_chars:
+            chunks[-1] = chunks[-1] + "\n\n" + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def _use_long_mode(text: str, long_mode: Optional[bool]) -> bool:
+    if long_mode is not None:
+        return long_mode
+    return len(text) > _env_int("PROCESS_LONG_THRESHOLD", DEFAULT_LONG_THRESHOLD)
+
+
+def _long_options(chunk_chars: Optional[int], max_workers: Optional[int]):
+    chunk_chars = chunk_chars or _env_int("PROCESS_CHUNK_CHARS", DEFAULT_CHUNK_CHARS)
+    overlap = min(_env_int("PROCESS_CHUNK_OVERLAP", DEFAULT_CHUNK_OVERLAP), chunk_chars // 4)
+    max_workers = max_workers or _env_int("PROCESS_MAP_WORKERS", DEFAULT_MAP_WORKERS)
+    return chunk_chars, overlap, max(1, max_workers)
+
+
+def _cache_prompt_hash(long: bool) -> str:
+    # 结果取决于模板与切分参数；模板修改后旧缓存自然不再命中
+    if not long:
+        return prompt_hash(load_prompt("extract_all.json.md"))
+    chunk_chars, overlap, _ = _long_options(None, None)
+    return prompt_hash(
+        load_prompt("extract_all.json.md"),
+        load_prompt("reduce_all.json.md"),
+        f"chunk={chunk_chars}:{overlap}",
+    )
+
+
+def process_text(text: str, long_mode: Optional[bool] = None, use_cache: bool = True) -> dict:
+    """long_mode=None 时按 PROCESS_LONG_THRESHOLD 自动选择单次调用或 map-reduce。"""
+    return process_text_cached(text, long_mode=long_mode, use_cache=use_cache)[0]
+
+
+async def process_text_async(text: str, long_mode: Optional[bool] = None, use_cache: bool = True) -> dict:
+    return (await process_text_cached_async(text, long_mode=long_mode, use_cache=use_cache))[0]
+
+
+def process_text_cached(
+    text: str,
+    long_mode: Optional[bool] = None,
+    use_cache: bool = True,
+) -> Tuple[dict, bool]:
+    """返回 (结果, 是否命中结果缓存)；use_cache=False 时既不读也不写缓存。"""
+    long = _use_long_mode(text, long_mode)
+    cache = get_result_cache() if use_cache else None
+    if cache is not None:
+        key = _cache_prompt_hash(long)
+        hit = cache.get(key, TEXT_MODEL, text)
+        if hit is not None:
+            return hit, True
+
+    if long:
+        result = process_text_long(text)
+    else:
+        result = _normalize_result(safe_json_loads(_complete(_build_prompt(text))))
+
+    if cache is not None:
+        cache.put(key, TEXT_MODEL, text, result)
+    return result, False
+
+
+async def process_text_cached_async(
+    text: str,
+    long_mode: Optional[bool] = None,
+    use_cache: bool = True,
+) -> Tuple[dict, bool]:
+    long = _use_long_mode(text, long_mode)
+    cache = get_result_cache() if use_cache else None
+    if cache is not None:
+        key = _cache_prompt_hash(long)
+        hit = await asyncio.to_thread(cache.get, key, TEXT_MODEL, text)
+        if hit is not None:
+            return hit, True
+
+    if long:
+        result = await process_text_long_async(text)
+    else:
+        result = _normalize_result(safe_json_loads(await _complete_async(_build_prompt(text))))
+
+    if cache is not None:
+        await asyncio.to_thread(cache.put, key, TEXT_MODEL, text, result)
+    return result, False
+
+
+def process_text_long(
+    text: str,
+    chunk_chars: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> dict:
+    """Map：各片段并行抽取；Reduce：合并摘要、关键词与实体。"""
+    chunk_chars, overlap, max_workers = _long_options(chunk_chars, max_workers)
+    chunks = split_long_text(text, chunk_chars, overlap)
+    if len(chunks) <= 1:
+        return _normalize_result(safe_json_loads(_complete(_build_prompt(text))))
+
+    def extract(chunk: str) -> dict:
+        return _normalize_result(safe_json_loads(_complete(_build_prompt(chunk))))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        partials = list(pool.map(extract, chunks))
+
+    reduced = safe_json_loads(_complete(_build_reduce_prompt(partials)))
+    return _merge_partials(reduced, partials)
+
+
+async def process_text_long_async(
+    text: str,
+    chunk_chars: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> dict:
+    chunk_chars, overlap, max_workers = _long_options(chunk_chars, max_workers)
+    chunks = split_long_text(text, chunk_chars, overlap)
+    if len(chunks) <= 1:
+        return _normalize_result(safe_json_loads(await _complete_async(_build_prompt(text))))
+
+    sem = asyncio.Semaphore(max_workers)
+
+    async def extract(chunk: str) -> dict:
+        async with sem:
+            return _normalize_result(safe_json_loads(await _complete_async(_build_prompt(chunk))))
+
+    partials = await asyncio.gather(*(extract(c) for c in chunks))
+
+    reduced = safe_json_loads(await _complete_async(_build_reduce_prompt(partials)))
+    return _merge_partials(reduced, partials)
+
+
+def _build_reduce_prompt(partials: List[dict]) -> str:
+    parts = [
+        {
+            "part": i + 1,
+            "summary_short": p["summary_short"],
+            "summary_bullets": p["summary_bullets"],
+            "topic": p["topic"],
+            "sentiment": p["sentiment"],
+            "keywords": p["keywords"],
+        }
+        for i, p in enumerate(partials)
+    ]
+    tpl = load_prompt("reduce_all.json.md")
+    return render_prompt(tpl, PARTS=json.dumps(parts, ensure_ascii=False, indent=2))
+
+
+def _unique(values) -> list:
+    out = []
+    for v in values:
+        if v and v not in out:
+            out.append(v)
+    return out
+
+
+def _merge_partials(reduced: dict, partials: List[dict]) -> dict:
+    # 实体与改写由代码合并：实体取并集（时间/地点取首个非空），改写按片段顺序拼接
+    ents = [p["entities"] for p in partials]
+    merged = {
+        "summary_short": reduced.get("summary_short") or partials[0]["summary_short"],
+        "summary_bullets": reduced.get("summary_bullets") or partials[0]["summary_bullets"],
+        "topic": reduced.get("topic") or partials[0]["topic"],
+        "sentiment": reduced.get("sentiment") or partials[0]["sentiment"],
+        "keywords": reduced.get("keywords") or _unique(k for p in partials for k in (p["keywords"] or []))[:3],
+        "entities": {
+            "time": next((e["time"] for e in ents if e["time"]), None),
+            "location": next((e["location"] for e in ents if e["location"]), None),
+            "people": _unique(x for e in ents for x in (e["people"] or [])),
+            "orgs": _unique(x for e in ents for x in (e["orgs"] or [])),
+        },
+        "rewrite_formal": "\n\n".join(str(p["rewrite_formal"]).strip() for p in partials if p["rewrite_formal"]),
+    }
+    return _normalize_result(merged)
 
-    obj = safe_json_loads(r.output_text)
 
+def _normalize_result(obj: dict) -> dict:
     # 兜底（你已有就保留）
     obj.setdefault("summary_short", "")
     obj.setdefault("summary_bullets", [])
@@ -0,0 +1,120 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.vector_index import top_k
+
+
+QUANT_INT8 = "int8"
+QUANT_BINARY = "binary"
+QUANT_TYPES = (QUANT_INT8, QUANT_BINARY)
+# The quantized scan keeps topk * rescore candidates for the float re-score
+DEFAULT_RESCORE = {QUANT_INT8: 4, QUANT_BINARY: 16}
+# Small int8 blocks keep the widened float32 copy in cache
+INT8_BLOCK_ROWS = 256
+BINARY_BLOCK_ROWS = 2048
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount_rows(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[x].sum(axis=1, dtype=np.int32)
+
+
+def _as_words(bits: np.ndarray) -> np.ndarray:
+    # Popcount over 64-bit words is several times faster than over bytes
+    if bits.shape[-1] % 8 == 0 and bits.flags.c_contiguous and hasattr(np, "bitwise_count"):
+        return bits.view(np.uint64)
+    return bits
+
+
+class QuantizedIndex:
+    """Compact copy of a normalized embedding matrix used to shortlist rows.
+
+    ``int8`` stores each dimension as a signed byte with a per-dimension
+    scale (4x smaller than float32); ``binary`` keeps only the sign bit and
+    ranks by Hamming distance (32x smaller). Either way the shortlist is
+    re-scored against the float32 rows, which stay on disk and are only
+    paged in for the candidates.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        codes: np.ndarray,
+        scale: Optional[np.ndarray] = None,
+        rescore: Optional[int] = None,
+    ) -> None:
+        if kind not in QUANT_TYPES:
+            raise ValueError(f"Unsupported quantization: {kind}")
+        if kind == QUANT_INT8 and scale is None:
+            raise ValueError("int8 quantization needs a per-dimension scale")
+        self.kind = kind
+        self.codes = codes
+        self.scale = scale
+        self.rescore = max(1, int(rescore or DEFAULT_RESCORE[kind]))
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, kind: str, rescore: Optional[int] = None) -> "QuantizedIndex":
+        if kind not in QUANT_TYPES:
+            raise ValueError(f"Unsupported quantization: {kind}")
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if kind == QUANT_BINARY:
+            return cls(kind, np.packbits(matrix > 0, axis=1), rescore=rescore)
+        scale = np.ones(matrix.shape[1], dtype=np.float32)
+        if matrix.shape[0]:
+            scale = (np.abs(matrix).max(axis=0) / 127.0).astype(np.float32)
+            # Dimensions that are zero everywhere quantize to 0 with any scale
+            scale[scale == 0.0] = 1.0
+        codes = np.clip(np.rint(matrix / scale), -127, 127).astype(np.int8)
+        return cls(kind, codes, scale=scale, rescore=rescore)
+
+    def __len__(self) -> int:
+        return int(self.codes.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes) + (int(self.scale.nbytes) if self.scale is not None else 0)
+
+    def approx_scores(self, q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Higher is closer: dot product for int8, negated Hamming distance for binary.
+
+        With ``rows`` (e.g. IVF candidates) only those rows are scored, in that order.
+        """
+        codes = self.codes if rows is None else self.codes[rows]
+        n = int(codes.shape[0])
+        out = np.empty(n, dtype=np.float32)
+        if self.kind == QUANT_BINARY:
+            codes = _as_words(np.asarray(codes))
+            qbits = np.packbits(q > 0)
+            qbits = qbits.view(codes.dtype) if codes.dtype != np.uint8 else qbits
+            for start in range(0, n, BINARY_BLOCK_ROWS):
+                block = codes[start:start + BINARY_BLOCK_ROWS]
+                out[start:start + block.shape[0]] = -_popcount_rows(block ^ qbits)
+            return out
+        qs = (q * self.scale).astype(np.float32)
+        for start in range(0, n, INT8_BLOCK_ROWS):
+            block = np.asarray(codes[start:start + INT8_BLOCK_ROWS])
+            out[start:start + block.shape[0]] = block.astype(np.float32) @ qs
+        return out
+
+    def search(
+        self,
+        matrix: np.ndarray,
+        q: np.ndarray,
+        topk: int,
+        rescore: Optional[int] = None,
+        rows: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        shortlist = top_k(self.approx_scores(q, rows), topk * max(1, rescore or self.rescore))
+        if rows is not None:
+            shortlist = rows[shortlist]
+        if shortlist.size == 0:
+            return shortlist, np.empty(0, dtype=np.float32)
+        # Sorted row order keeps the mmap reads sequential
+        rows = np.sort(shortlist)
+        scores = np.asarray(matrix[rows]) @ q
+        best = top_k(scores, topk)
+        return rows[best], scores[best]
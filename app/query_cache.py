@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.sqlite_local import LocalConnections
+
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+# Expired rows on disk are deleted at most this often; reads skip them by TTL anyway
+PRUNE_INTERVAL_SECONDS = 10 * 60
+# On overflow, evict the disk table down to this fraction of max_entries so eviction is amortized
+EVICT_TO_RATIO = 0.9
+
+CacheKey = Tuple[str, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_embeddings (
+    model TEXT NOT NULL,
+    question TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    created_ts REAL NOT NULL,
+    PRIMARY KEY (model, question)
+);
+CREATE INDEX IF NOT EXISTS idx_query_embeddings_created
+    ON query_embeddings (created_ts);
+"""
+
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFKC", question or "")
+    return " ".join(text.split()).casefold()
+
+
+class QueryEmbeddingCache:
+    """LRU + TTL cache of question embeddings keyed by (model, normalized question).
+
+    With ``path`` set, entries are also written to a SQLite file so a
+    restarted worker (or an ``eval_qa.py`` rerun) starts warm; the file keeps
+    at most ``max_entries`` rows as well, oldest evicted first.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        path: Optional[Path] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = Path(path) if path else None
+        self._entries: "OrderedDict[CacheKey, Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = LocalConnections(self.path, _SCHEMA) if self.path else None
+        self._last_prune = 0.0
+        # Rows in the file as of the last exact count plus puts since; None until first write
+        self._approx_count: Optional[int] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._miss_ms_total = 0.0
+        self._miss_timed = 0
+
+    def _read_disk(self, key: CacheKey, now: float) -> Optional[Tuple[float, List[float]]]:
+        row = self._disk.get().execute(
+            "SELECT vector, created_ts FROM query_embeddings WHERE model = ? AND question = ?",
+            key,
+        ).fetchone()
+        if not row or now - row[1] > self.ttl_seconds:
+            return None
+        return row[1], np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def _write_disk(self, key: CacheKey, created: float, vector: Sequence[float], prune: bool) -> None:
+        conn = self._disk.get()
+        conn.execute(
+            "INSERT OR REPLACE INTO query_embeddings (model, question, vector, created_ts) VALUES (?, ?, ?, ?)",
+            (key[0], key[1], np.asarray(vector, dtype=np.float32).tobytes(), created),
+        )
+        if prune:
+            conn.execute(
+                "DELETE FROM query_embeddings WHERE created_ts < ?",
+                (created - self.ttl_seconds,),
+            )
+        conn.commit()
+        with self._lock:
+            if self._approx_count is None or prune:
+                self._approx_count = conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+            else:
+                # Counts replaced rows too, so it only ever overestimates
+                self._approx_count += 1
+            if self._approx_count <= self.max_entries:
+                return
+            self._approx_count = self._evict_disk(conn, created)
+
+    def _evict_disk(self, conn, now: float) -> int:
+        """Exact count and eviction, run only once the approximate count passes the cap."""
+        conn.execute("DELETE FROM query_embeddings WHERE created_ts < ?", (now - self.ttl_seconds,))
+        count = conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        excess = count - int(self.max_entries * EVICT_TO_RATIO)
+        if count > self.max_entries and excess > 0:
+            conn.execute(
+                """
+                DELETE FROM query_embeddings WHERE rowid IN (
+                    SELECT rowid FROM query_embeddings ORDER BY created_ts ASC LIMIT ?
+                )
+                """,
+                (excess,),
+            )
+            count -= excess
+        conn.commit()
+        return count
+
+    def _store(self, key: CacheKey, created: float, vector: List[float]) -> None:
+        self._entries[key] = (created, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, model: str, question: str) -> Optional[List[float]]:
+        key = (model, normalize_question(question))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        # Disk I/O runs outside the lock so concurrent lookups are not serialized behind it
+        disk = self._read_disk(key, now) if self._disk is not None else None
+        with self._lock:
+            if disk is not None:
+                self._store(key, disk[0], disk[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return disk[1]
+            self.misses += 1
+        return None
+
+    def put(self, model: str, question: str, vector: Sequence[float], elapsed_ms: Optional[float] = None) -> None:
+        key = (model, normalize_question(question))
+        now = time.time()
+        vec = list(vector)
+        with self._lock:
+            self._store(key, now, vec)
+            if elapsed_ms is not None:
+                self._miss_ms_total += elapsed_ms
+                self._miss_timed += 1
+            prune = now - self._last_prune >= PRUNE_INTERVAL_SECONDS
+            if prune:
+                self._last_prune = now
+        if self._disk is not None:
+            self._write_disk(key, now, vec, prune)
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_miss_ms = (self._miss_ms_total / self._miss_timed) if self._miss_timed else 0.0
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persist_path": str(self.path) if self.path else None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "avg_miss_ms": avg_miss_ms,
+                # Each hit skipped one embeddings round trip of roughly avg_miss_ms
+                "saved_ms_estimate": avg_miss_ms * self.hits,
+            }
+
+
+_caches: Dict[Tuple, QueryEmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+def get_query_cache() -> Optional[QueryEmbeddingCache]:
+    """Process-wide cache from QUERY_CACHE_MAX_ENTRIES / _TTL_SECONDS / _PATH (0 entries disables)."""
+    max_entries = int(_env_number("QUERY_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    if max_entries <= 0:
+        return None
+    ttl = _env_number("QUERY_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)
+    path = os.getenv("QUERY_CACHE_PATH") or None
+    config = (max_entries, ttl, path)
+    with _caches_lock:
+        cache = _caches.get(config)
+        if cache is None:
+            cache = QueryEmbeddingCache(max_entries=max_entries, ttl_seconds=ttl, path=path)
+            _caches[config] = cache
+        return cache
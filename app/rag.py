@@ -1,12 +1,56 @@
-﻿import json
+﻿import asyncio
+import hashlib
+import json
 import math
+import shutil
+import threading
+import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
-from client import get_client
-from app.prompt_loader import load_prompt, render_prompt
+import numpy as np
 
+from client import get_async_client, get_client
+from app.prompt_loader import load_prompt, render_prompt
+from app.ann import ANN_IVF, DEFAULT_ANN_MIN_CHUNKS, IVFIndex
+from app.embed_cache import EmbeddingCache, get_embedding_cache
+from app.embedder import DEFAULT_MAX_BATCH_TOKENS, DEFAULT_MAX_IN_FLIGHT, embed_concurrent, estimate_tokens
+from app.query_cache import get_query_cache
+from app.rate_limiter import DEFAULT_OUTPUT_TOKENS, get_rate_limiter
+from app.index_store import (
+    CHUNKS_FILE,
+    DEFAULT_KEEP_VERSIONS,
+    FORMAT_BINARY,
+    detect_format,
+    load_vectors,
+    pin_index,
+    publish_version,
+    read_manifest,
+    staging_dir,
+    write_index,
+    write_manifest,
+)
+from app.lexical_index import LexicalIndex
+from app.quantize import QUANT_TYPES, QuantizedIndex
+from app.vector_index import VectorIndex, normalize_rows, normalize_vector
+
+
+# Keep at most this many tombstoned chunk ids in the file manifest
+MAX_TOMBSTONES = 10000
+
+RETRIEVAL_VECTOR = "vector"
+RETRIEVAL_HYBRID = "hybrid"
+RETRIEVAL_LEXICAL = "lexical"
+RETRIEVAL_MODES = (RETRIEVAL_VECTOR, RETRIEVAL_HYBRID, RETRIEVAL_LEXICAL)
+# k in reciprocal rank fusion: 1 / (k + rank); 60 is the usual choice
+DEFAULT_RRF_K = 60
+# Each ranked list feeds this many candidates per requested chunk into the fusion
+HYBRID_CANDIDATES_PER_RESULT = 4
+
+# build_index reports partial progress dicts (stage, files_*, chunks_*) to this callback;
+# it may be called from embedding worker threads
+ProgressFn = Callable[[Dict[str, Any]], None]
 
 
 @dataclass
@@ -33,7 +77,7 @@ def load_kb_files(kb_dir: str) -> List[Tuple[Path, str]]:
         raise FileNotFoundError(f"KB dir not found: {kb_dir}")
 
     files: List[Tuple[Path, str]] = []
-    for p in root.rglob("*"):
+    for p in sorted(root.rglob("*")):
         if not p.is_file():
             continue
         if p.suffix.lower() not in {".md", ".txt"}:
@@ -93,6 +137,14 @@ def split_with_overlap(text: str, max_len: int, overlap: int) -> List[str]:
     return out
 
 
+def chunk_text(text: str, max_len: int, overlap: int) -> List[Tuple[int, str]]:
+    out: List[Tuple[int, str]] = []
+    for section_id, section in enumerate(split_sections(text)):
+        for piece in split_with_overlap(section, max_len=max_len, overlap=overlap):
+            out.append((section_id, piece))
+    return out
+
+
 def build_chunks(kb_dir: str, max_len: int, overlap: int) -> List[Chunk]:
     chunks: List[Chunk] = []
     files = load_kb_files(kb_dir)
@@ -100,28 +152,148 @@ def build_chunks(kb_dir: str, max_len: int, overlap: int) -> List[Chunk]:
     idx = 0
     for path, text in files:
         rel = path.relative_to(kb_dir).as_posix()
-        sections = split_sections(text)
-        for section_id, section in enumerate(sections):
-            pieces = split_with_overlap(section, max_len=max_len, overlap=overlap)
-            for piece in pieces:
-                chunk_id = f"chunk_{idx:06d}"
-                chunks.append(Chunk(
-                    chunk_id=chunk_id,
-                    source_file=rel,
-                    section_id=section_id,
-                    text=piece,
-                ))
-                idx += 1
+        for section_id, piece in chunk_text(text, max_len=max_len, overlap=overlap):
+            chunk_id = f"chunk_{idx:06d}"
+            chunks.append(Chunk(
+                chunk_id=chunk_id,
+                source_file=rel,
+                section_id=section_id,
+                text=piece,
+            ))
+            idx += 1
     return chunks
 
 
 def _embed_texts(texts: List[str], model: str) -> List[List[float]]:
-    client = get_client()
-    resp = client.embeddings.create(model=model, input=texts)
+    client = get_client(max_retries=0)
+    resp = get_rate_limiter().call(
+        model,
+        sum(estimate_tokens(t) for t in texts),
+        lambda: client.embeddings.create(model=model, input=texts),
+    )
     # Keep input order
     return [item.embedding for item in resp.data]
 
 
+def embed_query(question: str, model: str) -> List[float]:
+    cache = get_query_cache()
+    if cache is not None:
+        cached = cache.get(model, question)
+        if cached is not None:
+            return cached
+
+    start = time.perf_counter()
+    q_emb = _embed_texts([question], model=model)[0]
+    if cache is not None:
+        cache.put(model, question, q_emb, elapsed_ms=(time.perf_counter() - start) * 1000)
+    return q_emb
+
+
+async def _embed_texts_async(texts: List[str], model: str) -> List[List[float]]:
+    client = get_async_client(max_retries=0)
+    resp = await get_rate_limiter().call_async(
+        model,
+        sum(estimate_tokens(t) for t in texts),
+        lambda: client.embeddings.create(model=model, input=texts),
+    )
+    return [item.embedding for item in resp.data]
+
+
+async def embed_query_async(question: str, model: str) -> List[float]:
+    cache = get_query_cache()
+    # The cache may hit SQLite when QUERY_CACHE_PATH is set, so keep it off the event loop
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, model, question)
+        if cached is not None:
+            return cached
+
+    start = time.perf_counter()
+    q_emb = (await _embed_texts_async([question], model=model))[0]
+    if cache is not None:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        await asyncio.to_thread(cache.put, model, question, q_emb, elapsed_ms)
+    return q_emb
+
+
+def _embed_with_cache(
+    texts: List[str],
+    model: str,
+    batch_size: int,
+    cache: Optional[EmbeddingCache],
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[List[Sequence[float]], int]:
+    """Embed ``texts`` through the cache; ``on_progress(done, cached)`` gets running totals."""
+    vectors: List[Optional[Sequence[float]]] = (
+        list(cache.get_many(model, texts)) if cache else [None] * len(texts)
+    )
+    hits = sum(1 for v in vectors if v is not None)
+
+    # Identical chunk text inside one build is embedded once as well
+    missing: Dict[str, List[int]] = {}
+    for pos, vec in enumerate(vectors):
+        if vec is None:
+            missing.setdefault(texts[pos], []).append(pos)
+    todo = list(missing)
+    done = [hits]
+    done_lock = threading.Lock()
+    if on_progress:
+        on_progress(hits, hits)
+
+    def on_batch(batch: List[str], embs: List[List[float]]) -> None:
+        if cache:
+            cache.put_many(model, batch, embs)
+        if on_progress:
+            # Batches finish on several embedding threads at once
+            with done_lock:
+                done[0] += sum(len(missing[text]) for text in batch)
+                total = done[0]
+            on_progress(total, hits)
+
+    embeddings = embed_concurrent(
+        todo,
+        model,
+        embed_fn=_embed_texts,
+        max_in_flight=max_in_flight,
+        max_batch_tokens=max_batch_tokens,
+        max_batch_items=batch_size,
+        on_batch=on_batch if (cache or on_progress) else None,
+    )
+    for text, emb in zip(todo, embeddings):
+        for pos in missing[text]:
+            vectors[pos] = emb
+    return vectors, hits
+
+
+def _sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _load_previous_build(
+    index_dir: str,
+    chunks_path: str,
+    embedding_model: str,
+    max_len: int,
+    overlap: int,
+) -> Optional[Tuple[Dict[str, Any], Dict[str, Chunk], VectorIndex]]:
+    manifest = read_manifest(index_dir)
+    if not manifest:
+        return None
+    same_params = (
+        manifest.get("embedding_model") == embedding_model
+        and manifest.get("max_len") == max_len
+        and manifest.get("overlap") == overlap
+    )
+    if not same_params or detect_format(index_dir) != FORMAT_BINARY:
+        return None
+    try:
+        chunks, vectors = load_index(index_dir=index_dir, chunks_path=chunks_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    return manifest, chunks, vectors
+
+
 def build_index(
     kb_dir: str,
     index_dir: str = "data/index",
@@ -129,66 +301,234 @@ def build_index(
     embedding_model: str = "text-embedding-3-small",
     max_len: int = 800,
     overlap: int = 120,
-    batch_size: int = 16,
-) -> Dict[str, int]:
-    chunks = build_chunks(kb_dir=kb_dir, max_len=max_len, overlap=overlap)
+    batch_size: int = 128,
+    ann: Optional[str] = None,
+    ann_min_chunks: int = DEFAULT_ANN_MIN_CHUNKS,
+    ivf_nlist: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    quantize: Optional[str] = None,
+    rescore: Optional[int] = None,
+    incremental: bool = False,
+    use_embed_cache: bool = True,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+    progress: Optional[ProgressFn] = None,
+    keep_versions: int = DEFAULT_KEEP_VERSIONS,
+) -> Dict[str, Any]:
+    """Build the KB index as a new version under ``index_dir`` and publish it.
+
+    ``chunks_path`` is only read, to reuse a previous flat-layout build, and
+    removed once that build is superseded; the chunks of a versioned build
+    live next to its vectors.
+    """
+    if ann not in (None, "", ANN_IVF):
+        raise ValueError(f"Unsupported ann type: {ann}")
+    if quantize not in (None, "", *QUANT_TYPES):
+        raise ValueError(f"Unsupported quantization: {quantize}")
 
     index_path = Path(index_dir)
     index_path.mkdir(parents=True, exist_ok=True)
 
-    chunks_out = [
-        {
-            "chunk_id": c.chunk_id,
-            "source_file": c.source_file,
-            "section_id": c.section_id,
-            "text": c.text,
-        }
-        for c in chunks
-    ]
-    Path(chunks_path).write_text(
-        json.dumps(chunks_out, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    prev = None
+    if incremental:
+        prev = _load_previous_build(index_dir, chunks_path, embedding_model, max_len, overlap)
+    prev_manifest, prev_chunks, prev_vectors = prev if prev else ({}, {}, None)
+    prev_files: Dict[str, Dict[str, Any]] = prev_manifest.get("files", {})
+    next_seq = int(prev_manifest.get("next_chunk_seq", 0))
+    tombstones: List[str] = list(prev_manifest.get("tombstones", []))
 
-    emb_path = index_path / "embeddings.jsonl"
-    with emb_path.open("w", encoding="utf-8") as f:
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i + batch_size]
-            texts = [c.text for c in batch]
-            embeddings = _embed_texts(texts, model=embedding_model)
-            for c, emb in zip(batch, embeddings):
-                row = {"chunk_id": c.chunk_id, "embedding": emb}
-                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    chunks: List[Chunk] = []
+    reused_rows: Dict[int, int] = {}
+    pending: List[int] = []
+    file_entries: Dict[str, Dict[str, Any]] = {}
+    counts = {"files_added": 0, "files_changed": 0, "files_removed": 0, "files_unchanged": 0}
 
-    return {"chunks": len(chunks)}
+    for path, text in load_kb_files(kb_dir):
+        rel = path.relative_to(kb_dir).as_posix()
+        digest = _sha256_text(text)
+        old = prev_files.get(rel)
+        old_ids: List[str] = old.get("chunk_ids", []) if old else []
+        reusable = (
+            old is not None
+            and old.get("sha256") == digest
+            and all(cid in prev_chunks and cid in prev_vectors for cid in old_ids)
+        )
+        if reusable:
+            for cid in old_ids:
+                reused_rows[len(chunks)] = prev_vectors.row_of(cid)
+                chunks.append(prev_chunks[cid])
+            file_entries[rel] = {"sha256": digest, "chunk_ids": old_ids}
+            counts["files_unchanged"] += 1
+            continue
+
+        if old is not None:
+            counts["files_changed"] += 1
+            tombstones.extend(old_ids)
+        else:
+            counts["files_added"] += 1
+        ids: List[str] = []
+        for section_id, piece in chunk_text(text, max_len=max_len, overlap=overlap):
+            chunk_id = f"chunk_{next_seq:06d}"
+            next_seq += 1
+            pending.append(len(chunks))
+            chunks.append(Chunk(
+                chunk_id=chunk_id,
+                source_file=rel,
+                section_id=section_id,
+                text=piece,
+            ))
+            ids.append(chunk_id)
+        file_entries[rel] = {"sha256": digest, "chunk_ids": ids}
+
+    for rel, old in prev_files.items():
+        if rel not in file_entries:
+            counts["files_removed"] += 1
+            tombstones.extend(old.get("chunk_ids", []))
+
+    if progress:
+        progress({
+            "stage": "embedding",
+            "files_total": len(file_entries),
+            "files_changed": counts["files_added"] + counts["files_changed"],
+            "chunks_total": len(chunks),
+            "chunks_to_embed": len(pending),
+            "chunks_embedded": 0,
+        })
+    embed_cache = get_embedding_cache() if use_embed_cache else None
+    vectors, cache_hits = _embed_with_cache(
+        [chunks[pos].text for pos in pending],
+        model=embedding_model,
+        batch_size=batch_size,
+        cache=embed_cache,
+        max_in_flight=max_in_flight,
+        max_batch_tokens=max_batch_tokens,
+        on_progress=(lambda n, cached: progress({"chunks_embedded": n, "chunks_cached": cached})) if progress else None,
+    )
+    if progress:
+        progress({"stage": "writing"})
+
+    new_matrix: Optional[np.ndarray] = None
+    if pending:
+        new_matrix = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    dim = 0
+    if new_matrix is not None:
+        dim = new_matrix.shape[1]
+    elif reused_rows:
+        dim = prev_vectors.dim
+    if reused_rows and prev_vectors.dim != dim:
+        raise ValueError("Embedding dimension changed; rebuild the index without incremental mode")
+
+    matrix = np.zeros((len(chunks), dim), dtype=np.float32)
+    if reused_rows:
+        positions = np.fromiter(reused_rows.keys(), dtype=np.int64, count=len(reused_rows))
+        rows = np.fromiter(reused_rows.values(), dtype=np.int64, count=len(reused_rows))
+        # Copy out of the mmap before the old files are replaced
+        matrix[positions] = np.asarray(prev_vectors.matrix[rows])
+    if new_matrix is not None:
+        matrix[np.asarray(pending, dtype=np.int64)] = new_matrix
+    prev_vectors = None
+
+    ivf: Optional[IVFIndex] = None
+    # Small KBs stay on exact search; IVF only pays off at scale
+    if ann == ANN_IVF and len(chunks) >= max(1, ann_min_chunks):
+        ivf = IVFIndex.build(matrix, nlist=ivf_nlist, nprobe=nprobe)
+    # Tokenizing is cheap next to embedding, so the BM25 index is always rebuilt in full
+    lexical = LexicalIndex.build([c.text for c in chunks])
+    quant: Optional[QuantizedIndex] = None
+    if quantize:
+        quant = QuantizedIndex.build(matrix, quantize, rescore=rescore)
+
+    if progress:
+        progress({"stage": "publishing"})
+    # The whole build (vectors, chunks, manifest) goes to a private dir and becomes
+    # live with one atomic CURRENT switch: readers never see a half-written pair
+    staged = staging_dir(str(index_path))
+    try:
+        header = write_index(
+            str(staged),
+            [c.chunk_id for c in chunks],
+            matrix,
+            embedding_model=embedding_model,
+            max_len=max_len,
+            overlap=overlap,
+            normalized=True,
+            ann=ivf,
+            lexical=lexical,
+            quant=quant,
+        )
+        chunks_out = [
+            {
+                "chunk_id": c.chunk_id,
+                "source_file": c.source_file,
+                "section_id": c.section_id,
+                "text": c.text,
+            }
+            for c in chunks
+        ]
+        (staged / CHUNKS_FILE).write_text(
+            json.dumps(chunks_out, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+        write_manifest(str(staged), {
+            "embedding_model": embedding_model,
+            "max_len": max_len,
+            "overlap": overlap,
+            "next_chunk_seq": next_seq,
+            "files": file_entries,
+            # Ids of chunks dropped from the index; ids are never reissued
+            "tombstones": tombstones[-MAX_TOMBSTONES:],
+        })
+        publish_version(str(index_path), staged, keep=keep_versions, legacy_chunks=chunks_path)
+    except BaseException:
+        shutil.rmtree(staged, ignore_errors=True)
+        raise
+
+    stats: Dict[str, Any] = {
+        "build_id": header["build_id"],
+        "chunks": len(chunks),
+        "ann": None,
+        "quantization": None,
+        "mode": "incremental" if prev else "full",
+        "chunks_embedded": len(pending),
+        "chunks_reused": len(reused_rows),
+        **counts,
+        "embed_cache_hits": cache_hits,
+        "embed_cache_misses": len(pending) - cache_hits,
+        "embed_cache_hit_rate": (cache_hits / len(pending)) if pending else 0.0,
+    }
+    if ivf is not None:
+        stats["ann"] = {"type": ANN_IVF, "nlist": ivf.nlist, "nprobe": ivf.nprobe}
+    stats["lexical"] = {"terms": len(lexical.terms), "postings": int(lexical.postings.shape[0])}
+    if quant is not None:
+        stats["quantization"] = {
+            "type": quant.kind,
+            "rescore": quant.rescore,
+            "bytes": quant.nbytes,
+            "float32_bytes": int(matrix.nbytes),
+        }
+    return stats
 
 
 def load_index(
     index_dir: str = "data/index",
     chunks_path: str = "data/chunks.json",
-) -> Tuple[Dict[str, Chunk], Dict[str, List[float]]]:
-    chunks_text = Path(chunks_path).read_text(encoding="utf-8")
-    chunk_rows = json.loads(chunks_text)
-    chunks: Dict[str, Chunk] = {}
-    for row in chunk_rows:
-        c = Chunk(
-            chunk_id=row["chunk_id"],
-            source_file=row["source_file"],
-            section_id=row.get("section_id", 0),
-            text=row["text"],
-        )
-        chunks[c.chunk_id] = c
-
-    emb_path = Path(index_dir) / "embeddings.jsonl"
-    embeddings: Dict[str, List[float]] = {}
-    with emb_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            if not line.strip():
-                continue
-            row = json.loads(line)
-            embeddings[row["chunk_id"]] = row["embedding"]
-
-    return chunks, embeddings
+) -> Tuple[Dict[str, Chunk], VectorIndex]:
+    # Chunks and vectors come from the same pinned version, even if a build publishes meanwhile
+    with pin_index(index_dir) as version_dir:
+        versioned = version_dir / CHUNKS_FILE
+        chunks_text = (versioned if versioned.exists() else Path(chunks_path)).read_text(encoding="utf-8")
+        chunk_rows = json.loads(chunks_text)
+        chunks: Dict[str, Chunk] = {}
+        for row in chunk_rows:
+            c = Chunk(
+                chunk_id=row["chunk_id"],
+                source_file=row["source_file"],
+                section_id=row.get("section_id", 0),
+                text=row["text"],
+            )
+            chunks[c.chunk_id] = c
+
+        return chunks, load_vectors(str(version_dir))
 
 
 def _cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -210,28 +550,149 @@ def _cosine_similarity(a: List[float], b: List[float]) -> float:
 def retrieve(
     question: str,
     chunks: Dict[str, Chunk],
-    embeddings: Dict[str, List[float]],
+    embeddings: Union[VectorIndex, Mapping[str, Sequence[float]]],
     topk: int,
     embedding_model: str,
+    nprobe: Optional[int] = None,
+    exact: bool = False,
+    mode: str = RETRIEVAL_VECTOR,
+) -> List[RetrievedChunk]:
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unsupported retrieval mode: {mode}")
+    if mode == RETRIEVAL_LEXICAL:
+        # No embedding call at all
+        return retrieve_lexical(question, chunks=chunks, embeddings=embeddings, topk=topk)
+    q_emb = embed_query(question, model=embedding_model)
+    if mode == RETRIEVAL_HYBRID:
+        return retrieve_hybrid(
+            question,
+            q_emb,
+            chunks=chunks,
+            embeddings=embeddings,
+            topk=topk,
+            nprobe=nprobe,
+            exact=exact,
+        )
+    return retrieve_by_embedding(
+        q_emb,
+        chunks=chunks,
+        embeddings=embeddings,
+        topk=topk,
+        nprobe=nprobe,
+        exact=exact,
+    )
+
+
+def has_lexical(embeddings: Union[VectorIndex, Mapping[str, Sequence[float]]]) -> bool:
+    return getattr(embeddings, "lexical", None) is not None
+
+
+def retrieve_lexical(
+    question: str,
+    chunks: Dict[str, Chunk],
+    embeddings: Union[VectorIndex, Mapping[str, Sequence[float]]],
+    topk: int,
 ) -> List[RetrievedChunk]:
-    q_emb = _embed_texts([question], model=embedding_model)[0]
+    """BM25-only retrieval; ``score`` is the BM25 score, not a cosine similarity."""
+    index = VectorIndex.from_embeddings(embeddings)
+    if index.lexical is None:
+        raise ValueError("Index has no lexical index; rebuild it to enable lexical retrieval")
+    topk = max(1, topk)
+    rows, scores = index.lexical.search(question, topk + max(0, len(index) - len(chunks)))
+    out: List[RetrievedChunk] = []
+    for row, score in zip(rows.tolist(), scores.tolist()):
+        c = chunks.get(index.ids[row])
+        if not c:
+            continue
+        out.append(RetrievedChunk(chunk=c, score=float(score)))
+        if len(out) >= topk:
+            break
+    return out
+
 
-    scored: List[RetrievedChunk] = []
-    for chunk_id, emb in embeddings.items():
+def fuse_rrf(rankings: Sequence[Sequence[str]], k: int = DEFAULT_RRF_K) -> List[Tuple[str, float]]:
+    """Reciprocal rank fusion: sum of 1 / (k + rank) over the lists an id appears in."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+def retrieve_hybrid(
+    question: str,
+    q_emb: Sequence[float],
+    chunks: Dict[str, Chunk],
+    embeddings: Union[VectorIndex, Mapping[str, Sequence[float]]],
+    topk: int,
+    nprobe: Optional[int] = None,
+    exact: bool = False,
+    rrf_k: int = DEFAULT_RRF_K,
+) -> List[RetrievedChunk]:
+    """Vector and BM25 candidates fused by rank.
+
+    The order comes from the fusion; ``score`` stays the cosine similarity
+    of each chunk, so refusal thresholds mean the same as in vector mode.
+    """
+    index = VectorIndex.from_embeddings(embeddings)
+    if index.lexical is None:
+        return retrieve_by_embedding(q_emb, chunks, index, topk=topk, nprobe=nprobe, exact=exact)
+    topk = max(1, topk)
+    candidates = topk * HYBRID_CANDIDATES_PER_RESULT + max(0, len(index) - len(chunks))
+    vector_hits = index.search(q_emb, candidates, nprobe=nprobe, exact=exact)
+    lex_rows, _ = index.lexical.search(question, candidates)
+    fused = fuse_rrf([[cid for cid, _ in vector_hits], [index.ids[r] for r in lex_rows.tolist()]], k=rrf_k)
+
+    cosine = dict(vector_hits)
+    q = normalize_vector(q_emb)
+    out: List[RetrievedChunk] = []
+    for chunk_id, _ in fused:
         c = chunks.get(chunk_id)
         if not c:
             continue
-        score = _cosine_similarity(q_emb, emb)
-        scored.append(RetrievedChunk(chunk=c, score=score))
+        score = cosine.get(chunk_id)
+        if score is None:
+            score = float(np.dot(index[chunk_id], q))
+        out.append(RetrievedChunk(chunk=c, score=score))
+        if len(out) >= topk:
+            break
+    return out
 
-    scored.sort(key=lambda x: x.score, reverse=True)
-    return scored[:max(1, topk)]
+
+def retrieve_by_embedding(
+    q_emb: Sequence[float],
+    chunks: Dict[str, Chunk],
+    embeddings: Union[VectorIndex, Mapping[str, Sequence[float]]],
+    topk: int,
+    nprobe: Optional[int] = None,
+    exact: bool = False,
+) -> List[RetrievedChunk]:
+    index = VectorIndex.from_embeddings(embeddings)
+    topk = max(1, topk)
+    # Over-fetch a little so ids missing from chunks.json don't shrink the result
+    hits = index.search(
+        q_emb,
+        topk + max(0, len(index) - len(chunks)),
+        nprobe=nprobe,
+        exact=exact,
+    )
+
+    out: List[RetrievedChunk] = []
+    for chunk_id, score in hits:
+        c = chunks.get(chunk_id)
+        if not c:
+            continue
+        out.append(RetrievedChunk(chunk=c, score=score))
+        if len(out) >= topk:
+            break
+    return out
 
 
 def should_refuse(retrieved: List[RetrievedChunk], threshold: float) -> bool:
     if not retrieved:
         return True
-    return retrieved[0].score < threshold
+    # Hybrid results are ordered by fusion, so the best score need not come first
+    return max(r.score for r in retrieved) < threshold
 
 
 def format_citations(retrieved: List[RetrievedChunk], preview_len: int = 80) -> List[Dict[str, str]]:
@@ -256,14 +717,63 @@ def build_evidence_block(retrieved: List[RetrievedChunk]) -> str:
     return "\n".join(lines)
 
 
-def generate_answer(question: str, retrieved: List[RetrievedChunk], model: str) -> str:
+def _answer_prompt(question: str, retrieved: List[RetrievedChunk]) -> str:
     tpl = load_prompt("rag_answer.md")
     evidence = build_evidence_block(retrieved)
-    prompt = render_prompt(tpl, QUESTION=question, EVIDENCE=evidence)
+    return render_prompt(tpl, QUESTION=question, EVIDENCE=evidence)
 
-    client = get_client()
-    resp = client.responses.create(
-        model=model,
-        input=prompt,
+
+def generate_answer(question: str, retrieved: List[RetrievedChunk], model: str) -> str:
+    prompt = _answer_prompt(question, retrieved)
+
+    client = get_client(max_retries=0)
+    resp = get_rate_limiter().call(
+        model,
+        estimate_tokens(prompt) + DEFAULT_OUTPUT_TOKENS,
+        lambda: client.responses.create(
+            model=model,
+            input=prompt,
+        ),
     )
     return (resp.output_text or "").strip()
+
+
+async def generate_answer_async(question: str, retrieved: List[RetrievedChunk], model: str) -> str:
+    prompt = _answer_prompt(question, retrieved)
+
+    client = get_async_client(max_retries=0)
+    resp = await get_rate_limiter().call_async(
+        model,
+        estimate_tokens(prompt) + DEFAULT_OUTPUT_TOKENS,
+        lambda: client.responses.create(
+            model=model,
+            input=prompt,
+        ),
+    )
+    return (resp.output_text or "").strip()
+
+
+def generate_answer_stream(question: str, retrieved: List[RetrievedChunk], model: str) -> Iterator[str]:
+    """Yield answer text deltas as the model produces them.
+
+    Closing the generator early (client went away) also closes the
+    upstream HTTP stream.
+    """
+    prompt = _answer_prompt(question, retrieved)
+
+    # No SDK retries inside the lease: a 429 fails the stream before any delta
+    # and the lease pauses the model's other callers for its Retry-After
+    client = get_client(max_retries=0)
+    # The lease (and its concurrency slot) is held until the stream ends
+    with get_rate_limiter().lease(model, estimate_tokens(prompt) + DEFAULT_OUTPUT_TOKENS):
+        stream = client.responses.create(
+            model=model,
+            input=prompt,
+            stream=True,
+        )
+        try:
+            for event in stream:
+                if event.type == "response.output_text.delta" and event.delta:
+                    yield event.delta
+        finally:
+            stream.close()
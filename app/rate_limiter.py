@@ -0,0 +1,370 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional, Tuple, TypeVar
+
+from openai import APIConnectionError, APIStatusError, RateLimitError
+
+from app.embedder import BACKOFF_BASE_SECONDS, BACKOFF_MAX_SECONDS, retry_after_seconds
+
+
+DEFAULT_MAX_RETRIES = 3
+# Reserved for the completion when only the prompt size is known up front
+DEFAULT_OUTPUT_TOKENS = 512
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Reservation-based token bucket.
+
+    ``reserve`` always succeeds and returns how long the caller must wait;
+    the balance may go negative, so callers are served strictly in the
+    order they reserved.
+    """
+
+    def __init__(self, per_minute: float, now: Optional[float] = None) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # A single request larger than the whole budget waits for a full bucket
+        amount = min(amount, self.capacity)
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, delta: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level - delta)
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted")
+
+    def __init__(self, wake: Callable[[], None]) -> None:
+        self.wake = wake
+        self.granted = False
+
+
+class ModelLimiter:
+    """RPM/TPM budgets, a FIFO concurrency cap and a shared Retry-After pause for one model."""
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_concurrency: int = 0) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._resume_at = 0.0
+        self._slots: Deque[_Waiter] = deque()
+        self.in_flight = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.rate_limited = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    def _reserve(self, tokens: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+            wait = max(self._resume_at - now, 0.0)
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+        return wait
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        with self._lock:
+            self._slots.append(waiter)
+            self._grant_locked()
+
+    def _grant_locked(self) -> None:
+        while self._slots and (self.max_concurrency <= 0 or self.in_flight < self.max_concurrency):
+            waiter = self._slots.popleft()
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+
+    def _cancel(self, waiter: _Waiter) -> None:
+        with self._lock:
+            if waiter.granted:
+                self.in_flight -= 1
+                self._grant_locked()
+            else:
+                self._slots.remove(waiter)
+            self.waiting -= 1
+
+    def _started(self, waited: float) -> None:
+        with self._lock:
+            self.waiting -= 1
+            self.acquired += 1
+            self.wait_total_s += waited
+            self.wait_max_s = max(self.wait_max_s, waited)
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._grant_locked()
+
+    def acquire(self, tokens: int) -> None:
+        start = time.monotonic()
+        delay = self._reserve(tokens)
+        while True:
+            if delay > 0:
+                time.sleep(delay)
+            # A Retry-After pause may have been pushed while we slept
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                break
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        self._enqueue(waiter)
+        event.wait()
+        self._started(time.monotonic() - start)
+
+    async def acquire_async(self, tokens: int) -> None:
+        start = time.monotonic()
+        delay = self._reserve(tokens)
+        waiter: Optional[_Waiter] = None
+        try:
+            while True:
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                with self._lock:
+                    delay = self._resume_at - time.monotonic()
+                if delay <= 0:
+                    break
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def wake() -> None:
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            waiter = _Waiter(wake)
+            self._enqueue(waiter)
+            await future
+        except asyncio.CancelledError:
+            if waiter is not None:
+                self._cancel(waiter)
+            else:
+                with self._lock:
+                    self.waiting -= 1
+            raise
+        self._started(time.monotonic() - start)
+
+    def settle(self, reserved: int, used: Optional[int]) -> None:
+        if used is None or self._tokens is None:
+            return
+        with self._lock:
+            self._tokens.adjust(used - reserved, time.monotonic())
+
+    def penalize(self, exc: Exception, attempt: int) -> float:
+        delay = retry_after_seconds(exc)
+        if delay is None:
+            delay = backoff_seconds(attempt)
+        with self._lock:
+            self.rate_limited += 1
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        return delay
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": self.waiting,
+                "in_flight": self.in_flight,
+                "acquired": self.acquired,
+                "rate_limited": self.rate_limited,
+                "avg_wait_ms": (self.wait_total_s / self.acquired * 1000) if self.acquired else 0.0,
+                "max_wait_ms": self.wait_max_s * 1000,
+                "paused_for_ms": max(self._resume_at - time.monotonic(), 0.0) * 1000,
+            }
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """429s plus the transient failures the SDK itself would retry (timeouts, 408/409, 5xx)."""
+    if isinstance(exc, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(exc, APIStatusError) and (exc.status_code in (408, 409) or exc.status_code >= 500)
+
+
+def backoff_seconds(attempt: int) -> float:
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return delay * (0.5 + random.random() / 2)
+
+
+def _usage_tokens(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage", None)
+    total = getattr(usage, "total_tokens", None)
+    return int(total) if isinstance(total, (int, float)) else None
+
+
+class RateLimiter:
+    """Per-model limiters shared by every upstream call in the process.
+
+    ``call`` / ``call_async`` are the only retry layer for the calls they
+    run: callers hand them a client with SDK retries disabled.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[int, int]]] = None,
+        default_rpm: int = 0,
+        default_tpm: int = 0,
+        max_concurrency: int = 0,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ) -> None:
+        self.limits = dict(limits or {})
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._models: Dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+
+    def for_model(self, model: str) -> ModelLimiter:
+        with self._lock:
+            limiter = self._models.get(model)
+            if limiter is None:
+                rpm, tpm = self.limits.get(model, (self.default_rpm, self.default_tpm))
+                limiter = ModelLimiter(rpm=rpm, tpm=tpm, max_concurrency=self.max_concurrency)
+                self._models[model] = limiter
+            return limiter
+
+    @contextmanager
+    def lease(self, model: str, tokens: int) -> Iterator[ModelLimiter]:
+        limiter = self.for_model(model)
+        limiter.acquire(tokens)
+        try:
+            yield limiter
+        except RateLimitError as exc:
+            limiter.penalize(exc, 0)
+            raise
+        finally:
+            limiter.release()
+
+    def _failed(self, limiter: ModelLimiter, exc: Exception, attempt: int) -> float:
+        """Re-raise unless ``exc`` is retried; return the caller's own sleep before the retry."""
+        if isinstance(exc, RateLimitError):
+            # Every caller of the model waits out the same pause in acquire()
+            limiter.penalize(exc, attempt)
+        if not is_retryable(exc) or attempt >= self.max_retries:
+            raise exc
+        return 0.0 if isinstance(exc, RateLimitError) else backoff_seconds(attempt)
+
+    def call(self, model: str, tokens: int, fn: Callable[[], T]) -> T:
+        """Run ``fn`` under the model's budgets, retrying 429s after the shared pause."""
+        limiter = self.for_model(model)
+        attempt = 0
+        while True:
+            limiter.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as exc:
+                delay = self._failed(limiter, exc, attempt)
+            else:
+                limiter.settle(tokens, _usage_tokens(result))
+                return result
+            finally:
+                limiter.release()
+            # Transient errors back off outside the concurrency slot
+            if delay > 0:
+                time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, model: str, tokens: int, fn: Callable[[], Awaitable[T]]) -> T:
+        limiter = self.for_model(model)
+        attempt = 0
+        while True:
+            await limiter.acquire_async(tokens)
+            try:
+                result = await fn()
+            except Exception as exc:
+                delay = self._failed(limiter, exc, attempt)
+            else:
+                limiter.settle(tokens, _usage_tokens(result))
+                return result
+            finally:
+                limiter.release()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            models = dict(self._models)
+        return {model: limiter.stats() for model, limiter in models.items()}
+
+
+def parse_limits(raw: Optional[str]) -> Dict[str, Tuple[int, int]]:
+    """Parse ``model=rpm:tpm,model2=rpm:tpm`` (either side may be 0 for unlimited)."""
+    limits: Dict[str, Tuple[int, int]] = {}
+    for item in (raw or "").split(","):
+        if not item.strip():
+            continue
+        model, _, budget = item.partition("=")
+        rpm, _, tpm = budget.partition(":")
+        try:
+            limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+        except ValueError:
+            raise RuntimeError(f"Invalid RATE_LIMITS entry: {item.strip()!r} (expected model=rpm:tpm)")
+    return limits
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        return default
+
+
+_limiters: Dict[Tuple, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter from RATE_LIMITS / RATE_LIMIT_RPM / _TPM / _MAX_CONCURRENCY / _MAX_RETRIES.
+
+    With nothing configured every budget is unlimited and only the shared
+    Retry-After pause applies.
+    """
+    raw_limits = os.getenv("RATE_LIMITS") or ""
+    config = (
+        raw_limits,
+        _env_int("RATE_LIMIT_RPM", 0),
+        _env_int("RATE_LIMIT_TPM", 0),
+        _env_int("RATE_LIMIT_MAX_CONCURRENCY", 0),
+        _env_int("RATE_LIMIT_MAX_RETRIES", DEFAULT_MAX_RETRIES),
+    )
+    with _limiters_lock:
+        limiter = _limiters.get(config)
+        if limiter is None:
+            limiter = RateLimiter(
+                limits=parse_limits(raw_limits),
+                default_rpm=config[1],
+                default_tpm=config[2],
+                max_concurrency=config[3],
+                max_retries=config[4],
+            )
+            _limiters[config] = limiter
+        return limiter
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.embed_cache import text_key
+from app.sqlite_local import LocalConnections
+
+
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parents[1] / "data" / "result_cache.db"
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+# On overflow, evict down to this fraction of max_entries so eviction is amortized
+EVICT_TO_RATIO = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    prompt_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    text_sha TEXT NOT NULL,
+    result_json TEXT NOT NULL,
+    created_ts REAL NOT NULL,
+    last_used_ts REAL NOT NULL,
+    PRIMARY KEY (prompt_hash, model, text_sha)
+);
+CREATE INDEX IF NOT EXISTS idx_results_last_used
+    ON results (last_used_ts);
+"""
+
+
+def prompt_hash(*parts: str) -> str:
+    """Fingerprint of everything besides the input text that shapes a result."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+class ResultCache:
+    """Persistent text-processing result cache keyed by (prompt hash, model, sha256(text)).
+
+    A changed prompt template yields a new prompt hash, so stale results are
+    simply never read again and age out through the TTL / LRU eviction.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    ) -> None:
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._conns = LocalConnections(self.path, _SCHEMA)
+        # Rows in the file as of the last exact count plus puts since; None until first put
+        self._approx_count: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, prompt: str, model: str, text: str) -> Optional[Dict]:
+        key = (prompt, model, text_key(text))
+        now = time.time()
+        conn = self._conns.get()
+        row = conn.execute(
+            """
+            SELECT result_json, created_ts FROM results
+            WHERE prompt_hash = ? AND model = ? AND text_sha = ?
+            """,
+            key,
+        ).fetchone()
+        if row is not None and now - row[1] > self.ttl_seconds:
+            conn.execute(
+                "DELETE FROM results WHERE prompt_hash = ? AND model = ? AND text_sha = ?",
+                key,
+            )
+            conn.commit()
+            row = None
+        if row is not None:
+            conn.execute(
+                """
+                UPDATE results SET last_used_ts = ?
+                WHERE prompt_hash = ? AND model = ? AND text_sha = ?
+                """,
+                (now, *key),
+            )
+            conn.commit()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, prompt: str, model: str, text: str, result: Dict) -> None:
+        if self.max_entries <= 0:
+            return
+        now = time.time()
+        payload = json.dumps(result, ensure_ascii=False)
+        conn = self._conns.get()
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO results
+                (prompt_hash, model, text_sha, result_json, created_ts, last_used_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (prompt, model, text_key(text), payload, now, now),
+        )
+        conn.commit()
+        with self._lock:
+            if self._approx_count is None:
+                self._approx_count = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            else:
+                # Counts replaced rows too, so it only ever overestimates
+                self._approx_count += 1
+            if self._approx_count <= self.max_entries:
+                return
+            self._approx_count = self._evict(conn, now)
+
+    def _evict(self, conn, now: float) -> int:
+        """Exact count and eviction, run only once the approximate count passes the cap."""
+        conn.execute("DELETE FROM results WHERE created_ts < ?", (now - self.ttl_seconds,))
+        count = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = count - int(self.max_entries * EVICT_TO_RATIO)
+        if count > self.max_entries and excess > 0:
+            conn.execute(
+                """
+                DELETE FROM results WHERE rowid IN (
+                    SELECT rowid FROM results ORDER BY last_used_ts ASC LIMIT ?
+                )
+                """,
+                (excess,),
+            )
+            self.evictions += excess
+            count -= excess
+        conn.commit()
+        return count
+
+    def close(self) -> None:
+        self._conns.close()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_caches: Dict[str, ResultCache] = {}
+_caches_lock = threading.Lock()
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Process-wide cache from RESULT_CACHE_PATH / _MAX_ENTRIES / _TTL_SECONDS (0 entries disables)."""
+    max_entries = int(_env_number("RESULT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    if max_entries <= 0:
+        return None
+    ttl_seconds = _env_number("RESULT_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)
+    path = os.getenv("RESULT_CACHE_PATH") or str(DEFAULT_CACHE_PATH)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = ResultCache(Path(path), max_entries=max_entries, ttl_seconds=ttl_seconds)
+            _caches[path] = cache
+        cache.max_entries = max_entries
+        cache.ttl_seconds = ttl_seconds
+        return cache
@@ -0,0 +1,58 @@
+import sqlite3
+import threading
+import weakref
+from pathlib import Path
+
+
+class LocalConnections:
+    """One SQLite connection per thread for a cache file, opened on first use.
+
+    Opening a connection (and re-running the schema script) per lookup costs
+    more than the lookup itself; WAL lets the threads read while one writes.
+    """
+
+    def __init__(self, path: Path, schema: str) -> None:
+        self.path = Path(path)
+        self.schema = schema
+        self._local = threading.local()
+        self._ready = False
+        self._ready_lock = threading.Lock()
+        # Bumped by close() so every thread drops its closed handle
+        self._generation = 0
+        self._open: "weakref.WeakSet[sqlite3.Connection]" = weakref.WeakSet()
+        self._open_lock = threading.Lock()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation == self._generation:
+            return conn
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # check_same_thread=False only so close() can close it; each thread uses its own
+        conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, factory=_Connection)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        with self._ready_lock:
+            if not self._ready:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(self.schema)
+                self._ready = True
+        with self._open_lock:
+            self._open.add(conn)
+        self._local.conn = conn
+        self._local.generation = self._generation
+        return conn
+
+    def close(self) -> None:
+        with self._open_lock:
+            conns = list(self._open)
+            self._open.clear()
+            self._generation += 1
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class _Connection(sqlite3.Connection):
+    # Subclass only so connections can be tracked weakly
+    pass
@@ -0,0 +1,132 @@
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Zero vectors stay zero so they score 0.0, like _cosine_similarity does
+    norms[norms == 0.0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def normalize_vector(vec: Sequence[float]) -> np.ndarray:
+    q = np.asarray(vec, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(q))
+    if norm == 0.0:
+        return q
+    return q / norm
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (argpartition + small sort)."""
+    n = scores.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class VectorIndex(Mapping[str, np.ndarray]):
+    """All chunk embeddings of a KB as one L2-normalized float32 matrix.
+
+    Row i belongs to ``ids[i]``. Because rows are unit length, cosine
+    similarity against a normalized query is a single matrix-vector product.
+    The class behaves as a read-only ``chunk_id -> vector`` mapping so code
+    written against the old ``Dict[str, List[float]]`` keeps working.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        matrix: np.ndarray,
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        if matrix.ndim != 2:
+            raise ValueError("Embedding matrix must be 2-dimensional")
+        if matrix.shape[0] != len(ids):
+            raise ValueError(
+                f"Embedding matrix has {matrix.shape[0]} rows but {len(ids)} chunk ids"
+            )
+        self.ids: List[str] = list(ids)
+        self.matrix = matrix
+        # Header of the on-disk index this came from (empty for in-memory data)
+        self.meta: Dict[str, Any] = dict(meta or {})
+        # Optional approximate index (app.ann.IVFIndex) over the same rows
+        self.ann: Optional[Any] = None
+        # Optional BM25 index (app.lexical_index.LexicalIndex) over the same rows
+        self.lexical: Optional[Any] = None
+        # Optional int8 / binary codes (app.quantize.QuantizedIndex) over the same rows
+        self.quant: Optional[Any] = None
+        self._rows: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def from_embeddings(cls, embeddings: Mapping[str, Sequence[float]]) -> "VectorIndex":
+        if isinstance(embeddings, VectorIndex):
+            return embeddings
+        ids = list(embeddings.keys())
+        if not ids:
+            return cls([], np.zeros((0, 0), dtype=np.float32))
+        dims = {len(embeddings[i]) for i in ids}
+        if len(dims) != 1:
+            raise ValueError(f"Inconsistent embedding dimensions: {sorted(dims)}")
+        matrix = np.asarray([embeddings[i] for i in ids], dtype=np.float32)
+        return cls(ids, normalize_rows(matrix))
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1]) if self.matrix.shape[0] else 0
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.matrix.nbytes)
+
+    def row_of(self, chunk_id: str) -> int:
+        if self._rows is None:
+            self._rows = {cid: i for i, cid in enumerate(self.ids)}
+        return self._rows[chunk_id]
+
+    def __getitem__(self, chunk_id: str) -> np.ndarray:
+        return self.matrix[self.row_of(chunk_id)]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _query(self, query: Sequence[float]) -> np.ndarray:
+        q = normalize_vector(query)
+        if q.shape[0] != self.dim:
+            raise ValueError(
+                f"Query embedding has dimension {q.shape[0]}, index has {self.dim}"
+            )
+        return q
+
+    def scores(self, query: Sequence[float]) -> np.ndarray:
+        return self.matrix @ self._query(query)
+
+    def search(
+        self,
+        query: Sequence[float],
+        topk: int,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+    ) -> List[Tuple[str, float]]:
+        if not self.ids:
+            return []
+        q = self._query(query)
+        topk = max(1, topk)
+        if self.ann is not None and not exact:
+            rows, scores = self.ann.search(self.matrix, q, topk, nprobe=nprobe, quant=self.quant)
+            # Fall back to exact search when the probed lists are too sparse
+            if rows.shape[0] >= min(topk, len(self.ids)):
+                return [(self.ids[i], float(s)) for i, s in zip(rows, scores)]
+        if self.quant is not None and not exact:
+            rows, scores = self.quant.search(self.matrix, q, topk)
+            return [(self.ids[i], float(s)) for i, s in zip(rows, scores)]
+        scores = self.matrix @ q
+        rows = top_k(scores, topk)
+        return [(self.ids[i], float(scores[i])) for i in rows]
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+import uvicorn
+from fastapi import Depends, FastAPI, Request
+
+from server.api.deps import get_current_user
+
+
+TEXT_RESULT = {
+    "summary_short": "ok",
+    "summary_bullets": ["a", "b", "c"],
+    "topic": "其他",
+    "sentiment": "中性",
+    "keywords": [],
+    "entities": {"time": None, "location": None, "people": [], "orgs": []},
+    "rewrite_formal": "ok",
+}
+
+
+class _Upstream:
+    """Stub OpenAI endpoint that answers after a fixed delay and tracks peak concurrency."""
+
+    def __init__(self, delay_ms: int) -> None:
+        self.delay = delay_ms / 1000.0
+        self.in_flight = 0
+        self.peak = 0
+
+    def app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/v1/responses")
+        async def responses(request: Request) -> dict:
+            body = await request.json()
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                await asyncio.sleep(self.delay)
+            finally:
+                self.in_flight -= 1
+            return {
+                "id": "resp_bench",
+                "object": "response",
+                "created_at": int(time.time()),
+                "model": body.get("model"),
+                "status": "completed",
+                "output": [
+                    {
+                        "type": "message",
+                        "id": "msg_bench",
+                        "status": "completed",
+                        "role": "assistant",
+                        "content": [
+                            {
+                                "type": "output_text",
+                                "text": json.dumps(TEXT_RESULT, ensure_ascii=False),
+                                "annotations": [],
+                            }
+                        ],
+                    }
+                ],
+            }
+
+        return app
+
+
+def _serve(app: FastAPI, port: int) -> uvicorn.Server:
+    config = uvicorn.Config(
+        app,
+        host="127.0.0.1",
+        port=port,
+        log_level="warning",
+        access_log=False,
+        timeout_keep_alive=60,
+    )
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError(f"server on port {port} did not start")
+        time.sleep(0.05)
+    return server
+
+
+def _api_app() -> FastAPI:
+    from app.pipeline import process_text
+    from server.main import create_app
+    from server.services.history_store import record_text_history
+
+    app = create_app()
+
+    # The pre-async handler shape, kept only as a baseline for comparison
+    @app.post("/bench/text/process_sync")
+    def process_sync(payload: dict, user: dict = Depends(get_current_user)) -> dict:
+        start = time.perf_counter()
+        result = process_text(payload["text"])
+        record_text_history(
+            user_id=user["id"],
+            input_text=payload["text"],
+            result=result,
+            status="success",
+            duration_ms=int((time.perf_counter() - start) * 1000),
+        )
+        return result
+
+    return app
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def _load(base_url: str, path: str, token: str, requests: int, concurrency: int) -> Dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+
+        async def one(i: int) -> None:
+            nonlocal errors
+            async with sem:
+                start = time.perf_counter()
+                try:
+                    res = await client.post(
+                        path,
+                        json={"text": f"bench text {i}"},
+                        headers={"Authorization": f"Bearer {token}"},
+                    )
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+                if res.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "rps": round(requests / wall, 1),
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test /api/text/process (async) vs a sync handler")
+    parser.add_argument("--requests", type=int, default=400, help="Total requests per route")
+    parser.add_argument("--concurrency", type=int, default=200, help="Concurrent client requests")
+    parser.add_argument("--upstream-ms", type=int, default=500, help="Stub upstream latency")
+    parser.add_argument("--routes", default="async,sync", help="Comma-separated: async, sync")
+    parser.add_argument("--port", type=int, default=18765, help="Port for the API (stub uses port+1)")
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp(prefix="bench_async_"))
+    os.environ["DB_PATH"] = str(tmp / "app.db")
+    os.environ.setdefault("JWT_SECRET", "bench-secret")
+    os.environ["OPENAI_API_KEY"] = "bench-key"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port + 1}/v1"
+    os.environ["OPENAI_MAX_RETRIES"] = "0"
+    # Every request sends the same text; measure upstream calls, not result cache hits
+    os.environ["RESULT_CACHE_MAX_ENTRIES"] = "0"
+    os.environ.setdefault("OPENAI_POOL_MAX_CONNECTIONS", str(args.concurrency))
+
+    upstream = _Upstream(args.upstream_ms)
+    _serve(upstream.app(), args.port + 1)
+    _serve(_api_app(), args.port)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    res = httpx.post(
+        f"{base_url}/api/auth/register",
+        json={"username": f"bench_{int(time.time())}", "password": "pass1234"},
+    )
+    res.raise_for_status()
+    token = res.json()["token"]
+
+    paths = {"async": "/api/text/process", "sync": "/bench/text/process_sync"}
+    for route in [r.strip() for r in args.routes.split(",") if r.strip()]:
+        upstream.peak = 0
+        row = asyncio.run(_load(base_url, paths[route], token, args.requests, args.concurrency))
+        row = {"route": route, **row, "upstream_peak_in_flight": upstream.peak}
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
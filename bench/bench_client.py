@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+from openai import OpenAI
+
+import client
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the shared client can keep connections alive
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; avoid the Nagle / delayed-ACK stall
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        payload = json.dumps({
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": [0.1, 0.2, 0.3]}
+                for i, _ in enumerate(body["input"])
+            ],
+            "model": body["model"],
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _fresh_client() -> OpenAI:
+    # What every call paid before the shared registry: dotenv parsing plus a new pool
+    client.load_env()
+    return OpenAI(**client._client_kwargs())
+
+
+def _measure(get: Callable[[], OpenAI], calls: int) -> Dict:
+    get().embeddings.create(model="text-embedding-3-small", input=["warmup"])
+    samples: List[float] = []
+    for i in range(calls):
+        start = time.perf_counter()
+        get().embeddings.create(model="text-embedding-3-small", input=[f"text {i}"])
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "calls": calls,
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(sorted(samples)[int(len(samples) * 0.95) - 1], 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-call OpenAI client overhead: new client vs shared registry")
+    parser.add_argument("--calls", type=int, default=200, help="Embedding calls per mode")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_MAX_RETRIES"] = "0"
+
+    before = _measure(_fresh_client, args.calls)
+    after = _measure(client.get_client, args.calls)
+    print(json.dumps({"mode": "client_per_call", **before}))
+    print(json.dumps({"mode": "shared_client", **after}))
+    print(json.dumps({"overhead_saved_ms_per_call": round(before["mean_ms"] - after["mean_ms"], 3)}))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
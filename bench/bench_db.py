@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from server.services import db, history_store, user_store
+
+
+def _legacy_get_conn() -> sqlite3.Connection:
+    # What every call paid before pooling: a new connection, default journal
+    # mode / synchronous=FULL, and the user_version schema check
+    path = db.get_db_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    db._ensure_schema(conn)
+    return conn
+
+
+def _round_trip(user_id: str, i: int) -> None:
+    # One authenticated request that writes and lists history
+    user_store.get_user_by_id(user_id)
+    history_store.record_text_history(
+        user_id=user_id,
+        input_text=f"bench text {i}",
+        result={"summary_short": "ok"},
+        status="success",
+        duration_ms=1,
+    )
+    history_store.list_text_history(user_id, 20)
+
+
+def _measure(mode: str, rounds: int, threads: int) -> Dict:
+    tmp = Path(tempfile.mkdtemp(prefix=f"bench_db_{mode}_"))
+    os.environ["DB_PATH"] = str(tmp / "app.db")
+    getter = _legacy_get_conn if mode == "per_call_connection" else db.get_conn
+    user_store.get_conn = getter
+    history_store.get_conn = getter
+
+    user_ids = [user_store.create_user(f"bench_{mode}_{t}", "hash")["id"] for t in range(threads)]
+    samples: List[float] = []
+    lock = threading.Lock()
+
+    def worker(user_id: str) -> None:
+        local: List[float] = []
+        for i in range(rounds):
+            start = time.perf_counter()
+            _round_trip(user_id, i)
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            samples.extend(local)
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(uid,)) for uid in user_ids]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - start
+    db.close_connections()
+    samples.sort()
+    return {
+        "mode": mode,
+        "threads": threads,
+        "round_trips": len(samples),
+        "round_trips_per_sec": round(len(samples) / wall, 1),
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Auth + history round trips: connection per call vs pooled connections")
+    parser.add_argument("--rounds", type=int, default=500, help="Round trips per thread")
+    parser.add_argument("--threads", default="1,4", help="Concurrent request threads to try")
+    args = parser.parse_args()
+
+    for threads in (int(t) for t in args.threads.split(",")):
+        for mode in ("per_call_connection", "pooled"):
+            print(json.dumps(_measure(mode, args.rounds, threads)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+from server.services import db, history_store
+
+
+def _legacy_trim(conn, table: str, user_id: str, keep: int) -> None:
+    # The per-insert trim this benchmark compares against
+    conn.execute(
+        f"""
+        DELETE FROM {table}
+        WHERE user_id = ?
+        AND id NOT IN (
+            SELECT id FROM {table}
+            WHERE user_id = ?
+            ORDER BY created_ts DESC
+            LIMIT ?
+        )
+        """,
+        (user_id, user_id, keep),
+    )
+
+
+def _legacy_write_batch(items) -> None:
+    with db.get_conn() as conn:
+        for table, user_id, rows in items:
+            conn.executemany(history_store._INSERTS[table], rows)
+            _legacy_trim(conn, table, user_id, history_store.get_max_records())
+
+
+def _prefill(rows: int, users: int) -> List[str]:
+    user_ids = [f"user_{i}" for i in range(users)]
+    base_ts = int(time.time() * 1000) - rows
+    batch = []
+    with db.get_conn() as conn:
+        for i in range(rows):
+            user_id = user_ids[i % users]
+            batch.append((
+                uuid.uuid4().hex, user_id, "2024-01-01T00:00:00Z", base_ts + i, 1, "success",
+                f"prefill {i}", f"prefill {i}", "ok", None, 0, None, None, None,
+            ))
+            if len(batch) >= 50000:
+                conn.executemany(history_store._TEXT_INSERT, batch)
+                batch.clear()
+        if batch:
+            conn.executemany(history_store._TEXT_INSERT, batch)
+    return user_ids
+
+
+def _measure(mode: str, rows: int, users: int, inserts: int) -> Dict:
+    tmp = Path(tempfile.mkdtemp(prefix=f"bench_retention_{mode}_"))
+    os.environ["DB_PATH"] = str(tmp / "app.db")
+    # Every user sits exactly at the per-user limit, as after a long-running deployment
+    os.environ["HISTORY_LIMIT"] = str(rows // users)
+    history_store._inserts_since_trim.clear()
+    history_store._write_batch = _legacy_write_batch if mode == "trim_every_insert" else original_write_batch
+    user_ids = _prefill(rows, users)
+
+    start = time.perf_counter()
+    for i in range(inserts):
+        history_store.record_text_history(
+            user_id=user_ids[i % users],
+            input_text=f"bench {i}",
+            result={"summary_short": "ok"},
+            status="success",
+            duration_ms=1,
+        )
+    elapsed = time.perf_counter() - start
+    with db.get_conn() as conn:
+        total = conn.execute("SELECT COUNT(*) FROM history_text").fetchone()[0]
+    db.close_connections()
+    return {
+        "mode": mode,
+        "table_rows": rows,
+        "users": users,
+        "history_limit": rows // users,
+        "inserts": inserts,
+        "inserts_per_sec": round(inserts / elapsed, 1),
+        "mean_ms": round(elapsed / inserts * 1000, 3),
+        "rows_after": total,
+    }
+
+
+original_write_batch = history_store._write_batch
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="History insert throughput: per-insert trim vs amortized retention")
+    parser.add_argument("--sizes", default="10000,1000000", help="Prefilled history_text rows")
+    parser.add_argument("--users", type=int, default=100, help="Users the rows are spread over")
+    parser.add_argument("--inserts", type=int, default=2000, help="Timed single-row inserts per mode")
+    parser.add_argument("--trim-every", type=int, default=20, help="HISTORY_TRIM_EVERY; small enough that trims run during the timed inserts")
+    args = parser.parse_args()
+
+    # Measure the write itself, not the request-path enqueue
+    os.environ["HISTORY_WRITE_MODE"] = "sync"
+    os.environ["HISTORY_TRIM_EVERY"] = str(args.trim_every)
+    for rows in (int(s) for s in args.sizes.split(",")):
+        for mode in ("trim_every_insert", "amortized"):
+            print(json.dumps(_measure(mode, rows, args.users, args.inserts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from server.services import db, history_store
+
+# Small vocabulary so common terms hit many rows and rare ones few, like real Q&A logs
+_COMMON = ["知识库", "索引", "文档", "配置", "问题", "接口", "模型", "用户", "数据", "服务"]
+_RARE = [f"工单{i:05d}" for i in range(20000)]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(_COMMON, k=6) + [rng.choice(_RARE)]
+    rng.shuffle(words)
+    return "，".join(words) + "。"
+
+
+def _prefill(rows: int, users: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    user_ids = [uuid.uuid4().hex for _ in range(users)]
+    base_ts = int(time.time() * 1000) - rows
+    batch = []
+    with db.get_conn() as conn:
+        for i in range(rows):
+            question = _sentence(rng)
+            answer = _sentence(rng) + _sentence(rng)
+            batch.append((
+                uuid.uuid4().hex, user_ids[i % users], "kb", "2024-01-01T00:00:00Z", base_ts + i, 1,
+                "success", question, question[:120], 5, 0.35, "emb", "model", 0, answer, answer[:200],
+                0.5, "[]", None, 0, None, None, None,
+            ))
+            if len(batch) >= 50000:
+                conn.executemany(history_store._RAG_INSERT, batch)
+                batch.clear()
+        if batch:
+            conn.executemany(history_store._RAG_INSERT, batch)
+    return user_ids
+
+
+def _time(fn: Callable[[], object], repeat: int) -> Dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[max(0, int(len(samples) * 0.95) - 1)], 3),
+    }
+
+
+_MODES = {
+    # HISTORY_SEARCH_SCAN_ROWS per mode
+    "scan": str(10 ** 9),
+    "fts": "0",
+    "auto": str(history_store.DEFAULT_SEARCH_SCAN_ROWS),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="History search: user-row scan vs FTS5 index vs the automatic choice")
+    parser.add_argument("--rows", type=int, default=1000000, help="history_rag rows")
+    parser.add_argument(
+        "--users",
+        default="10000,20",
+        help="User counts to spread the rows over: 10000 = default HISTORY_LIMIT of 100, 20 = very long histories",
+    )
+    parser.add_argument("--repeat", type=int, default=50, help="Searches per query kind and mode")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ["HISTORY_WRITE_MODE"] = "sync"
+    os.environ["HISTORY_LIMIT"] = str(args.rows)
+    for users in (int(u) for u in args.users.split(",")):
+        tmp = Path(tempfile.mkdtemp(prefix="bench_history_search_"))
+        os.environ["DB_PATH"] = str(tmp / "app.db")
+        start = time.perf_counter()
+        user_ids = _prefill(args.rows, users, args.seed)
+        print(json.dumps({
+            "rows": args.rows,
+            "users": users,
+            "rows_per_user": args.rows // users,
+            "insert_with_fts_sec": round(time.perf_counter() - start, 1),
+        }))
+
+        rng = random.Random(args.seed + 1)
+        queries = {
+            "rare_term": lambda: rng.choice(_RARE),
+            "common_term": lambda: "知识库",
+            "common_and_rare": lambda: "知识库 " + rng.choice(_RARE),
+        }
+        for kind, make_query in queries.items():
+            for mode, scan_rows in _MODES.items():
+                os.environ["HISTORY_SEARCH_SCAN_ROWS"] = scan_rows
+
+                def run() -> None:
+                    history_store.search_rag_history(rng.choice(user_ids), make_query(), args.limit)
+
+                print(json.dumps({"users": users, "query": kind, "mode": mode, **_time(run, args.repeat)}))
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
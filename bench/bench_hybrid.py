@@ -0,0 +1,92 @@
+import argparse
+import json
+import random
+import time
+from typing import Dict
+
+import numpy as np
+
+from app.lexical_index import LexicalIndex
+from app.rag import Chunk, retrieve_by_embedding, retrieve_hybrid, retrieve_lexical
+from app.vector_index import VectorIndex, normalize_rows
+
+_WORDS = ["知识库", "索引", "部署", "监控", "告警", "备份", "数据库", "重启", "服务", "磁盘", "网络", "日志", "权限", "配置"]
+
+
+def _chunk_text(rng: random.Random, i: int) -> str:
+    # Ops-notes style: Chinese prose plus one unique error code per chunk
+    words = rng.choices(_WORDS, k=rng.randint(40, 80))
+    words.insert(rng.randrange(len(words)), f"ERR-{i:06d}")
+    return "，".join(words) + "。"
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_one(n: int, dim: int, topk: int, queries: int, repeat: int, seed: int) -> Dict:
+    rng = random.Random(seed)
+    texts = [_chunk_text(rng, i) for i in range(n)]
+    ids = [f"chunk_{i:06d}" for i in range(n)]
+    chunks = {cid: Chunk(chunk_id=cid, source_file="ops.txt", section_id=0, text=t) for cid, t in zip(ids, texts)}
+    matrix = normalize_rows(np.random.default_rng(seed).standard_normal((n, dim), dtype=np.float32))
+    index = VectorIndex(ids, matrix)
+
+    start = time.perf_counter()
+    index.lexical = LexicalIndex.build(texts)
+    build_s = time.perf_counter() - start
+
+    # Identifier lookups: embeddings cannot resolve these, BM25 should
+    targets = [rng.randrange(n) for _ in range(queries)]
+    questions = [f"ERR-{t:06d} 怎么处理" for t in targets]
+    q_emb = np.random.default_rng(seed + 1).standard_normal(dim, dtype=np.float32)
+
+    def hit_rate(fn) -> float:
+        hits = 0
+        for t, q in zip(targets, questions):
+            hits += any(r.chunk.chunk_id == ids[t] for r in fn(q))
+        return hits / len(targets)
+
+    vector = lambda q: retrieve_by_embedding(q_emb, chunks, index, topk=topk)
+    lexical = lambda q: retrieve_lexical(q, chunks, index, topk=topk)
+    hybrid = lambda q: retrieve_hybrid(q, q_emb, chunks, index, topk=topk)
+    return {
+        "chunks": n,
+        "dim": dim,
+        "lexical_build_ms": round(build_s * 1000, 1),
+        "lexical_terms": len(index.lexical.terms),
+        "lexical_mb": round(index.lexical.nbytes / 1024 / 1024, 1),
+        "matrix_mb": round(index.nbytes / 1024 / 1024, 1),
+        "vector_query_ms": round(_best_of(lambda: vector(questions[0]), repeat) * 1000, 3),
+        "lexical_query_ms": round(_best_of(lambda: lexical(questions[0]), repeat) * 1000, 3),
+        "hybrid_query_ms": round(_best_of(lambda: hybrid(questions[0]), repeat) * 1000, 3),
+        "identifier_hit_rate": {
+            "vector": hit_rate(vector),
+            "lexical": hit_rate(lexical),
+            "hybrid": hit_rate(hybrid),
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Vector vs BM25 vs hybrid retrieval (local compute only)")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated KB sizes")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--topk", type=int, default=5, help="Top-K")
+    parser.add_argument("--queries", type=int, default=50, help="Identifier queries for the hit rate")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeats per timed query")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        row = bench_one(size, args.dim, args.topk, args.queries, args.repeat, args.seed)
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from app import pipeline
+from app.prompt_loader import load_prompt
+
+
+REDUCE_MARKER = "各片段结果如下"
+_TEMPLATE_CHARS = len(load_prompt("extract_all.json.md"))
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Stub Responses endpoint whose latency grows with prompt size and generated output.
+
+    Latency = base + prefill per input kchar + decode per output kchar; the formal
+    rewrite is roughly half the input, so single-shot output grows with the document.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    base_ms = 300.0
+    prefill_ms = 5.0
+    decode_ms = 200.0
+    lock = threading.Lock()
+    in_flight = 0
+    peak = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["input"]
+        if REDUCE_MARKER in prompt:
+            result = {
+                "summary_short": "全文摘要",
+                "summary_bullets": ["a", "b", "c"],
+                "topic": "其他",
+                "sentiment": "中性",
+                "keywords": ["k1", "k2", "k3"],
+            }
+        else:
+            text_chars = max(0, len(prompt) - _TEMPLATE_CHARS)
+            result = {
+                "summary_short": "片段摘要",
+                "summary_bullets": ["a", "b", "c"],
+                "topic": "其他",
+                "sentiment": "中性",
+                "keywords": ["k1"],
+                "entities": {"time": None, "location": None, "people": [], "orgs": []},
+                "rewrite_formal": "文" * (text_chars // 2),
+            }
+        output = json.dumps(result, ensure_ascii=False)
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.peak = max(cls.peak, cls.in_flight)
+        try:
+            time.sleep((cls.base_ms + cls.prefill_ms * len(prompt) / 1000 + cls.decode_ms * len(output) / 1000) / 1000)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+        payload = json.dumps({
+            "id": "resp_bench",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": body.get("model"),
+            "status": "completed",
+            "output": [
+                {
+                    "type": "message",
+                    "id": "msg_bench",
+                    "status": "completed",
+                    "role": "assistant",
+                    "content": [{"type": "output_text", "text": output, "annotations": []}],
+                }
+            ],
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _make_doc(chars: int) -> str:
+    paragraph = "本段介绍项目背景、进展与下一步计划，涉及多个团队的协作安排。"
+    sections: List[str] = []
+    i = 0
+    while sum(len(s) for s in sections) < chars:
+        body = "\n\n".join(paragraph * 6 for _ in range(3))
+        sections.append(f"# 第{i + 1}节\n{body}")
+        i += 1
+    return "\n\n".join(sections)[:chars]
+
+
+def _run(mode: str, text: str, chunk_chars: int, workers: int) -> Dict:
+    _StubHandler.peak = 0
+    start = time.perf_counter()
+    if mode == "single_shot":
+        pipeline.process_text(text, long_mode=False, use_cache=False)
+        calls = 1
+    else:
+        pipeline.process_text_long(text, chunk_chars=chunk_chars, max_workers=workers)
+        calls = len(pipeline.split_long_text(text, chunk_chars, min(pipeline.DEFAULT_CHUNK_OVERLAP, chunk_chars // 4))) + 1
+    return {
+        "mode": mode,
+        "doc_chars": len(text),
+        "chunk_chars": chunk_chars if mode != "single_shot" else None,
+        "workers": workers if mode != "single_shot" else None,
+        "calls": calls,
+        "peak_in_flight": _StubHandler.peak,
+        "wall_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Long-document processing: single-shot vs map-reduce")
+    parser.add_argument("--sizes", default="8000,32000,64000", help="Document sizes in characters")
+    parser.add_argument("--chunk-chars", default="2000,4000,8000", help="Chunk sizes to try")
+    parser.add_argument("--workers", default="1,4,8", help="Map parallelism values to try")
+    parser.add_argument("--base-ms", type=float, default=300.0, help="Stub per-call latency")
+    parser.add_argument("--prefill-ms", type=float, default=5.0, help="Stub latency per 1000 prompt chars")
+    parser.add_argument("--decode-ms", type=float, default=200.0, help="Stub latency per 1000 output chars (decode dominates)")
+    args = parser.parse_args()
+
+    _StubHandler.base_ms = args.base_ms
+    _StubHandler.prefill_ms = args.prefill_ms
+    _StubHandler.decode_ms = args.decode_ms
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_MAX_RETRIES"] = "0"
+    pipeline.process_text("warmup", long_mode=False, use_cache=False)
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        text = _make_doc(size)
+        print(json.dumps(_run("single_shot", text, 0, 1)))
+        for chunk_chars in (int(c) for c in args.chunk_chars.split(",")):
+            for workers in (int(w) for w in args.workers.split(",")):
+                print(json.dumps(_run("map_reduce", text, chunk_chars, workers)))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
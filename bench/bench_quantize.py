@@ -0,0 +1,85 @@
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.quantize import QUANT_TYPES, QuantizedIndex
+from app.vector_index import VectorIndex, normalize_rows
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _clustered(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    # Topic clusters plus noise: closer to real embeddings than iid Gaussians
+    centers = rng.standard_normal((max(1, n // 200), dim), dtype=np.float32)
+    assign = rng.integers(0, centers.shape[0], size=n)
+    noise = rng.standard_normal((n, dim), dtype=np.float32)
+    return normalize_rows(centers[assign] + 0.8 * noise)
+
+
+def bench_one(n: int, dim: int, topk: int, queries: int, rescores: List[int], repeat: int, seed: int) -> Dict:
+    rng = np.random.default_rng(seed)
+    matrix = _clustered(n, dim, rng)
+    ids = [f"chunk_{i:06d}" for i in range(n)]
+    index = VectorIndex(ids, matrix)
+    # Each query is a chunk embedding plus noise of a quarter of its norm
+    noise = normalize_rows(rng.standard_normal((queries, dim), dtype=np.float32))
+    qs = matrix[rng.choice(n, size=queries, replace=False)] + 0.25 * noise
+    exact = [{cid for cid, _ in index.search(q, topk, exact=True)} for q in qs]
+
+    result: Dict = {
+        "chunks": n,
+        "dim": dim,
+        "float32_mb": round(index.nbytes / 1024 / 1024, 1),
+        "exact_query_ms": round(_best_of(lambda: index.search(qs[0], topk, exact=True), repeat) * 1000, 3),
+    }
+    for kind in QUANT_TYPES:
+        start = time.perf_counter()
+        index.quant = QuantizedIndex.build(matrix, kind)
+        row: Dict = {
+            "build_ms": round((time.perf_counter() - start) * 1000, 1),
+            "mb": round(index.quant.nbytes / 1024 / 1024, 2),
+        }
+        for rescore in rescores:
+            index.quant.rescore = rescore
+            recall = sum(
+                len(want & {cid for cid, _ in index.search(q, topk)}) / len(want)
+                for q, want in zip(qs, exact)
+            ) / len(qs)
+            row[f"rescore_{rescore}"] = {
+                "query_ms": round(_best_of(lambda: index.search(qs[0], topk), repeat) * 1000, 3),
+                f"recall_at_{topk}": round(recall, 3),
+            }
+        result[kind] = row
+    index.quant = None
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="float32 vs int8 vs binary retrieval: memory, speed, recall")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated KB sizes")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--topk", type=int, default=10, help="Top-K")
+    parser.add_argument("--queries", type=int, default=50, help="Queries for recall")
+    parser.add_argument("--rescores", default="1,4,16", help="Comma-separated re-score multipliers")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeats per timed query")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    rescores = [int(r) for r in args.rescores.split(",") if r.strip()]
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        row = bench_one(size, args.dim, args.topk, args.queries, rescores, args.repeat, args.seed)
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.ann import IVFIndex
+from app.rag import _cosine_similarity
+from app.vector_index import VectorIndex
+
+
+def _python_topk(q: List[float], embeddings: Dict[str, List[float]], topk: int) -> List[str]:
+    scored = [(cid, _cosine_similarity(q, emb)) for cid, emb in embeddings.items()]
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return [cid for cid, _ in scored[:topk]]
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_one(
+    n: int,
+    dim: int,
+    topk: int,
+    repeat: int,
+    run_python: bool,
+    seed: int,
+    nprobe: int = 0,
+) -> Dict:
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((n, dim), dtype=np.float32)
+    query = rng.standard_normal(dim, dtype=np.float32).tolist()
+    ids = [f"chunk_{i:06d}" for i in range(n)]
+
+    start = time.perf_counter()
+    index = VectorIndex.from_embeddings({cid: row for cid, row in zip(ids, matrix)})
+    build_s = time.perf_counter() - start
+
+    numpy_s = _best_of(lambda: index.search(query, topk), repeat)
+    result = {
+        "chunks": n,
+        "dim": dim,
+        "numpy_build_ms": round(build_s * 1000, 2),
+        "numpy_query_ms": round(numpy_s * 1000, 3),
+        "matrix_mb": round(index.nbytes / 1024 / 1024, 1),
+    }
+
+    if nprobe:
+        start = time.perf_counter()
+        index.ann = IVFIndex.build(index.matrix)
+        result["ivf_build_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        ivf_s = _best_of(lambda: index.search(query, topk, nprobe=nprobe), repeat)
+        exact_ids = {cid for cid, _ in index.search(query, topk, exact=True)}
+        ivf_ids = {cid for cid, _ in index.search(query, topk, nprobe=nprobe)}
+        result["ivf_nlist"] = index.ann.nlist
+        result["ivf_query_ms"] = round(ivf_s * 1000, 3)
+        result["ivf_recall"] = len(exact_ids & ivf_ids) / len(exact_ids)
+
+    if run_python:
+        as_lists = {cid: row.tolist() for cid, row in zip(ids, matrix)}
+        python_s = _best_of(lambda: _python_topk(query, as_lists, topk), 1)
+        expected = _python_topk(query, as_lists, topk)
+        got = [cid for cid, _ in index.search(query, topk, exact=True)]
+        result["python_query_ms"] = round(python_s * 1000, 1)
+        result["speedup"] = round(python_s / numpy_s, 1) if numpy_s else None
+        result["same_topk"] = expected == got
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark pure-Python vs NumPy retrieval")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated KB sizes")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--topk", type=int, default=5, help="Top-K")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeats for the NumPy path")
+    parser.add_argument(
+        "--python-max",
+        type=int,
+        default=100000,
+        help="Skip the pure-Python path above this many chunks",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--nprobe", type=int, default=0, help="Also benchmark an IVF index with this nprobe")
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        row = bench_one(
+            n=size,
+            dim=args.dim,
+            topk=args.topk,
+            repeat=args.repeat,
+            run_python=size <= args.python_max,
+            seed=args.seed,
+            nprobe=args.nprobe,
+        )
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
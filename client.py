@@ -1,10 +1,40 @@
+import asyncio
+import importlib.util
 import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 from config import load_env, must_getenv
 
-def get_client() -> OpenAI:
-    load_env()
+# Clients for superseded configs stay usable by in-flight calls; only this many are kept
+MAX_CLIENTS_PER_REGISTRY = 4
+
+_env_loaded = False
+_lock = threading.Lock()
+_sync_clients: "OrderedDict[Tuple, OpenAI]" = OrderedDict()
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, OrderedDict]" = weakref.WeakKeyDictionary()
+# Evicted async clients waiting out their grace period; aclose_clients() closes them early
+_async_evicted: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, set]" = weakref.WeakKeyDictionary()
+# Copies of a registry client with another retry count; they share its connection pool
+_retry_variants: "weakref.WeakKeyDictionary[Any, Dict[int, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _ensure_env() -> None:
+    # .env is read once per process and never overrides variables already set,
+    # so edits to the file need a restart; changes made to os.environ (tests,
+    # an embedding host) are picked up by the next call through the fingerprint
+    global _env_loaded
+    if not _env_loaded:
+        load_env()
+        _env_loaded = True
+
+
+def _client_kwargs() -> dict:
+    _ensure_env()
     proxy = os.getenv("OPENAI_PROXY")
     if proxy:
         if not os.getenv("HTTP_PROXY"):
@@ -17,7 +47,7 @@ def get_client() -> OpenAI:
 
     kwargs = {
         "api_key": must_getenv("OPENAI_API_KEY"),
-        "base_url": "https://api.gptsapi.net/v1",
+        "base_url": os.getenv("OPENAI_BASE_URL") or "https://api.gptsapi.net/v1",
     }
     try:
         kwargs["timeout"] = float(timeout)
@@ -28,4 +58,146 @@ def get_client() -> OpenAI:
     except ValueError:
         raise RuntimeError("OPENAI_MAX_RETRIES must be an integer")
 
-    return OpenAI(**kwargs)
+    return kwargs
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        raise RuntimeError(f"{name} must be an integer")
+
+
+def _pool_options() -> dict:
+    raw_http2 = (os.getenv("OPENAI_HTTP2") or "auto").strip().lower()
+    h2_available = importlib.util.find_spec("h2") is not None
+    if raw_http2 in {"0", "false", "no"}:
+        http2 = False
+    elif raw_http2 in {"1", "true", "yes"}:
+        if not h2_available:
+            raise RuntimeError("OPENAI_HTTP2 is enabled but the 'h2' package is not installed")
+        http2 = True
+    else:
+        http2 = h2_available
+    try:
+        keepalive_expiry = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY") or 30)
+    except ValueError:
+        raise RuntimeError("OPENAI_KEEPALIVE_EXPIRY must be a number (seconds)")
+    return {
+        "max_connections": _env_int("OPENAI_POOL_MAX_CONNECTIONS", 100),
+        "max_keepalive_connections": _env_int("OPENAI_POOL_MAX_KEEPALIVE", 20),
+        "keepalive_expiry": keepalive_expiry,
+        "http2": http2,
+    }
+
+
+def _fingerprint() -> Tuple[Tuple, dict, dict]:
+    kwargs = _client_kwargs()
+    pool = _pool_options()
+    proxies = (os.getenv("HTTP_PROXY"), os.getenv("HTTPS_PROXY"), os.getenv("NO_PROXY"))
+    key = tuple(sorted(kwargs.items())) + tuple(sorted(pool.items())) + proxies
+    return key, kwargs, pool
+
+
+def _limits(pool: dict) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=pool["max_connections"],
+        max_keepalive_connections=pool["max_keepalive_connections"],
+        keepalive_expiry=pool["keepalive_expiry"],
+    )
+
+
+def _close_grace(client) -> float:
+    # Long enough for any call already made on the client to finish or time out
+    timeout = client.timeout if isinstance(client.timeout, (int, float)) else 60.0
+    return float(timeout) * (client.max_retries + 1)
+
+
+def _close_later(client) -> None:
+    timer = threading.Timer(_close_grace(client), client.close)
+    timer.daemon = True
+    timer.start()
+
+
+def _aclose_later(loop: asyncio.AbstractEventLoop, client) -> None:
+    _async_evicted.setdefault(loop, set()).add(client)
+
+    def close() -> None:
+        with _lock:
+            pending = _async_evicted.get(loop, set())
+            if client not in pending:
+                return
+            pending.discard(client)
+        loop.create_task(client.close())
+
+    loop.call_later(_close_grace(client), close)
+
+
+def _remember(registry: OrderedDict, key: Tuple, client, on_evict) -> None:
+    registry[key] = client
+    registry.move_to_end(key)
+    while len(registry) > MAX_CLIENTS_PER_REGISTRY:
+        # Evicted clients would otherwise leak their connection pools
+        _, evicted = registry.popitem(last=False)
+        on_evict(evicted)
+
+
+def _with_retries(client, max_retries: Optional[int]):
+    if max_retries is None or max_retries == client.max_retries:
+        return client
+    variants = _retry_variants.setdefault(client, {})
+    variant = variants.get(max_retries)
+    if variant is None:
+        variant = client.with_options(max_retries=max_retries)
+        variants[max_retries] = variant
+    return variant
+
+
+def get_client(max_retries: Optional[int] = None) -> OpenAI:
+    """Process-wide OpenAI client, re-created only when its env config changes.
+
+    Calls paced by ``app.rate_limiter`` pass ``max_retries=0``: the limiter
+    retries them itself, so 429s are not retried again inside the SDK.
+    """
+    key, kwargs, pool = _fingerprint()
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            http_client = DefaultHttpxClient(limits=_limits(pool), http2=pool["http2"])
+            client = OpenAI(http_client=http_client, **kwargs)
+            _remember(_sync_clients, key, client, _close_later)
+        return _with_retries(client, max_retries)
+
+
+def get_async_client(max_retries: Optional[int] = None) -> AsyncOpenAI:
+    """Shared AsyncOpenAI client for the running event loop (connections are loop-bound)."""
+    key, kwargs, pool = _fingerprint()
+    loop = asyncio.get_running_loop()
+    with _lock:
+        registry = _async_clients.setdefault(loop, OrderedDict())
+        client = registry.get(key)
+        if client is None:
+            http_client = DefaultAsyncHttpxClient(limits=_limits(pool), http2=pool["http2"])
+            client = AsyncOpenAI(http_client=http_client, **kwargs)
+            _remember(registry, key, client, lambda evicted: _aclose_later(loop, evicted))
+        return _with_retries(client, max_retries)
+
+
+def close_clients() -> None:
+    with _lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_clients() -> None:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        registry: Optional[Dict] = _async_clients.pop(loop, None)
+        evicted = _async_evicted.pop(loop, set())
+    for client in [*(registry or {}).values(), *evicted]:
+        await client.close()
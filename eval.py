@@ -1,21 +1,17 @@
 import json
-import time
 from pathlib import Path
+
+from openai import RateLimitError
+
 from app.pipeline import process_text
 
 def call_with_retry(text: str, max_retry: int = 5):
-    # 固定退避：20~25秒左右
-    delay = 22
+    # 429 时由共享限流器按 Retry-After 暂停后续请求，这里只需重试，不再固定 sleep
     for i in range(max_retry):
         try:
             return process_text(text)
-        except Exception as e:
-            msg = str(e)
-            if "Error code: 429" in msg or "rate_limit" in msg:
-                # 自动等待后继续
-                time.sleep(delay)
-                continue
-            raise  # 其他错误直接抛出
+        except RateLimitError:
+            continue
     raise RuntimeError("Too many 429 retries")
 
 def main():
@@ -1,13 +1,23 @@
 ﻿import argparse
 import json
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
+from app.ann import DEFAULT_ANN_MIN_CHUNKS
+from app.index_store import detect_format
+from app.quantize import QUANT_TYPES
 from app.rag import (
+    RETRIEVAL_HYBRID,
+    RETRIEVAL_LEXICAL,
+    RETRIEVAL_MODES,
+    RETRIEVAL_VECTOR,
     build_index,
+    embed_query,
     generate_answer,
     load_index,
-    retrieve,
+    retrieve_by_embedding,
+    retrieve_hybrid,
+    retrieve_lexical,
     should_refuse,
 )
 
@@ -37,15 +47,37 @@ def eval_one(
     threshold: float,
     embedding_model: str,
     answer_model: str,
+    nprobe: Optional[int] = None,
+    retrieval: str = RETRIEVAL_VECTOR,
 ) -> Dict:
-    retrieved = retrieve(
-        question=question,
-        chunks=chunks,
-        embeddings=embeddings,
-        topk=topk,
-        embedding_model=embedding_model,
-    )
-    refused = should_refuse(retrieved, threshold=threshold)
+    q_emb = None
+    if retrieval == RETRIEVAL_LEXICAL:
+        retrieved = retrieve_lexical(question, chunks=chunks, embeddings=embeddings, topk=topk)
+    elif retrieval == RETRIEVAL_HYBRID:
+        q_emb = embed_query(question, model=embedding_model)
+        retrieved = retrieve_hybrid(question, q_emb, chunks=chunks, embeddings=embeddings, topk=topk, nprobe=nprobe)
+    else:
+        q_emb = embed_query(question, model=embedding_model)
+        retrieved = retrieve_by_embedding(
+            q_emb,
+            chunks=chunks,
+            embeddings=embeddings,
+            topk=topk,
+            nprobe=nprobe,
+        )
+
+    # recall@k of the ANN / quantized index against exact float32 search on the same query
+    approx_recall = None
+    approximate = getattr(embeddings, "ann", None) is not None or getattr(embeddings, "quant", None) is not None
+    if retrieval == RETRIEVAL_VECTOR and approximate:
+        exact = retrieve_by_embedding(q_emb, chunks=chunks, embeddings=embeddings, topk=topk, exact=True)
+        exact_ids = {r.chunk.chunk_id for r in exact}
+        if exact_ids:
+            got_ids = {r.chunk.chunk_id for r in retrieved}
+            approx_recall = len(exact_ids & got_ids) / len(exact_ids)
+
+    # BM25 scores are not on the cosine scale: lexical mode only refuses when nothing matched
+    refused = not retrieved if retrieval == RETRIEVAL_LEXICAL else should_refuse(retrieved, threshold=threshold)
 
     evidence_text = "\n".join([r.chunk.text for r in retrieved])
     evidence_norm = _normalize(evidence_text)
@@ -78,6 +110,7 @@ def eval_one(
         "answer_keyword_hit": answer_keyword_hit,
         "should_refuse": should_refuse_flag,
         "refused": refused,
+        "approx_recall": approx_recall,
     }
 
 
@@ -92,20 +125,33 @@ def main() -> None:
     parser.add_argument("--topk", type=int, default=5, help="Top-K")
     parser.add_argument("--threshold", type=float, default=0.35, help="Refusal threshold")
     parser.add_argument("--reindex", action="store_true", help="Force rebuild index")
+    parser.add_argument("--ann", choices=["ivf"], default=None, help="Build an IVF index when reindexing")
+    parser.add_argument("--ann-min-chunks", type=int, default=DEFAULT_ANN_MIN_CHUNKS, help="Exact search below this many chunks")
+    parser.add_argument("--ivf-nlist", type=int, default=None, help="IVF list count")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF lists probed per query")
+    parser.add_argument("--quantize", choices=list(QUANT_TYPES), default=None, help="Store int8 / binary codes when reindexing")
+    parser.add_argument("--rescore", type=int, default=None, help="Quantized candidates per result re-scored in float32")
+    parser.add_argument("--retrieval", choices=list(RETRIEVAL_MODES), default=RETRIEVAL_VECTOR, help="Retrieval mode to evaluate")
     args = parser.parse_args()
 
-    index_dir = Path(args.index_dir)
-    chunks_path = Path(args.chunks_path)
-    if args.reindex or (not index_dir.exists()) or (not chunks_path.exists()):
+    if args.reindex or detect_format(args.index_dir) is None:
         build_index(
             kb_dir=args.kb,
             index_dir=args.index_dir,
             chunks_path=args.chunks_path,
             embedding_model=args.embedding_model,
+            ann=args.ann,
+            ann_min_chunks=args.ann_min_chunks,
+            ivf_nlist=args.ivf_nlist,
+            quantize=args.quantize,
+            rescore=args.rescore,
         )
 
     chunks, embeddings = load_index(index_dir=args.index_dir, chunks_path=args.chunks_path)
     items = load_eval_data(args.eval_path)
+    quant = getattr(embeddings, "quant", None)
+    if quant is not None and args.rescore:
+        quant.rescore = args.rescore
 
     total = 0
     retrieval_total = 0
@@ -114,6 +160,8 @@ def main() -> None:
     answer_hit = 0
     refusal_total = 0
     refusal_hit = 0
+    recall_sum = 0.0
+    recall_total = 0
 
     for item in items:
         question = item.get("question", "")
@@ -132,6 +180,8 @@ def main() -> None:
             threshold=args.threshold,
             embedding_model=args.embedding_model,
             answer_model=args.answer_model,
+            nprobe=args.nprobe,
+            retrieval=args.retrieval,
         )
 
         total += 1
@@ -150,12 +200,27 @@ def main() -> None:
             if result["refused"]:
                 refusal_hit += 1
 
+        if result["approx_recall"] is not None:
+            recall_total += 1
+            recall_sum += result["approx_recall"]
+
     summary = {
         "total": total,
+        "retrieval": args.retrieval,
         "retrieval_hit_rate": (retrieval_hit / retrieval_total) if retrieval_total else 0.0,
         "answer_keyword_hit_rate": (answer_hit / answer_total) if answer_total else 0.0,
         "refusal_accuracy": (refusal_hit / refusal_total) if refusal_total else 0.0,
     }
+    summary["memory"] = {"float32_bytes": embeddings.nbytes}
+    if quant is not None:
+        summary["quantization"] = {"type": quant.kind, "rescore": quant.rescore}
+        summary["memory"]["quantized_bytes"] = quant.nbytes
+        summary["memory"]["ratio"] = round(embeddings.nbytes / quant.nbytes, 1) if quant.nbytes else None
+    if recall_total:
+        ann = embeddings.ann
+        if ann is not None:
+            summary["ann"] = {"type": "ivf", "nlist": ann.nlist, "nprobe": args.nprobe or ann.nprobe}
+        summary[f"recall_at_{args.topk}"] = recall_sum / recall_total
 
     print(json.dumps(summary, ensure_ascii=False, indent=2))
 
@@ -3,6 +3,9 @@ import json
 from pathlib import Path
 
 from app.rag import (
+    RETRIEVAL_LEXICAL,
+    RETRIEVAL_MODES,
+    RETRIEVAL_VECTOR,
     build_index,
     format_citations,
     generate_answer,
@@ -10,6 +13,10 @@ from app.rag import (
     retrieve,
     should_refuse,
 )
+from app.ann import DEFAULT_ANN_MIN_CHUNKS
+from app.embedder import DEFAULT_MAX_BATCH_TOKENS, DEFAULT_MAX_IN_FLIGHT
+from app.index_store import convert_jsonl_index, detect_format, migrate_tree
+from app.quantize import QUANT_TYPES
 
 
 def _refusal_payload(question: str) -> dict:
@@ -35,6 +42,15 @@ def cmd_index(args: argparse.Namespace) -> None:
         max_len=args.max_len,
         overlap=args.overlap,
         batch_size=args.batch_size,
+        ann=args.ann,
+        ann_min_chunks=args.ann_min_chunks,
+        ivf_nlist=args.ivf_nlist,
+        nprobe=args.nprobe,
+        quantize=args.quantize,
+        rescore=args.rescore,
+        incremental=args.incremental,
+        max_in_flight=args.max_in_flight,
+        max_batch_tokens=args.max_batch_tokens,
     )
     print(json.dumps({"ok": True, "stats": stats}, ensure_ascii=False, indent=2))
 
@@ -50,9 +66,14 @@ def cmd_ask(args: argparse.Namespace) -> None:
         embeddings=embeddings,
         topk=args.topk,
         embedding_model=args.embedding_model,
+        nprobe=args.nprobe,
+        exact=args.exact,
+        mode=args.retrieval,
     )
 
-    if should_refuse(retrieved, threshold=args.threshold):
+    # BM25 scores are not on the cosine scale: lexical mode only refuses when nothing matched
+    refused = not retrieved if args.retrieval == RETRIEVAL_LEXICAL else should_refuse(retrieved, threshold=args.threshold)
+    if refused:
         print(json.dumps(_refusal_payload(args.question), ensure_ascii=False, indent=2))
         return
 
@@ -66,13 +87,38 @@ def cmd_ask(args: argparse.Namespace) -> None:
         "question": args.question,
         "refused": False,
         "answer": answer,
-        "top_score": retrieved[0].score if retrieved else None,
+        "top_score": max(r.score for r in retrieved) if retrieved else None,
         "threshold": args.threshold,
+        "retrieval": args.retrieval,
         "citations": format_citations(retrieved),
     }
     print(json.dumps(result, ensure_ascii=False, indent=2))
 
 
+def cmd_convert(args: argparse.Namespace) -> None:
+    if args.kbs_root:
+        converted = migrate_tree(
+            args.kbs_root,
+            embedding_model=args.embedding_model,
+            remove_jsonl=args.remove_jsonl,
+        )
+        print(json.dumps({"ok": True, "converted": converted}, ensure_ascii=False, indent=2))
+        return
+
+    fmt = detect_format(args.index_dir)
+    if fmt != "jsonl":
+        print(json.dumps({"ok": True, "index_dir": args.index_dir, "format": fmt, "converted": False}))
+        return
+    header = convert_jsonl_index(
+        args.index_dir,
+        embedding_model=args.embedding_model,
+        max_len=args.max_len,
+        overlap=args.overlap,
+        remove_jsonl=args.remove_jsonl,
+    )
+    print(json.dumps({"ok": True, "index_dir": args.index_dir, "header": header}, ensure_ascii=False, indent=2))
+
+
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(description="Local KB QA (RAG)")
     sub = p.add_subparsers(dest="command", required=True)
@@ -84,7 +130,16 @@ def build_parser() -> argparse.ArgumentParser:
     p_index.add_argument("--embedding-model", default="text-embedding-3-small", help="Embedding model")
     p_index.add_argument("--max-len", type=int, default=800, help="Max chunk length")
     p_index.add_argument("--overlap", type=int, default=120, help="Chunk overlap length")
-    p_index.add_argument("--batch-size", type=int, default=16, help="Embedding batch size")
+    p_index.add_argument("--batch-size", type=int, default=128, help="Max texts per embedding request")
+    p_index.add_argument("--max-batch-tokens", type=int, default=DEFAULT_MAX_BATCH_TOKENS, help="Max estimated tokens per embedding request")
+    p_index.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Concurrent embedding requests")
+    p_index.add_argument("--ann", choices=["ivf"], default=None, help="Also build an approximate (IVF) index")
+    p_index.add_argument("--ann-min-chunks", type=int, default=DEFAULT_ANN_MIN_CHUNKS, help="Use exact search below this many chunks")
+    p_index.add_argument("--ivf-nlist", type=int, default=None, help="IVF list count (default 4*sqrt(chunks))")
+    p_index.add_argument("--nprobe", type=int, default=None, help="Default IVF lists probed per query")
+    p_index.add_argument("--quantize", choices=list(QUANT_TYPES), default=None, help="Also store int8 or binary codes and search them first")
+    p_index.add_argument("--rescore", type=int, default=None, help="Quantized candidates per result re-scored in float32")
+    p_index.add_argument("--incremental", action="store_true", help="Only re-embed added/changed files")
     p_index.set_defaults(func=cmd_index)
 
     p_ask = sub.add_parser("ask", help="Ask question")
@@ -95,8 +150,25 @@ def build_parser() -> argparse.ArgumentParser:
     p_ask.add_argument("--chunks-path", default="data/chunks.json", help="Chunks JSON path")
     p_ask.add_argument("--embedding-model", default="text-embedding-3-small", help="Embedding model")
     p_ask.add_argument("--model", default="gpt-4o-mini", help="Answer model")
+    p_ask.add_argument("--nprobe", type=int, default=None, help="IVF lists probed (higher = better recall)")
+    p_ask.add_argument("--exact", action="store_true", help="Skip the ANN / quantized index and search exactly")
+    p_ask.add_argument(
+        "--retrieval",
+        choices=list(RETRIEVAL_MODES),
+        default=RETRIEVAL_VECTOR,
+        help="vector, hybrid (vector + BM25, rank fusion) or lexical (BM25 only, no embedding call)",
+    )
     p_ask.set_defaults(func=cmd_ask)
 
+    p_convert = sub.add_parser("convert", help="Convert embeddings.jsonl indexes to the binary format")
+    p_convert.add_argument("--index-dir", default="data/index", help="Index dir to convert")
+    p_convert.add_argument("--kbs-root", default=None, help="Convert every index under this dir (e.g. data/kbs)")
+    p_convert.add_argument("--embedding-model", default="text-embedding-3-small", help="Model recorded in the header")
+    p_convert.add_argument("--max-len", type=int, default=None, help="Chunk length recorded in the header")
+    p_convert.add_argument("--overlap", type=int, default=None, help="Chunk overlap recorded in the header")
+    p_convert.add_argument("--remove-jsonl", action="store_true", help="Delete embeddings.jsonl after converting")
+    p_convert.set_defaults(func=cmd_convert)
+
     return p
 
 
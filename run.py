@@ -1,8 +1,13 @@
+import argparse
+import functools
+import glob
 import json
 import sys
 from pathlib import Path
 from datetime import datetime
+from typing import List, Optional, Tuple
 
+from app.batch import DEFAULT_CONCURRENCY, DEFAULT_MAX_RETRIES, process_many
 from app.pipeline import process_text
 
 
@@ -64,17 +69,7 @@ def to_markdown_report(input_path: Path, source_text: str, result: dict) -> str:
     return "\n".join(md)
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("用法：python run.py <input.txt>")
-        sys.exit(1)
-
-    p = Path(sys.argv[1])
-    text = p.read_text(encoding="utf-8")
-
-    # 调用你的 LLM 文本处理流水线
-    result = process_text(text)
-
+def _write_outputs(p: Path, text: str, result: dict) -> Tuple[Path, Path]:
     # 1) 输出 JSON
     out_json = p.with_suffix(".result.json")
     out_json.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -82,6 +77,75 @@ def main():
     # 2) 输出 Markdown 报告
     out_md = p.with_suffix(".report.md")
     out_md.write_text(to_markdown_report(p, text, result), encoding="utf-8")
+    return out_json, out_md
+
+
+def collect_inputs(target: str) -> List[Path]:
+    """目录（递归 .txt/.md）或通配符模式 -> 待处理文件列表（跳过本工具生成的报告）。"""
+    p = Path(target)
+    if p.is_dir():
+        files = [f for f in p.rglob("*") if f.suffix.lower() in {".txt", ".md"}]
+    else:
+        files = [Path(f) for f in glob.glob(target, recursive=True)]
+    files = [f for f in files if f.is_file() and not f.name.endswith(".report.md")]
+    return sorted(files)
+
+
+def run_batch(
+    files: List[Path],
+    concurrency: int,
+    max_retries: int,
+    jsonl_path: Optional[str],
+    write_files: bool,
+    use_cache: bool = True,
+) -> int:
+    texts = [f.read_text(encoding="utf-8") for f in files]
+    out = open(jsonl_path, "w", encoding="utf-8") if jsonl_path else sys.stdout
+    fn = functools.partial(process_text, use_cache=use_cache)
+    failed = 0
+    try:
+        for done, item in enumerate(process_many(texts, concurrency=concurrency, max_retries=max_retries, fn=fn), 1):
+            src = files[item.index]
+            item.extra["file"] = src.as_posix()
+            if item.ok and write_files:
+                _write_outputs(src, item.text, item.result)
+            if not item.ok:
+                failed += 1
+            out.write(json.dumps(item.to_json(), ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"[{done}/{len(files)}] {'OK ' if item.ok else 'ERR'} {src}", file=sys.stderr)
+    finally:
+        if jsonl_path:
+            out.close()
+    print(f"完成：{len(files) - failed}/{len(files)} 成功", file=sys.stderr)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本处理 CLI：单个文件，或目录 / 通配符批量处理")
+    parser.add_argument("input", help="输入文件、目录或通配符（如 'data/docs/*.txt'）")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="批量模式的并发数")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES, help="批量模式单条失败后的重试次数")
+    parser.add_argument("--jsonl", default=None, help="批量结果 JSONL 输出路径（默认输出到 stdout）")
+    parser.add_argument("--no-files", action="store_true", help="批量模式不为每个文件生成 .result.json/.report.md")
+    parser.add_argument("--no-cache", action="store_true", help="跳过结果缓存，总是调用模型")
+    args = parser.parse_args()
+
+    p = Path(args.input)
+    if p.is_dir() or any(ch in args.input for ch in "*?["):
+        files = collect_inputs(args.input)
+        if not files:
+            print("未找到待处理文件：", args.input)
+            sys.exit(1)
+        failed = run_batch(files, args.concurrency, args.max_retries, args.jsonl, not args.no_files, not args.no_cache)
+        sys.exit(1 if failed else 0)
+
+    text = p.read_text(encoding="utf-8")
+
+    # 调用你的 LLM 文本处理流水线
+    result = process_text(text, use_cache=not args.no_cache)
+
+    out_json, out_md = _write_outputs(p, text, result)
 
     print("已生成：", out_json)
     print("已生成：", out_md)
@@ -4,7 +4,7 @@ from fastapi import APIRouter, File, Form, UploadFile, Depends
 
 from server.api.deps import get_current_user
 from server.services.kb_store import list_kbs, save_upload_files
-from server.services.rag_service import build_index_for_kb
+from server.services.index_jobs import get_index_status, submit_index_job
 
 router = APIRouter(prefix="/api/kb", tags=["kb"])
 
@@ -24,7 +24,20 @@ async def upload_kb(
     return await save_upload_files(user_id=user["id"], files=files, kb_id=kb_id, kb_name=kb_name)
 
 
-@router.post("/{kb_id}/index")
+@router.post("/{kb_id}/index", status_code=202)
 def index_kb(kb_id: str, user: dict = Depends(get_current_user)) -> dict:
-    stats = build_index_for_kb(user_id=user["id"], kb_id=kb_id)
-    return {"ok": True, "kb_id": kb_id, "stats": stats}
+    result = submit_index_job(user_id=user["id"], kb_id=kb_id)
+    job = result["job"]
+    return {
+        "ok": True,
+        "kb_id": kb_id,
+        "job_id": job["id"],
+        "status": job["status"],
+        "coalesced": result["coalesced"],
+        "job": job,
+    }
+
+
+@router.get("/{kb_id}/index/status")
+def index_status(kb_id: str, user: dict = Depends(get_current_user)) -> dict:
+    return get_index_status(user_id=user["id"], kb_id=kb_id)
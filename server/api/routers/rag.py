@@ -1,16 +1,23 @@
-﻿from time import perf_counter
+﻿from datetime import datetime
+from time import perf_counter
+from typing import Literal, Optional
+import asyncio
+import json
 import traceback
 
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from server.api.deps import get_current_user
-from server.services.rag_service import ask_kb
+from server.services.external_errors import raise_external_error
+from server.services.rag_service import ask_kb_async, prepare_ask, stream_answer
 from server.services.history_store import (
     get_rag_history,
-    list_rag_history,
-    normalize_limit,
+    page_rag_history,
     record_rag_history,
+    search_rag_history,
+    to_ts_ms,
 )
 
 router = APIRouter(prefix="/api/rag", tags=["rag"])
@@ -23,13 +30,35 @@ class RagAskRequest(BaseModel):
     threshold: float = Field(0.35, ge=0.0, le=1.0)
     embedding_model: str = Field("text-embedding-3-small")
     model: str = Field("gpt-4o-mini")
+    # vector | hybrid | lexical; defaults to RAG_RETRIEVAL (vector)
+    retrieval: Optional[Literal["vector", "hybrid", "lexical"]] = None
+
+
+def _record_error(req: RagAskRequest, user_id: str, start: float, exc: Exception, error_trace: str) -> None:
+    try:
+        record_rag_history(
+            user_id=user_id,
+            kb_id=req.kb_id,
+            question=req.question,
+            topk=req.topk,
+            threshold=req.threshold,
+            embedding_model=req.embedding_model,
+            model=req.model,
+            result=None,
+            status="error",
+            duration_ms=int((perf_counter() - start) * 1000),
+            error=exc,
+            error_trace=error_trace,
+        )
+    except Exception:
+        pass
 
 
 @router.post("/ask")
-def ask(req: RagAskRequest, user: dict = Depends(get_current_user)) -> dict:
+async def ask(req: RagAskRequest, user: dict = Depends(get_current_user)) -> dict:
     start = perf_counter()
     try:
-        result = ask_kb(
+        result = await ask_kb_async(
             user_id=user["id"],
             kb_id=req.kb_id,
             question=req.question,
@@ -37,32 +66,17 @@ def ask(req: RagAskRequest, user: dict = Depends(get_current_user)) -> dict:
             threshold=req.threshold,
             embedding_model=req.embedding_model,
             model=req.model,
+            retrieval=req.retrieval,
         )
     except Exception as exc:
-        duration_ms = int((perf_counter() - start) * 1000)
-        try:
-            record_rag_history(
-                user_id=user["id"],
-                kb_id=req.kb_id,
-                question=req.question,
-                topk=req.topk,
-                threshold=req.threshold,
-                embedding_model=req.embedding_model,
-                model=req.model,
-                result=None,
-                status="error",
-                duration_ms=duration_ms,
-                error=exc,
-                error_trace=traceback.format_exc(),
-            )
-        except Exception:
-            pass
+        await asyncio.to_thread(_record_error, req, user["id"], start, exc, traceback.format_exc())
         raise
 
     duration_ms = int((perf_counter() - start) * 1000)
     status = "refused" if result.get("refused") else "success"
     try:
-        record_rag_history(
+        await asyncio.to_thread(
+            record_rag_history,
             user_id=user["id"],
             kb_id=req.kb_id,
             question=req.question,
@@ -79,11 +93,131 @@ def ask(req: RagAskRequest, user: dict = Depends(get_current_user)) -> dict:
     return result
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/ask/stream")
+def ask_stream(req: RagAskRequest, user: dict = Depends(get_current_user)) -> StreamingResponse:
+    start = perf_counter()
+    # Retrieval runs before the response starts so 404/429/5xx keep their status codes
+    try:
+        prepared = prepare_ask(
+            user_id=user["id"],
+            kb_id=req.kb_id,
+            question=req.question,
+            topk=req.topk,
+            threshold=req.threshold,
+            embedding_model=req.embedding_model,
+            model=req.model,
+            retrieval=req.retrieval,
+        )
+    except Exception as exc:
+        _record_error(req, user["id"], start, exc, traceback.format_exc())
+        raise
+
+    def events():
+        parts = []
+        result = None
+        error = None
+        error_trace = None
+        try:
+            for event, data in stream_answer(prepared, question=req.question, model=req.model):
+                if event == "delta":
+                    parts.append(data["text"])
+                elif event == "done":
+                    result = data
+                yield _sse(event, data)
+        except Exception as exc:
+            error = exc
+            error_trace = traceback.format_exc()
+            try:
+                raise_external_error(exc, action="answer generation")
+            except HTTPException as http_exc:
+                yield _sse("error", {"status_code": http_exc.status_code, "detail": http_exc.detail})
+        finally:
+            # Also runs when the client disconnects and the generator is closed
+            if result is not None:
+                status = "refused" if result.get("refused") else "success"
+            elif error is not None:
+                status = "error"
+            else:
+                status = "cancelled"
+            if result is None:
+                result = {**prepared.result, "answer": "".join(parts).strip() or None}
+            try:
+                record_rag_history(
+                    user_id=user["id"],
+                    kb_id=req.kb_id,
+                    question=req.question,
+                    topk=req.topk,
+                    threshold=req.threshold,
+                    embedding_model=req.embedding_model,
+                    model=req.model,
+                    result=result,
+                    status=status,
+                    duration_ms=int((perf_counter() - start) * 1000),
+                    error=error,
+                    error_trace=error_trace,
+                )
+            except Exception:
+                pass
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/history")
-def list_history(limit: int = 50, user: dict = Depends(get_current_user)) -> dict:
-    safe_limit = normalize_limit(limit)
-    items = list_rag_history(user["id"], safe_limit)
-    return {"items": items, "limit": safe_limit}
+def list_history(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    kb_id: Optional[str] = None,
+    refused: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user: dict = Depends(get_current_user),
+) -> dict:
+    """Newest first; pass the returned ``next_cursor`` back as ``cursor`` for the next page."""
+    try:
+        return page_rag_history(
+            user["id"],
+            limit,
+            cursor=cursor,
+            status=status,
+            kb_id=kb_id,
+            refused=refused,
+            since_ts=to_ts_ms(since),
+            until_ts=to_ts_ms(until),
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@router.get("/history/search")
+def search_history(
+    q: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    kb_id: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+) -> dict:
+    """Full-text search over the caller's history, best match first; page with ``next_cursor``."""
+    try:
+        return search_rag_history(
+            user["id"],
+            q,
+            limit,
+            cursor=cursor,
+            status=status,
+            kb_id=kb_id,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
 
 @router.get("/history/{history_id}")
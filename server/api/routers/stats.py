@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends
+
+from app.embed_cache import get_embedding_cache
+from app.query_cache import get_query_cache
+from app.rate_limiter import get_rate_limiter
+from app.result_cache import get_result_cache
+from server.api.deps import get_current_user
+from server.services.answer_cache import get_answer_cache
+from server.services.history_store import history_writer_stats
+from server.services.index_cache import get_index_cache
+from server.services.index_jobs import index_job_stats
+
+router = APIRouter(prefix="/api/stats", tags=["stats"])
+
+
+@router.get("")
+def stats(user: dict = Depends(get_current_user)) -> dict:
+    embed_cache = get_embedding_cache()
+    query_cache = get_query_cache()
+    answer_cache = get_answer_cache()
+    result_cache = get_result_cache()
+    return {
+        "index_cache": get_index_cache().stats(),
+        "embed_cache": embed_cache.stats() if embed_cache else None,
+        "query_cache": query_cache.stats() if query_cache else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "result_cache": result_cache.stats() if result_cache else None,
+        "rate_limiter": get_rate_limiter().stats(),
+        "history_writer": history_writer_stats(),
+        "index_jobs": index_job_stats(),
+    }
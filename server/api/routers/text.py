@@ -1,35 +1,61 @@
-﻿from time import perf_counter
+﻿from datetime import datetime
+from time import perf_counter
+from typing import List, Optional
+import asyncio
+import json
 import traceback
 
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from app.pipeline import process_text
+from app.batch import DEFAULT_CONCURRENCY, DEFAULT_MAX_RETRIES, process_many_async
+from app.pipeline import process_text_cached_async
 from server.api.deps import get_current_user
 from server.services.external_errors import raise_external_error
 from server.services.history_store import (
     get_text_history,
-    list_text_history,
-    normalize_limit,
+    page_text_history,
     record_text_history,
+    record_text_history_bulk,
+    search_text_history,
+    to_ts_ms,
 )
 
 router = APIRouter(prefix="/api/text", tags=["text"])
 
 
+# History rows from a batch are written in groups of this many
+BATCH_HISTORY_FLUSH = 50
+
+
 class TextProcessRequest(BaseModel):
     text: str = Field(..., min_length=1, description="Input text")
+    bypass_cache: bool = Field(False, description="Skip the result cache and call the model")
+
+
+class BatchItem(BaseModel):
+    id: Optional[str] = Field(None, description="Caller-side id echoed back in the result line")
+    text: str = Field(..., min_length=1)
+
+
+class TextBatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1, max_length=1000)
+    concurrency: int = Field(DEFAULT_CONCURRENCY, ge=1, le=32)
+    max_retries: int = Field(DEFAULT_MAX_RETRIES, ge=0, le=5)
+    bypass_cache: bool = False
 
 
 @router.post("/process")
-def process(req: TextProcessRequest, user: dict = Depends(get_current_user)) -> dict:
+async def process(req: TextProcessRequest, user: dict = Depends(get_current_user)) -> dict:
     start = perf_counter()
     try:
-        result = process_text(req.text)
+        result, cached = await process_text_cached_async(req.text, use_cache=not req.bypass_cache)
     except Exception as exc:
         duration_ms = int((perf_counter() - start) * 1000)
         try:
-            record_text_history(
+            await asyncio.to_thread(
+                record_text_history,
                 user_id=user["id"],
                 input_text=req.text,
                 result=None,
@@ -43,23 +69,126 @@ def process(req: TextProcessRequest, user: dict = Depends(get_current_user)) ->
         raise_external_error(exc, action="text processing")
     duration_ms = int((perf_counter() - start) * 1000)
     try:
-        record_text_history(
+        await asyncio.to_thread(
+            record_text_history,
             user_id=user["id"],
             input_text=req.text,
             result=result,
             status="success",
             duration_ms=duration_ms,
+            cached=cached,
         )
     except Exception:
         pass
     return result
 
 
+@router.post("/process_batch")
+async def process_batch(req: TextBatchRequest, user: dict = Depends(get_current_user)) -> StreamingResponse:
+    """Stream one JSON line per item as it finishes, then a summary line."""
+    texts = [item.text for item in req.items]
+    ids = [item.id for item in req.items]
+
+    async def lines():
+        pending_history = []
+        succeeded = failed = 0
+
+        async def flush() -> None:
+            if not pending_history:
+                return
+            records = list(pending_history)
+            pending_history.clear()
+            try:
+                await asyncio.to_thread(record_text_history_bulk, user["id"], records)
+            except Exception:
+                pass
+
+        async def run(text: str):
+            return await process_text_cached_async(text, use_cache=not req.bypass_cache)
+
+        batch = process_many_async(
+            texts,
+            concurrency=req.concurrency,
+            max_retries=req.max_retries,
+            fn=run,
+        )
+        try:
+            async for item in batch:
+                cached = False
+                if item.ok:
+                    succeeded += 1
+                    item.result, cached = item.result
+                    item.extra["cached"] = cached
+                else:
+                    failed += 1
+                pending_history.append(
+                    {
+                        "input_text": item.text,
+                        "result": item.result,
+                        "status": "success" if item.ok else "error",
+                        "duration_ms": item.duration_ms,
+                        "error": item.error,
+                        "error_trace": item.error_trace,
+                        "cached": cached,
+                    }
+                )
+                if ids[item.index] is not None:
+                    item.extra["id"] = ids[item.index]
+                yield json.dumps(item.to_json(), ensure_ascii=False) + "\n"
+                if len(pending_history) >= BATCH_HISTORY_FLUSH:
+                    await flush()
+            summary = {"total": len(texts), "succeeded": succeeded, "failed": failed}
+            yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+        finally:
+            # Runs on client disconnect as well: cancel unfinished items, keep finished ones
+            await batch.aclose()
+            await flush()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @router.get("/history")
-def list_history(limit: int = 50, user: dict = Depends(get_current_user)) -> dict:
-    safe_limit = normalize_limit(limit)
-    items = list_text_history(user["id"], safe_limit)
-    return {"items": items, "limit": safe_limit}
+def list_history(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user: dict = Depends(get_current_user),
+) -> dict:
+    """Newest first; pass the returned ``next_cursor`` back as ``cursor`` for the next page."""
+    try:
+        return page_text_history(
+            user["id"],
+            limit,
+            cursor=cursor,
+            status=status,
+            since_ts=to_ts_ms(since),
+            until_ts=to_ts_ms(until),
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@router.get("/history/search")
+def search_history(
+    q: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+) -> dict:
+    """Full-text search over the caller's history, best match first; page with ``next_cursor``."""
+    try:
+        return search_text_history(
+            user["id"],
+            q,
+            limit,
+            cursor=cursor,
+            status=status,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
 
 @router.get("/history/{history_id}")
@@ -1,8 +1,19 @@
-﻿from fastapi import FastAPI
+﻿from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from client import aclose_clients, close_clients
 from config import load_env
-from server.api.routers import auth, kb, rag, text
+from server.api.routers import auth, kb, rag, stats, text
+from server.services.db import close_connections
+from server.services.history_store import (
+    shutdown_history_writer,
+    start_history_maintenance,
+    start_history_writer,
+    stop_history_maintenance,
+)
+from server.services.index_jobs import resume_index_jobs, shutdown_index_jobs
 
 
 ALLOWED_ORIGINS = [
@@ -11,9 +22,25 @@ ALLOWED_ORIGINS = [
 ]
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_history_writer()
+    start_history_maintenance()
+    # Pick up index builds queued or interrupted before the restart
+    resume_index_jobs()
+    yield
+    shutdown_index_jobs()
+    stop_history_maintenance()
+    # Drain queued history rows before the DB connections go away
+    shutdown_history_writer()
+    await aclose_clients()
+    close_clients()
+    close_connections()
+
+
 def create_app() -> FastAPI:
     load_env()
-    app = FastAPI(title="LLM + RAG Web API", version="1.0.0")
+    app = FastAPI(title="LLM + RAG Web API", version="1.0.0", lifespan=lifespan)
 
     app.add_middleware(
         CORSMiddleware,
@@ -27,6 +54,7 @@ def create_app() -> FastAPI:
     app.include_router(text.router)
     app.include_router(kb.router)
     app.include_router(rag.router)
+    app.include_router(stats.router)
 
     @app.get("/health")
     def health() -> dict:
@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.query_cache import normalize_question
+from app.vector_index import normalize_vector
+
+
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_TTL_SECONDS = 60 * 60
+DEFAULT_SIM_THRESHOLD = 0.97
+
+MATCH_EXACT = "exact"
+MATCH_SEMANTIC = "semantic"
+
+# (user_id, kb_id, index_version, model, retrieved chunk ids)
+GroupKey = Tuple[str, str, str, str, Tuple[str, ...]]
+EntryKey = Tuple[GroupKey, str]
+
+
+class _Entry:
+    __slots__ = ("created", "q_vec", "answer")
+
+    def __init__(self, created: float, q_vec: np.ndarray, answer: str) -> None:
+        self.created = created
+        self.q_vec = q_vec
+        self.answer = answer
+
+
+def make_group_key(
+    user_id: str,
+    kb_id: str,
+    index_version: str,
+    model: str,
+    chunk_ids: Sequence[str],
+) -> GroupKey:
+    return (user_id, kb_id, index_version, model, tuple(chunk_ids))
+
+
+class AnswerCache:
+    """Generated answers keyed by KB index version, model and retrieved chunk ids.
+
+    Within one group (same evidence, same model, same index build) a
+    question hits either exactly (normalized text) or semantically, when
+    its embedding is at least ``sim_threshold`` cosine-similar to a cached
+    question. ``sim_threshold`` <= 0 disables the semantic lookup.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        sim_threshold: float = DEFAULT_SIM_THRESHOLD,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sim_threshold = sim_threshold
+        self._entries: "OrderedDict[EntryKey, _Entry]" = OrderedDict()
+        self._groups: Dict[GroupKey, Dict[str, None]] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _drop(self, key: EntryKey) -> None:
+        self._entries.pop(key, None)
+        group = self._groups.get(key[0])
+        if group is not None:
+            group.pop(key[1], None)
+            if not group:
+                del self._groups[key[0]]
+
+    def get(
+        self,
+        group: GroupKey,
+        question: str,
+        q_emb: Optional[Sequence[float]] = None,
+    ) -> Optional[Tuple[str, str]]:
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((group, normalized))
+            if entry is not None and now - entry.created <= self.ttl_seconds:
+                self._entries.move_to_end((group, normalized))
+                self.exact_hits += 1
+                return entry.answer, MATCH_EXACT
+
+            if q_emb is not None and self.sim_threshold > 0:
+                q = normalize_vector(q_emb)
+                best_key: Optional[EntryKey] = None
+                best_score = self.sim_threshold
+                for other in list(self._groups.get(group, {})):
+                    key = (group, other)
+                    cand = self._entries[key]
+                    if now - cand.created > self.ttl_seconds:
+                        self._drop(key)
+                        continue
+                    if cand.q_vec.shape != q.shape:
+                        continue
+                    score = float(cand.q_vec @ q)
+                    if score >= best_score:
+                        best_key, best_score = key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key].answer, MATCH_SEMANTIC
+
+            self.misses += 1
+        return None
+
+    def put(
+        self,
+        group: GroupKey,
+        question: str,
+        q_emb: Sequence[float],
+        answer: str,
+    ) -> None:
+        key = (group, normalize_question(question))
+        with self._lock:
+            self._entries[key] = _Entry(time.time(), normalize_vector(q_emb), answer)
+            self._entries.move_to_end(key)
+            self._groups.setdefault(group, {})[key[1]] = None
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str, kb_id: Optional[str] = None) -> int:
+        with self._lock:
+            keys: List[EntryKey] = [
+                k for k in self._entries
+                if k[0][0] == user_id and (kb_id is None or k[0][1] == kb_id)
+            ]
+            for k in keys:
+                self._drop(k)
+        return len(keys)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "sim_threshold": self.sim_threshold,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+_caches: Dict[Tuple, AnswerCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Process-wide cache from ANSWER_CACHE_MAX_ENTRIES / _TTL_SECONDS / _SIM_THRESHOLD (0 entries disables)."""
+    max_entries = int(_env_number("ANSWER_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    if max_entries <= 0:
+        return None
+    ttl = _env_number("ANSWER_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)
+    sim_threshold = _env_number("ANSWER_CACHE_SIM_THRESHOLD", DEFAULT_SIM_THRESHOLD)
+    config = (max_entries, ttl, sim_threshold)
+    with _caches_lock:
+        cache = _caches.get(config)
+        if cache is None:
+            cache = AnswerCache(max_entries=max_entries, ttl_seconds=ttl, sim_threshold=sim_threshold)
+            _caches[config] = cache
+        return cache
+
+
+def invalidate_answers(user_id: str, kb_id: Optional[str] = None) -> int:
+    with _caches_lock:
+        caches = list(_caches.values())
+    return sum(cache.invalidate(user_id, kb_id) for cache in caches)
@@ -1,11 +1,26 @@
 ﻿import os
 import sqlite3
+import threading
+import weakref
 from pathlib import Path
+from typing import Dict, Set
 
 from server.services.paths import BASE_DIR, DATA_DIR
 
 
-SCHEMA_VERSION = 2
+SCHEMA_VERSION = 9
+
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_CACHE_SIZE_KB = 16 * 1024
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+
+_local = threading.local()
+_schema_ready: Set[str] = set()
+_schema_lock = threading.Lock()
+# Bumped by close_connections() so every thread drops its closed handles
+_generation = 0
+_open_conns: "weakref.WeakSet[sqlite3.Connection]" = weakref.WeakSet()
+_open_conns_lock = threading.Lock()
 
 
 def _resolve_db_path() -> Path:
@@ -24,6 +39,65 @@ def get_db_path() -> Path:
     return _resolve_db_path()
 
 
+def _add_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# Full-text indexes over history, kept in sync by triggers on every write path
+# (history writer, retention trims, user deletion). External content: the FTS
+# tables store only the index and read text back from the history tables by rowid.
+_FTS_TABLES = {
+    "history_text": ("input_text", "summary_short"),
+    "history_rag": ("question", "answer"),
+}
+
+
+def _ensure_fts(conn: sqlite3.Connection) -> None:
+    for table, columns in _FTS_TABLES.items():
+        fts = f"{table}_fts"
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).fetchone()
+        if exists:
+            continue
+        cols = ", ".join(columns)
+        new_vals = ", ".join(f"new.{c}" for c in columns)
+        old_vals = ", ".join(f"old.{c}" for c in columns)
+        try:
+            # trigram: substring matching that works for Chinese without word segmentation
+            conn.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5("
+                f"{cols}, content='{table}', content_rowid='rowid', tokenize='trigram')"
+            )
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 / trigram (< 3.34): search falls back to LIKE
+            return
+        conn.executescript(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {cols}) VALUES (new.rowid, {new_vals});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_vals});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_vals});
+                INSERT INTO {fts} (rowid, {cols}) VALUES (new.rowid, {new_vals});
+            END;
+            """
+        )
+        # Index rows written before the FTS table existed
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def has_fts(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table}_fts",)
+    ).fetchone() is not None
+
+
 def _ensure_schema(conn: sqlite3.Connection) -> None:
     cur = conn.execute("PRAGMA user_version")
     row = cur.fetchone()
@@ -52,6 +126,7 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
             index_chunks INTEGER,
             index_dir TEXT,
             chunks_path TEXT,
+            index_build_id TEXT,
             index_updated_at TEXT,
             UNIQUE (user_id, id)
         );
@@ -79,12 +154,16 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
             input_preview TEXT NOT NULL,
             summary_short TEXT,
             output_json TEXT,
+            cached INTEGER NOT NULL DEFAULT 0,
             error_type TEXT,
             error_message TEXT,
             error_trace TEXT
         );
-        CREATE INDEX IF NOT EXISTS idx_history_text_user_ts
-            ON history_text (user_id, created_ts DESC);
+        CREATE INDEX IF NOT EXISTS idx_history_text_user_ts_id
+            ON history_text (user_id, created_ts, id);
+        CREATE INDEX IF NOT EXISTS idx_history_text_user_status_ts
+            ON history_text (user_id, status, created_ts, id);
+        CREATE INDEX IF NOT EXISTS idx_history_text_ts ON history_text (created_ts);
 
         CREATE TABLE IF NOT EXISTS history_rag (
             id TEXT PRIMARY KEY,
@@ -106,23 +185,132 @@ def _ensure_schema(conn: sqlite3.Connection) -> None:
             top_score REAL,
             citations_json TEXT,
             reason TEXT,
+            cached INTEGER NOT NULL DEFAULT 0,
             error_type TEXT,
             error_message TEXT,
             error_trace TEXT
         );
-        CREATE INDEX IF NOT EXISTS idx_history_rag_user_ts
-            ON history_rag (user_id, created_ts DESC);
+        CREATE INDEX IF NOT EXISTS idx_history_rag_user_ts_id
+            ON history_rag (user_id, created_ts, id);
+        CREATE INDEX IF NOT EXISTS idx_history_rag_user_status_ts
+            ON history_rag (user_id, status, created_ts, id);
+        CREATE INDEX IF NOT EXISTS idx_history_rag_user_kb_ts
+            ON history_rag (user_id, kb_id, created_ts, id);
+        CREATE INDEX IF NOT EXISTS idx_history_rag_user_refused_ts
+            ON history_rag (user_id, refused, created_ts, id);
+        CREATE INDEX IF NOT EXISTS idx_history_rag_ts ON history_rag (created_ts);
+
+        CREATE TABLE IF NOT EXISTS index_jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            kb_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            created_ts INTEGER NOT NULL,
+            started_ts INTEGER,
+            finished_ts INTEGER,
+            heartbeat_ts INTEGER,
+            submissions INTEGER NOT NULL DEFAULT 1,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            progress_json TEXT,
+            stats_json TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_index_jobs_status_ts ON index_jobs (status, created_ts);
+        CREATE INDEX IF NOT EXISTS idx_index_jobs_user_kb_ts ON index_jobs (user_id, kb_id, created_ts);
+        -- At most one queued build per KB: repeated submissions coalesce into it
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_index_jobs_queued_kb
+            ON index_jobs (user_id, kb_id) WHERE status = 'queued';
         """
     )
+    # Tables created by older versions are not touched by CREATE TABLE IF NOT EXISTS
+    _add_column(conn, "history_rag", "cached", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "history_text", "cached", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "kb", "index_build_id", "TEXT")
+    # Superseded by the (user_id, created_ts, id) keyset indexes
+    conn.execute("DROP INDEX IF EXISTS idx_history_text_user_ts")
+    conn.execute("DROP INDEX IF EXISTS idx_history_rag_user_ts")
+    _ensure_fts(conn)
     conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
 
 
-def get_conn() -> sqlite3.Connection:
-    path = get_db_path()
-    path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(path))
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        return default
+
+
+class _PooledConnection(sqlite3.Connection):
+    # Subclass only so the connection can be tracked weakly; a thread's
+    # connection is closed when the thread (and its thread-local) goes away
+    pass
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    # check_same_thread=False only so close_connections() can close it at shutdown;
+    # each connection is otherwise used by the thread that opened it
+    conn = sqlite3.connect(str(path), check_same_thread=False, factory=_PooledConnection)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
-    _ensure_schema(conn)
+    conn.execute(f"PRAGMA busy_timeout = {_env_int('DB_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{_env_int('DB_CACHE_SIZE_KB', DEFAULT_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {_env_int('DB_MMAP_SIZE', DEFAULT_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
     return conn
+
+
+def _prepare_db(path: Path, conn: sqlite3.Connection) -> None:
+    key = str(path)
+    if key in _schema_ready:
+        return
+    with _schema_lock:
+        if key in _schema_ready:
+            return
+        # WAL is persistent in the file: readers no longer block the writer
+        conn.execute("PRAGMA journal_mode = WAL")
+        _ensure_schema(conn)
+        _schema_ready.add(key)
+
+
+def get_conn() -> sqlite3.Connection:
+    """Return this thread's connection to the current DB_PATH, opening it once.
+
+    Use as ``with get_conn() as conn:`` -- the block commits or rolls back but
+    leaves the connection open for the next call on the same thread.
+    """
+    path = get_db_path()
+    conns: Dict[str, sqlite3.Connection] = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "generation", None) != _generation:
+        conns = _local.conns = {}
+        _local.generation = _generation
+    conn = conns.get(str(path))
+    if conn is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = _connect(path)
+        conns[str(path)] = conn
+        with _open_conns_lock:
+            _open_conns.add(conn)
+    _prepare_db(path, conn)
+    return conn
+
+
+def close_connections() -> None:
+    """Close every pooled connection (app shutdown); threads reconnect on next use."""
+    global _generation
+    with _open_conns_lock:
+        conns = list(_open_conns)
+        _open_conns.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    with _schema_lock:
+        _schema_ready.clear()
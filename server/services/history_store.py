@@ -1,13 +1,26 @@
-﻿import json
+﻿import base64
+import binascii
+import json
+import logging
 import os
+import threading
 import time
 import uuid
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from server.services.db import get_conn
+from server.services.db import get_conn, has_fts
+from server.services.history_writer import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_FLUSH_INTERVAL,
+    DEFAULT_MAX_QUEUE,
+    HistoryWriter,
+    WriteItem,
+)
 
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_MAX_RECORDS = 100
 PREVIEW_LEN = 120
 ERROR_MESSAGE_MAX = 500
@@ -59,21 +72,34 @@ def normalize_limit(limit: int) -> int:
     return min(limit, max_records)
 
 
-def _trim_table(conn, table: str, user_id: str) -> None:
-    max_records = get_max_records()
-    conn.execute(
+def _trim_user(conn, table: str, user_id: str, keep: int) -> int:
+    # Walks idx_*_user_ts_id past the newest `keep` rows; cost is O(rows of this user), no NOT IN
+    cur = conn.execute(
         f"""
-        DELETE FROM {table}
-        WHERE user_id = ?
-        AND id NOT IN (
-            SELECT id FROM {table}
+        DELETE FROM {table} WHERE rowid IN (
+            SELECT rowid FROM {table}
             WHERE user_id = ?
-            ORDER BY created_ts DESC
-            LIMIT ?
+            ORDER BY created_ts DESC, id DESC
+            LIMIT -1 OFFSET ?
         )
         """,
-        (user_id, user_id, max_records),
+        (user_id, keep),
     )
+    return max(cur.rowcount, 0)
+
+
+def _retention_floor(conn, table: str, user_id: str) -> Optional[Tuple[int, str]]:
+    """(created_ts, id) of the user's oldest row still within HISTORY_LIMIT, if over it."""
+    # Same index walk as _trim_user, so reads agree with what the next trim keeps
+    return conn.execute(
+        f"""
+        SELECT created_ts, id FROM {table}
+        WHERE user_id = ?
+        ORDER BY created_ts DESC, id DESC
+        LIMIT 1 OFFSET ?
+        """,
+        (user_id, get_max_records() - 1),
+    ).fetchone()
 
 
 def _serialize_json(value: Optional[Any]) -> Optional[str]:
@@ -104,7 +130,17 @@ def _error_fields(error: Optional[Exception], error_trace: Optional[str]) -> Dic
     }
 
 
-def record_text_history(
+_TEXT_INSERT = """
+    INSERT INTO history_text (
+        id, user_id, created_at, created_ts, duration_ms, status,
+        input_text, input_preview, summary_short, output_json, cached,
+        error_type, error_message, error_trace
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _text_history_row(
     *,
     user_id: str,
     input_text: str,
@@ -113,43 +149,76 @@ def record_text_history(
     duration_ms: int,
     error: Optional[Exception] = None,
     error_trace: Optional[str] = None,
-) -> str:
-    history_id = uuid.uuid4().hex
-    created_at = _now_iso()
-    created_ts = _now_ts_ms()
+    cached: bool = False,
+) -> tuple:
     summary_short = result.get("summary_short") if result else None
     output_json = _serialize_json(result) if result else None
-
     errors = _error_fields(error, error_trace)
+    return (
+        uuid.uuid4().hex,
+        user_id,
+        _now_iso(),
+        _now_ts_ms(),
+        int(duration_ms),
+        status,
+        input_text,
+        _preview(input_text),
+        summary_short,
+        output_json,
+        1 if cached else 0,
+        errors["error_type"],
+        errors["error_message"],
+        errors["error_trace"],
+    )
 
-    with get_conn() as conn:
-        conn.execute(
-            """
-            INSERT INTO history_text (
-                id, user_id, created_at, created_ts, duration_ms, status,
-                input_text, input_preview, summary_short, output_json,
-                error_type, error_message, error_trace
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                history_id,
-                user_id,
-                created_at,
-                created_ts,
-                int(duration_ms),
-                status,
-                input_text,
-                _preview(input_text),
-                summary_short,
-                output_json,
-                errors["error_type"],
-                errors["error_message"],
-                errors["error_trace"],
-            ),
-        )
-        _trim_table(conn, "history_text", user_id)
-    return history_id
+
+def record_text_history(
+    *,
+    user_id: str,
+    input_text: str,
+    result: Optional[Dict[str, Any]],
+    status: str,
+    duration_ms: int,
+    error: Optional[Exception] = None,
+    error_trace: Optional[str] = None,
+    cached: bool = False,
+) -> str:
+    row = _text_history_row(
+        user_id=user_id,
+        input_text=input_text,
+        result=result,
+        status=status,
+        duration_ms=duration_ms,
+        error=error,
+        error_trace=error_trace,
+        cached=cached,
+    )
+    _submit("history_text", user_id, [row])
+    return row[0]
+
+
+def record_text_history_bulk(user_id: str, records: List[Dict[str, Any]]) -> List[str]:
+    """Insert many history_text rows in one transaction.
+
+    Each record takes the keyword arguments of :func:`record_text_history`
+    except ``user_id``.
+    """
+    if not records:
+        return []
+    rows = [_text_history_row(user_id=user_id, **record) for record in records]
+    _submit("history_text", user_id, rows)
+    return [row[0] for row in rows]
+
+
+_RAG_INSERT = """
+    INSERT INTO history_rag (
+        id, user_id, kb_id, created_at, created_ts, duration_ms, status,
+        question, question_preview, topk, threshold,
+        embedding_model, model, refused, answer, answer_preview,
+        top_score, citations_json, reason, cached, error_type, error_message, error_trace
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
 
 def record_rag_history(
@@ -175,75 +244,483 @@ def record_rag_history(
     top_score = result.get("top_score") if result else None
     refused = result.get("refused") if result else None
     reason = result.get("reason") if result else None
+    cached = bool(result.get("cached")) if result else False
     citations_json = _serialize_json(result.get("citations")) if result else None
 
     errors = _error_fields(error, error_trace)
 
+    row = (
+        history_id,
+        user_id,
+        kb_id,
+        created_at,
+        created_ts,
+        int(duration_ms),
+        status,
+        question,
+        _preview(question),
+        int(topk),
+        float(threshold),
+        embedding_model,
+        model,
+        1 if refused else 0 if refused is not None else None,
+        answer,
+        _preview(answer),
+        top_score,
+        citations_json,
+        reason,
+        1 if cached else 0,
+        errors["error_type"],
+        errors["error_message"],
+        errors["error_trace"],
+    )
+    _submit("history_rag", user_id, [row])
+    return history_id
+
+
+_INSERTS = {"history_text": _TEXT_INSERT, "history_rag": _RAG_INSERT}
+
+_writer: Optional[HistoryWriter] = None
+_writer_lock = threading.Lock()
+
+# Retention is amortized: a user is trimmed after every HISTORY_TRIM_EVERY inserts
+# (so at most that many rows over HISTORY_LIMIT; list and search queries stop at
+# the user's newest HISTORY_LIMIT rows, so the extra rows are never returned),
+# and global / age limits are applied by a background compaction pass every
+# HISTORY_COMPACT_INTERVAL seconds, never on the write path
+DEFAULT_TRIM_EVERY = 50
+DEFAULT_COMPACT_INTERVAL = 300.0
+
+_retention_lock = threading.Lock()
+_inserts_since_trim: Dict[tuple, int] = {}
+_maintenance: Optional[Tuple[threading.Thread, threading.Event]] = None
+_retention_stats = {"trims": 0, "trimmed_rows": 0, "compactions": 0, "compacted_rows": 0}
+
+
+def _count_inserts(key: tuple, count: int, trim_every: int) -> bool:
+    with _retention_lock:
+        total = _inserts_since_trim.get(key, 0) + count
+        if total >= trim_every:
+            _inserts_since_trim.pop(key, None)
+            return True
+        _inserts_since_trim[key] = total
+        return False
+
+
+def _compact(conn) -> Dict[str, int]:
+    per_user = get_max_records()
+    global_max = int(_env_number("HISTORY_GLOBAL_MAX_RECORDS", 0))
+    max_age_days = _env_number("HISTORY_MAX_AGE_DAYS", 0)
+    deleted: Dict[str, int] = {}
+    for table in _INSERTS:
+        removed = 0
+        over = conn.execute(
+            f"SELECT user_id FROM {table} GROUP BY user_id HAVING COUNT(*) > ?",
+            (per_user,),
+        ).fetchall()
+        for row in over:
+            removed += _trim_user(conn, table, row[0], per_user)
+        if max_age_days > 0:
+            cutoff = _now_ts_ms() - int(max_age_days * 86400 * 1000)
+            removed += max(conn.execute(f"DELETE FROM {table} WHERE created_ts < ?", (cutoff,)).rowcount, 0)
+        if global_max > 0:
+            removed += max(
+                conn.execute(
+                    f"""
+                    DELETE FROM {table} WHERE rowid IN (
+                        SELECT rowid FROM {table} ORDER BY created_ts DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (global_max,),
+                ).rowcount,
+                0,
+            )
+        deleted[table] = removed
+    with _retention_lock:
+        _inserts_since_trim.clear()
+        _retention_stats["compactions"] += 1
+        _retention_stats["compacted_rows"] += sum(deleted.values())
+    return deleted
+
+
+def compact_history() -> Dict[str, int]:
+    """Apply per-user, global and age limits to both history tables now."""
+    flush_history()
     with get_conn() as conn:
-        conn.execute(
-            """
-            INSERT INTO history_rag (
-                id, user_id, kb_id, created_at, created_ts, duration_ms, status,
-                question, question_preview, topk, threshold,
-                embedding_model, model, refused, answer, answer_preview,
-                top_score, citations_json, reason, error_type, error_message, error_trace
+        return _compact(conn)
+
+
+def _write_batch(items: List[WriteItem]) -> None:
+    trim_every = max(1, int(_env_number("HISTORY_TRIM_EVERY", DEFAULT_TRIM_EVERY)))
+    counts: Dict[tuple, int] = {}
+    with get_conn() as conn:
+        for table, user_id, rows in items:
+            conn.executemany(_INSERTS[table], rows)
+            counts[(table, user_id)] = counts.get((table, user_id), 0) + len(rows)
+        for (table, user_id), count in counts.items():
+            if _count_inserts((table, user_id), count, trim_every):
+                trimmed = _trim_user(conn, table, user_id, get_max_records())
+                with _retention_lock:
+                    _retention_stats["trims"] += 1
+                    _retention_stats["trimmed_rows"] += trimmed
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+def get_history_writer() -> Optional[HistoryWriter]:
+    """Background writer, or None when HISTORY_WRITE_MODE=sync (writes stay in the request).
+
+    After shutdown_history_writer() this keeps returning the closed writer,
+    whose submits write synchronously, until start_history_writer() runs.
+    """
+    global _writer
+    if (os.getenv("HISTORY_WRITE_MODE") or "async").strip().lower() == "sync":
+        return None
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter(
+                _write_batch,
+                batch_size=int(_env_number("HISTORY_WRITE_BATCH", DEFAULT_BATCH_SIZE)),
+                flush_interval=_env_number("HISTORY_WRITE_INTERVAL_MS", DEFAULT_FLUSH_INTERVAL * 1000) / 1000,
+                max_queue=int(_env_number("HISTORY_WRITE_MAX_QUEUE", DEFAULT_MAX_QUEUE)),
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                history_id,
-                user_id,
-                kb_id,
-                created_at,
-                created_ts,
-                int(duration_ms),
-                status,
-                question,
-                _preview(question),
-                int(topk),
-                float(threshold),
-                embedding_model,
-                model,
-                1 if refused else 0 if refused is not None else None,
-                answer,
-                _preview(answer),
-                top_score,
-                citations_json,
-                reason,
-                errors["error_type"],
-                errors["error_message"],
-                errors["error_trace"],
-            ),
-        )
-        _trim_table(conn, "history_rag", user_id)
-    return history_id
+        return _writer
+
+
+def _submit(table: str, user_id: str, rows: List[tuple]) -> None:
+    writer = get_history_writer()
+    if writer is None:
+        _write_batch([(table, user_id, rows)])
+    else:
+        writer.submit((table, user_id, rows))
+
+
+def flush_history() -> None:
+    """Wait for queued history rows so the next read sees them."""
+    writer = _writer
+    if writer is not None:
+        writer.flush()
+
+
+def start_history_writer() -> None:
+    """Let the next submit start a fresh writer if an earlier shutdown closed it (app startup)."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None and _writer.closed:
+            _writer = None
+
+
+def _maintain(stop: threading.Event, interval: float) -> None:
+    while not stop.wait(interval):
+        try:
+            compact_history()
+        except Exception:
+            logger.exception("history compaction failed")
+
+
+def start_history_maintenance() -> None:
+    """Run compaction every HISTORY_COMPACT_INTERVAL seconds on a background thread (app startup)."""
+    global _maintenance
+    interval = _env_number("HISTORY_COMPACT_INTERVAL", DEFAULT_COMPACT_INTERVAL)
+    if interval <= 0:
+        return
+    with _retention_lock:
+        if _maintenance is not None and _maintenance[0].is_alive():
+            return
+        stop = threading.Event()
+        thread = threading.Thread(target=_maintain, args=(stop, interval), name="history-compact", daemon=True)
+        thread.start()
+        _maintenance = (thread, stop)
+
+
+def stop_history_maintenance(timeout: Optional[float] = 10.0) -> None:
+    global _maintenance
+    with _retention_lock:
+        maintenance, _maintenance = _maintenance, None
+    if maintenance is not None:
+        maintenance[1].set()
+        maintenance[0].join(timeout)
+
+
+def shutdown_history_writer() -> None:
+    """Drain and stop the background writer (app shutdown)."""
+    writer = _writer
+    if writer is not None:
+        writer.close()
+
+
+def history_writer_stats() -> Dict[str, Any]:
+    writer = get_history_writer()
+    stats = writer.stats() if writer is not None else {"mode": "sync", "queue_depth": 0}
+    with _retention_lock:
+        stats["retention"] = dict(_retention_stats)
+    return stats
 
 
 def _row_to_dict(row) -> Dict[str, Any]:
     data = dict(row)
     if "refused" in data and data["refused"] is not None:
         data["refused"] = bool(data["refused"])
+    if "cached" in data and data["cached"] is not None:
+        data["cached"] = bool(data["cached"])
     return data
 
 
-def list_text_history(user_id: str, limit: int) -> List[Dict[str, Any]]:
+def to_ts_ms(value: Optional[datetime]) -> Optional[int]:
+    """Query-parameter datetime -> created_ts (naive values are taken as UTC)."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def encode_cursor(created_ts: int, history_id: str) -> str:
+    raw = f"{int(created_ts)}:{history_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """Inverse of :func:`encode_cursor`; raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, history_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").split(":", 1)
+        return int(ts), history_id
+    except (binascii.Error, UnicodeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def _page(
+    table: str,
+    columns: str,
+    user_id: str,
+    limit: int,
+    cursor: Optional[str],
+    filters: Dict[str, Any],
+    since_ts: Optional[int],
+    until_ts: Optional[int],
+) -> Dict[str, Any]:
+    # Keyset pagination on (created_ts, id): each page is one index range seek,
+    # served by idx_<table>_user_ts or the per-filter (user_id, col, created_ts, id) index
     safe_limit = normalize_limit(limit)
+    where = ["user_id = ?"]
+    params: List[Any] = [user_id]
+    for column, value in filters.items():
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since_ts is not None:
+        where.append("created_ts >= ?")
+        params.append(int(since_ts))
+    if until_ts is not None:
+        where.append("created_ts < ?")
+        params.append(int(until_ts))
+    if cursor:
+        where.append("(created_ts, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    flush_history()
     with get_conn() as conn:
+        floor = _retention_floor(conn, table, user_id)
+        if floor is not None:
+            # Rows past HISTORY_LIMIT wait for the next trim; pages never reach them
+            where.append("(created_ts, id) >= (?, ?)")
+            params.extend(floor)
         rows = conn.execute(
-            """
-            SELECT id, created_at, created_ts, duration_ms, status,
-                   input_preview, summary_short
-            FROM history_text
-            WHERE user_id = ?
-            ORDER BY created_ts DESC
+            f"""
+            SELECT {columns}
+            FROM {table}
+            WHERE {" AND ".join(where)}
+            ORDER BY created_ts DESC, id DESC
             LIMIT ?
             """,
-            (user_id, safe_limit),
+            (*params, safe_limit + 1),
         ).fetchall()
-    return [_row_to_dict(row) for row in rows]
+    items = [_row_to_dict(row) for row in rows[:safe_limit]]
+    next_cursor = None
+    if len(rows) > safe_limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last["created_ts"], last["id"])
+    return {"items": items, "limit": safe_limit, "next_cursor": next_cursor}
+
+
+# The trigram tokenizer indexes 3-character windows; shorter terms cannot use the index
+MIN_FTS_TERM = 3
+# Users with at most this many rows are searched by scanning their rows: cheaper
+# than an FTS query for a common term, which ranks matches across all users
+DEFAULT_SEARCH_SCAN_ROWS = 2000
+
+
+def get_search_scan_rows() -> int:
+    # 0 always uses the FTS index
+    return max(0, int(_env_number("HISTORY_SEARCH_SCAN_ROWS", DEFAULT_SEARCH_SCAN_ROWS)))
+
+
+def _search_terms(query: str) -> List[str]:
+    terms: List[str] = []
+    for term in (query or "").split():
+        if term not in terms:
+            terms.append(term)
+    if not terms:
+        raise ValueError("Empty search query")
+    return terms
+
+
+def _encode_offset(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"o:{int(offset)}".encode("ascii")).decode("ascii").rstrip("=")
+
+
+def _decode_offset(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        tag, offset = base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii").split(":", 1)
+        if tag != "o" or int(offset) < 0:
+            raise ValueError
+        return int(offset)
+    except (binascii.Error, UnicodeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _search(
+    table: str,
+    columns: str,
+    search_columns: Tuple[str, ...],
+    user_id: str,
+    query: str,
+    limit: int,
+    cursor: Optional[str],
+    filters: Dict[str, Any],
+) -> Dict[str, Any]:
+    # Every term must match (AND). Large histories go through the FTS5 index,
+    # ranked by bm25; small ones, and terms shorter than a trigram, are matched
+    # with LIKE and ranked by term occurrences. Ranked results page by offset,
+    # carried in an opaque cursor.
+    terms = _search_terms(query)
+    safe_limit = normalize_limit(limit)
+    offset = _decode_offset(cursor)
+    where = ["h.user_id = ?"]
+    params: List[Any] = [user_id]
+    for column, value in filters.items():
+        if value is not None:
+            where.append(f"h.{column} = ?")
+            params.append(value)
+
+    flush_history()
+    with get_conn() as conn:
+        floor = _retention_floor(conn, table, user_id)
+        if floor is not None:
+            where.append("(h.created_ts, h.id) >= (?, ?)")
+            params.extend(floor)
+        fts = f"{table}_fts"
+        fts_terms = [t for t in terms if len(t) >= MIN_FTS_TERM]
+        if fts_terms and not has_fts(conn, table):
+            fts_terms = []
+        if fts_terms:
+            user_rows = conn.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+            if user_rows <= get_search_scan_rows():
+                fts_terms = []
+        for term in terms:
+            if term in fts_terms:
+                continue
+            where.append("(" + " OR ".join(f"h.{c} LIKE ? ESCAPE '\\'" for c in search_columns) + ")")
+            params.extend([_like_pattern(term)] * len(search_columns))
+        if fts_terms:
+            match = " ".join('"' + t.replace('"', '""') + '"' for t in fts_terms)
+            sql = f"""
+                SELECT {columns}, bm25({fts}) AS score
+                FROM {fts} JOIN {table} h ON h.rowid = {fts}.rowid
+                WHERE {fts} MATCH ? AND {" AND ".join(where)}
+                ORDER BY score, h.created_ts DESC, h.id DESC
+                LIMIT ? OFFSET ?
+            """
+            params.insert(0, match)
+        else:
+            # Negated occurrence count, so that like bm25 lower is better
+            occurrences = " + ".join(
+                f"(length(coalesce(h.{c}, '')) - length(replace(lower(coalesce(h.{c}, '')), ?, ''))) / {len(t)}"
+                for t in terms
+                for c in search_columns
+            )
+            sql = f"""
+                SELECT {columns}, -({occurrences}) AS score
+                FROM {table} h
+                WHERE {" AND ".join(where)}
+                ORDER BY score, h.created_ts DESC, h.id DESC
+                LIMIT ? OFFSET ?
+            """
+            params[0:0] = [t.lower() for t in terms for _ in search_columns]
+        rows = conn.execute(sql, (*params, safe_limit + 1, offset)).fetchall()
+    items = [_row_to_dict(row) for row in rows[:safe_limit]]
+    next_cursor = _encode_offset(offset + safe_limit) if len(rows) > safe_limit else None
+    return {
+        "items": items,
+        "limit": safe_limit,
+        "next_cursor": next_cursor,
+        "mode": "fts" if fts_terms else "scan",
+    }
+
+
+def page_text_history(
+    user_id: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    since_ts: Optional[int] = None,
+    until_ts: Optional[int] = None,
+) -> Dict[str, Any]:
+    return _page(
+        "history_text",
+        "id, created_at, created_ts, duration_ms, status, input_preview, summary_short, cached",
+        user_id,
+        limit,
+        cursor,
+        {"status": status},
+        since_ts,
+        until_ts,
+    )
+
+
+def list_text_history(user_id: str, limit: int) -> List[Dict[str, Any]]:
+    return page_text_history(user_id, limit)["items"]
+
+
+def search_text_history(
+    user_id: str,
+    query: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+) -> Dict[str, Any]:
+    return _search(
+        "history_text",
+        "h.id, h.created_at, h.created_ts, h.duration_ms, h.status, h.input_preview, h.summary_short, h.cached",
+        ("input_text", "summary_short"),
+        user_id,
+        query,
+        limit,
+        cursor,
+        {"status": status},
+    )
 
 
 def get_text_history(user_id: str, history_id: str) -> Optional[Dict[str, Any]]:
+    flush_history()
     with get_conn() as conn:
         row = conn.execute(
             "SELECT * FROM history_text WHERE id = ? AND user_id = ?",
@@ -252,24 +729,56 @@ def get_text_history(user_id: str, history_id: str) -> Optional[Dict[str, Any]]:
     return _row_to_dict(row) if row else None
 
 
+def page_rag_history(
+    user_id: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    kb_id: Optional[str] = None,
+    refused: Optional[bool] = None,
+    since_ts: Optional[int] = None,
+    until_ts: Optional[int] = None,
+) -> Dict[str, Any]:
+    return _page(
+        "history_rag",
+        """id, created_at, created_ts, duration_ms, status, kb_id,
+           question_preview, answer_preview, refused, cached, top_score, threshold""",
+        user_id,
+        limit,
+        cursor,
+        {"status": status, "kb_id": kb_id, "refused": None if refused is None else int(refused)},
+        since_ts,
+        until_ts,
+    )
+
+
 def list_rag_history(user_id: str, limit: int) -> List[Dict[str, Any]]:
-    safe_limit = normalize_limit(limit)
-    with get_conn() as conn:
-        rows = conn.execute(
-            """
-            SELECT id, created_at, created_ts, duration_ms, status, kb_id,
-                   question_preview, answer_preview, refused, top_score, threshold
-            FROM history_rag
-            WHERE user_id = ?
-            ORDER BY created_ts DESC
-            LIMIT ?
-            """,
-            (user_id, safe_limit),
-        ).fetchall()
-    return [_row_to_dict(row) for row in rows]
+    return page_rag_history(user_id, limit)["items"]
+
+
+def search_rag_history(
+    user_id: str,
+    query: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    kb_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    return _search(
+        "history_rag",
+        """h.id, h.created_at, h.created_ts, h.duration_ms, h.status, h.kb_id,
+           h.question_preview, h.answer_preview, h.refused, h.cached, h.top_score, h.threshold""",
+        ("question", "answer"),
+        user_id,
+        query,
+        limit,
+        cursor,
+        {"status": status, "kb_id": kb_id},
+    )
 
 
 def get_rag_history(user_id: str, history_id: str) -> Optional[Dict[str, Any]]:
+    flush_history()
     with get_conn() as conn:
         row = conn.execute(
             "SELECT * FROM history_rag WHERE id = ? AND user_id = ?",
@@ -0,0 +1,182 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_MAX_QUEUE = 10000
+
+# (table, user_id, rows) -- rows are ready-to-insert tuples for that table
+WriteItem = Tuple[str, str, List[tuple]]
+
+
+class _Barrier:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+
+
+class _Stop:
+    pass
+
+
+class HistoryWriter:
+    """Write-behind queue for history rows.
+
+    Request handlers only enqueue; a single background thread groups queued
+    rows into one transaction per ``batch_size`` rows or ``flush_interval``
+    seconds, whichever comes first. When the queue is full the caller writes
+    synchronously instead of dropping records.
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[WriteItem]], None],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ) -> None:
+        self._write_batch = write_batch
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, max_queue))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._pending = 0
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.overflow_sync = 0
+        self.batches = 0
+        self.max_batch = 0
+        self._flush_ms_total = 0.0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: WriteItem) -> None:
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._ensure_thread()
+                self._pending += len(item[2])
+        if closed:
+            self._write_batch([item])
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._pending -= len(item[2])
+                self.overflow_sync += 1
+            self._write_batch([item])
+            return
+        with self._lock:
+            self.enqueued += len(item[2])
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Block until everything submitted so far is written (read-your-writes)."""
+        with self._lock:
+            if self._pending == 0 or self._thread is None:
+                return True
+        barrier = _Barrier()
+        self._queue.put(barrier)
+        return barrier.done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """Drain the queue and stop the thread; later submits write synchronously."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_Stop())
+        thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            batch: List[WriteItem] = []
+            barriers: List[_Barrier] = []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            rows = 0
+            item = first
+            while True:
+                if isinstance(item, _Stop):
+                    stop = True
+                elif isinstance(item, _Barrier):
+                    barriers.append(item)
+                else:
+                    batch.append(item)
+                    rows += len(item[2])
+                if rows >= self.batch_size:
+                    break
+                if stop or barriers:
+                    # Barriers flush immediately; on stop, drain what is already queued
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(batch, rows)
+            for barrier in barriers:
+                barrier.done.set()
+            if stop:
+                return
+
+    def _flush(self, batch: List[WriteItem], rows: int) -> None:
+        start = time.perf_counter()
+        try:
+            self._write_batch(batch)
+            ok = True
+        except Exception:
+            logger.exception("history writer failed to write %d rows", rows)
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._pending -= rows
+            if ok:
+                self.written += rows
+            else:
+                self.failed += rows
+            self.batches += 1
+            self.max_batch = max(self.max_batch, rows)
+            self._flush_ms_total += elapsed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "mode": "async",
+                "queue_depth": self._pending,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "failed": self.failed,
+                "overflow_sync": self.overflow_sync,
+                "batches": self.batches,
+                "avg_batch_rows": (self.written + self.failed) / self.batches if self.batches else 0.0,
+                "max_batch_rows": self.max_batch,
+                "avg_flush_ms": self._flush_ms_total / self.batches if self.batches else 0.0,
+            }
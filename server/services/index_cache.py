@@ -0,0 +1,240 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.index_store import (
+    HEADER_FILE,
+    LEGACY_FILE,
+    acquire_index,
+    current_build_id,
+    pin_version,
+    release_index,
+)
+from app.rag import Chunk, load_index
+from app.vector_index import VectorIndex
+
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Rough per-chunk overhead of the Chunk object, dict slot and id string
+CHUNK_OVERHEAD_BYTES = 256
+
+IndexPair = Tuple[Dict[str, Chunk], VectorIndex]
+CacheKey = Tuple[str, str, Tuple]
+
+
+def _parse_max_bytes(raw: Optional[str]) -> int:
+    if raw is None or not raw.strip():
+        return DEFAULT_MAX_BYTES
+    try:
+        return max(int(raw), 0)
+    except ValueError:
+        return DEFAULT_MAX_BYTES
+
+
+def _file_sig(path: Path) -> Tuple[int, int]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return (0, 0)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def index_version(index_dir: Path, chunks_path: Path) -> Tuple:
+    """Cheap version of an index: changes whenever a build publishes or rewrites it."""
+    return (
+        current_build_id(str(index_dir)),
+        _file_sig(index_dir / HEADER_FILE),
+        _file_sig(index_dir / LEGACY_FILE),
+        _file_sig(chunks_path),
+    )
+
+
+def estimate_bytes(chunks: Dict[str, Chunk], vectors: VectorIndex) -> int:
+    text_bytes = sum(len(c.text) for c in chunks.values()) * 2
+    lexical = getattr(vectors, "lexical", None)
+    lexical_bytes = lexical.nbytes if lexical is not None else 0
+    vector_bytes = vectors.nbytes
+    quant = getattr(vectors, "quant", None)
+    if quant is not None and isinstance(vectors.matrix, np.memmap):
+        # Queries scan the codes; mapped float rows are only paged in for re-scoring
+        vector_bytes = quant.nbytes
+    return vector_bytes + lexical_bytes + text_bytes + CHUNK_OVERHEAD_BYTES * len(chunks)
+
+
+class _Entry:
+    __slots__ = ("pair", "size", "index_dir", "version")
+
+    def __init__(self, pair: IndexPair, size: int, index_dir: Path, version: Path) -> None:
+        self.pair = pair
+        self.size = size
+        self.index_dir = index_dir
+        # Pinned index version the pair reads from (its mmaps point into it)
+        self.version = version
+
+
+class IndexCache:
+    """LRU of loaded KB indexes, bounded by estimated bytes.
+
+    Every entry pins the index version its mmaps point into, and every lease
+    adds a pin of its own, so a rebuild's GC never deletes a version that a
+    cached index or an in-flight query still reads.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _pop(self, key: CacheKey) -> _Entry:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        return entry
+
+    @staticmethod
+    def _unpin(entries: List[_Entry]) -> None:
+        # Outside the cache lock: releasing the last pin of a superseded version deletes it
+        for entry in entries:
+            release_index(str(entry.index_dir), entry.version)
+
+    def acquire(
+        self,
+        user_id: str,
+        kb_id: str,
+        index_dir: Path,
+        chunks_path: Path,
+        loader: Optional[Callable[[str, str], IndexPair]] = None,
+    ) -> Tuple[IndexPair, Callable[[], None]]:
+        """Cached (or freshly loaded) index plus a release callback that drops the caller's pin."""
+        loader = loader or (lambda i, c: load_index(index_dir=i, chunks_path=c))
+        key: CacheKey = (user_id, kb_id, index_version(index_dir, chunks_path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # The entry's own pin keeps the version alive while this one is added
+                pin_version(entry.version)
+                return entry.pair, partial(release_index, str(index_dir), entry.version)
+            self.misses += 1
+
+        version = acquire_index(str(index_dir))
+        release = partial(release_index, str(index_dir), version)
+        try:
+            pair = loader(str(version), str(chunks_path))
+        except BaseException:
+            release()
+            raise
+        if version != index_dir and version.name != key[2][0]:
+            # A build published between the version check and the pin
+            key = (user_id, kb_id, (version.name, *key[2][1:]))
+        size = estimate_bytes(*pair)
+        if size > self.max_bytes:
+            return pair, release
+
+        dropped: List[_Entry] = []
+        with self._lock:
+            # Any older version of the same KB is stale now
+            for stale in [k for k in self._entries if k[:2] == key[:2] and k != key]:
+                dropped.append(self._pop(stale))
+            if key in self._entries:
+                dropped.append(self._pop(key))
+            pin_version(version)
+            self._entries[key] = _Entry(pair, size, index_dir, version)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                dropped.append(self._pop(oldest))
+                self.evictions += 1
+        self._unpin(dropped)
+        return pair, release
+
+    @contextmanager
+    def lease(
+        self,
+        user_id: str,
+        kb_id: str,
+        index_dir: Path,
+        chunks_path: Path,
+        loader: Optional[Callable[[str, str], IndexPair]] = None,
+    ) -> Iterator[IndexPair]:
+        """Use an index with its version pinned for the whole block (queries read its mmaps)."""
+        pair, release = self.acquire(user_id, kb_id, index_dir, chunks_path, loader=loader)
+        try:
+            yield pair
+        finally:
+            release()
+
+    def get_or_load(
+        self,
+        user_id: str,
+        kb_id: str,
+        index_dir: Path,
+        chunks_path: Path,
+        loader: Optional[Callable[[str, str], IndexPair]] = None,
+    ) -> IndexPair:
+        """Like lease() without a pin for the caller: only safe while the entry stays cached."""
+        pair, release = self.acquire(user_id, kb_id, index_dir, chunks_path, loader=loader)
+        release()
+        return pair
+
+    def invalidate(self, user_id: str, kb_id: Optional[str] = None) -> int:
+        with self._lock:
+            keys = [
+                k for k in self._entries
+                if k[0] == user_id and (kb_id is None or k[1] == kb_id)
+            ]
+            dropped = [self._pop(k) for k in keys]
+            self.invalidations += len(keys)
+        self._unpin(dropped)
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            dropped = list(self._entries.values())
+            self._entries.clear()
+            self._bytes = 0
+        self._unpin(dropped)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_cache: Optional[IndexCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_index_cache() -> IndexCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = IndexCache(max_bytes=_parse_max_bytes(os.getenv("INDEX_CACHE_MAX_BYTES")))
+    return _cache
+
+
+def invalidate_kb(user_id: str, kb_id: Optional[str] = None) -> int:
+    if _cache is None:
+        return 0
+    return _cache.invalidate(user_id, kb_id)
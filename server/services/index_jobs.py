@@ -0,0 +1,466 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from fastapi import HTTPException
+
+from server.services.db import get_conn
+from server.services.kb_store import validate_kb_id
+from server.services.rag_service import build_index_for_kb, check_kb_buildable
+from server.services.user_store import get_kb_detail
+
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+DEFAULT_WORKERS = 2
+DEFAULT_PER_USER = 1
+# A running job whose heartbeat is older than this was left by a dead process
+DEFAULT_STALE_SECONDS = 60.0
+# Jobs interrupted this many times are failed instead of requeued
+MAX_ATTEMPTS = 3
+# Progress goes to the DB at most this often; stage changes are written at once
+PROGRESS_WRITE_INTERVAL = 0.5
+
+BuildFn = Callable[..., Dict[str, Any]]
+
+
+def _now_ts_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _iso(ts_ms: Optional[int]) -> Optional[str]:
+    if ts_ms is None:
+        return None
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _iso_to_ts_ms(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        dt = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return int(dt.timestamp() * 1000)
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+def _eta_seconds(progress: Dict[str, Any], now_ms: int) -> Optional[float]:
+    # Rate from chunks embedded by the API since the stage began; cache hits are free
+    if progress.get("stage") != "embedding":
+        return None
+    todo = progress.get("chunks_to_embed") or 0
+    done = progress.get("chunks_embedded") or 0
+    cached = progress.get("chunks_cached") or 0
+    started = progress.get("embed_started_ts")
+    if done >= todo:
+        return 0.0
+    if not started or done <= cached:
+        return None
+    elapsed = max(0.0, (now_ms - started) / 1000)
+    return round((todo - done) * elapsed / (done - cached), 1)
+
+
+def _job_to_dict(row, now_ms: Optional[int] = None) -> Dict[str, Any]:
+    progress = json.loads(row["progress_json"]) if row["progress_json"] else {}
+    return {
+        "id": row["id"],
+        "kb_id": row["kb_id"],
+        "status": row["status"],
+        "created_at": row["created_at"],
+        "started_at": _iso(row["started_ts"]),
+        "finished_at": _iso(row["finished_ts"]),
+        "submissions": row["submissions"],
+        "attempts": row["attempts"],
+        "progress": progress,
+        "eta_seconds": _eta_seconds(progress, now_ms or _now_ts_ms()) if row["status"] == JOB_RUNNING else None,
+        "stats": json.loads(row["stats_json"]) if row["stats_json"] else None,
+        "error": row["error"],
+    }
+
+
+def _find_job(conn: sqlite3.Connection, user_id: str, kb_id: str, status: str):
+    return conn.execute(
+        """
+        SELECT * FROM index_jobs
+        WHERE user_id = ? AND kb_id = ? AND status = ?
+        ORDER BY created_ts DESC LIMIT 1
+        """,
+        (user_id, kb_id, status),
+    ).fetchone()
+
+
+def enqueue_job(user_id: str, kb_id: str, kb_updated_at: Optional[str] = None) -> Dict[str, Any]:
+    """Queue a build for the KB, coalescing with a build that already covers it.
+
+    A queued job absorbs every later submission. A running job absorbs a
+    submission too, unless the KB changed after it started -- then one
+    follow-up job is queued behind it.
+    """
+    now = _now_ts_ms()
+    changed_ts = _iso_to_ts_ms(kb_updated_at)
+    with get_conn() as conn:
+        for _ in range(2):
+            row = _find_job(conn, user_id, kb_id, JOB_QUEUED)
+            if row is None:
+                running = _find_job(conn, user_id, kb_id, JOB_RUNNING)
+                # updated_at has second precision: an update in the start second counts as later
+                if running is not None and changed_ts is not None and changed_ts < running["started_ts"] // 1000 * 1000:
+                    row = running
+            if row is not None:
+                conn.execute("UPDATE index_jobs SET submissions = submissions + 1 WHERE id = ?", (row["id"],))
+                job = _job_to_dict(row, now)
+                job["submissions"] += 1
+                return {"job": job, "coalesced": True}
+            job_id = uuid.uuid4().hex
+            try:
+                conn.execute(
+                    """
+                    INSERT INTO index_jobs (id, user_id, kb_id, status, created_at, created_ts, progress_json)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (job_id, user_id, kb_id, JOB_QUEUED, _iso(now), now, json.dumps({"stage": JOB_QUEUED})),
+                )
+            except sqlite3.IntegrityError:
+                # Another worker process queued this KB in between; join that job
+                continue
+            row = conn.execute("SELECT * FROM index_jobs WHERE id = ?", (job_id,)).fetchone()
+            return {"job": _job_to_dict(row, now), "coalesced": False}
+    raise HTTPException(status_code=409, detail="Index job is being queued concurrently, retry")
+
+
+def get_index_status(user_id: str, kb_id: str) -> Dict[str, Any]:
+    kb_id = validate_kb_id(kb_id)
+    kb = get_kb_detail(user_id, kb_id)
+    now = _now_ts_ms()
+    with get_conn() as conn:
+        running = _find_job(conn, user_id, kb_id, JOB_RUNNING)
+        queued = _find_job(conn, user_id, kb_id, JOB_QUEUED)
+        latest = conn.execute(
+            "SELECT * FROM index_jobs WHERE user_id = ? AND kb_id = ? ORDER BY created_ts DESC LIMIT 1",
+            (user_id, kb_id),
+        ).fetchone()
+    if kb is None and latest is None:
+        raise HTTPException(status_code=404, detail="KB not found")
+    current = running or latest
+    return {
+        "kb_id": kb_id,
+        "job": _job_to_dict(current, now) if current is not None else None,
+        # Follow-up build queued behind the running one
+        "next_job": _job_to_dict(queued, now) if running is not None and queued is not None else None,
+        "index": kb["index"] if kb else None,
+    }
+
+
+class _JobProgress:
+    """Progress callback handed to build_index; throttles DB writes."""
+
+    def __init__(self, job_id: str) -> None:
+        self.job_id = job_id
+        self.state: Dict[str, Any] = {"stage": "starting"}
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def __call__(self, update: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            stage = update.get("stage")
+            stage_changed = stage is not None and stage != self.state.get("stage")
+            self.state.update(update)
+            if "chunks_cached" in update and "embed_started_ts" not in self.state:
+                self.state["embed_started_ts"] = _now_ts_ms()
+            if not stage_changed and now - self._last_write < PROGRESS_WRITE_INTERVAL:
+                return
+            self._last_write = now
+            # Written under the lock so a stale snapshot never lands after a newer one
+            with get_conn() as conn:
+                conn.execute(
+                    "UPDATE index_jobs SET progress_json = ?, heartbeat_ts = ? WHERE id = ?",
+                    (json.dumps(self.state), _now_ts_ms(), self.job_id),
+                )
+
+
+class IndexJobRunner:
+    """Runs queued index builds on a small pool of background threads.
+
+    Jobs live in the ``index_jobs`` table, so a restart picks up queued
+    work, and running jobs whose heartbeat stopped are requeued. At most
+    ``per_user`` builds run at once for one user and one per KB.
+    """
+
+    def __init__(
+        self,
+        build: Optional[BuildFn] = None,
+        workers: int = DEFAULT_WORKERS,
+        per_user: int = DEFAULT_PER_USER,
+        stale_seconds: float = DEFAULT_STALE_SECONDS,
+    ) -> None:
+        self._build = build
+        self.workers = max(1, workers)
+        self.per_user = max(1, per_user)
+        self.stale_seconds = max(1.0, stale_seconds)
+        # Heartbeats are written well inside the stale window
+        self.heartbeat_interval = min(5.0, self.stale_seconds / 3)
+        self._cond = threading.Condition()
+        self._claim_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._running: Set[str] = set()
+        self._closed = False
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def start(self) -> None:
+        with self._cond:
+            if self._closed or self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"index-job-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._heartbeat, name="index-job-heartbeat", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """Stop taking jobs. Builds still running are abandoned and resumed by the next start."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        deadline = time.monotonic() + (timeout or 0)
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    def wait_idle(self, timeout: float = 10.0) -> bool:
+        """Block until no job is queued or running in this DB (tests, admin scripts)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with get_conn() as conn:
+                row = conn.execute(
+                    "SELECT 1 FROM index_jobs WHERE status IN (?, ?) LIMIT 1", (JOB_QUEUED, JOB_RUNNING)
+                ).fetchone()
+            if row is None:
+                return True
+            time.sleep(0.02)
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            running = len(self._running)
+        return {
+            "workers": self.workers,
+            "per_user": self.per_user,
+            "running": running,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def _reclaim_stale(self, conn: sqlite3.Connection, now: int) -> None:
+        stale = conn.execute(
+            "SELECT * FROM index_jobs WHERE status = ? AND heartbeat_ts < ?",
+            (JOB_RUNNING, now - int(self.stale_seconds * 1000)),
+        ).fetchall()
+        for row in stale:
+            if row["id"] in self._running:
+                continue
+            queued = _find_job(conn, row["user_id"], row["kb_id"], JOB_QUEUED)
+            if row["attempts"] >= MAX_ATTEMPTS or queued is not None:
+                # A follow-up build already covers the KB, or the build keeps dying
+                conn.execute(
+                    "UPDATE index_jobs SET status = ?, finished_ts = ?, error = ? WHERE id = ?",
+                    (JOB_FAILED, now, "Interrupted by a server restart", row["id"]),
+                )
+                continue
+            logger.info("requeueing interrupted index job %s (kb %s)", row["id"], row["kb_id"])
+            conn.execute(
+                "UPDATE index_jobs SET status = ?, progress_json = ? WHERE id = ?",
+                (JOB_QUEUED, json.dumps({"stage": JOB_QUEUED, "resumed": True}), row["id"]),
+            )
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        now = _now_ts_ms()
+        with self._claim_lock, get_conn() as conn:
+            # IMMEDIATE: claims from several server processes are serialized by SQLite
+            conn.execute("BEGIN IMMEDIATE")
+            self._reclaim_stale(conn, now)
+            row = conn.execute(
+                """
+                SELECT j.id, j.user_id, j.kb_id FROM index_jobs j
+                WHERE j.status = ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM index_jobs r
+                      WHERE r.status = ? AND r.user_id = j.user_id AND r.kb_id = j.kb_id
+                  )
+                  AND (
+                      SELECT COUNT(*) FROM index_jobs r WHERE r.status = ? AND r.user_id = j.user_id
+                  ) < ?
+                ORDER BY j.created_ts
+                LIMIT 1
+                """,
+                (JOB_QUEUED, JOB_RUNNING, JOB_RUNNING, self.per_user),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                """
+                UPDATE index_jobs
+                SET status = ?, started_ts = ?, heartbeat_ts = ?, attempts = attempts + 1,
+                    progress_json = ?, error = NULL
+                WHERE id = ?
+                """,
+                (JOB_RUNNING, now, now, json.dumps({"stage": "starting"}), row["id"]),
+            )
+            with self._cond:
+                self._running.add(row["id"])
+            return dict(row)
+
+    def _finish(self, job_id: str, status: str, state: Dict[str, Any], stats: Optional[Dict], error: Optional[str]) -> None:
+        state = dict(state, stage=status)
+        with get_conn() as conn:
+            conn.execute(
+                """
+                UPDATE index_jobs
+                SET status = ?, finished_ts = ?, heartbeat_ts = ?, progress_json = ?, stats_json = ?, error = ?
+                WHERE id = ?
+                """,
+                (
+                    status,
+                    _now_ts_ms(),
+                    _now_ts_ms(),
+                    json.dumps(state),
+                    json.dumps(stats, ensure_ascii=False) if stats is not None else None,
+                    error,
+                    job_id,
+                ),
+            )
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        progress = _JobProgress(job["id"])
+        succeeded = False
+        try:
+            build = self._build or build_index_for_kb
+            stats = build(user_id=job["user_id"], kb_id=job["kb_id"], progress=progress)
+        except Exception as exc:
+            detail = exc.detail if isinstance(exc, HTTPException) else repr(exc)
+            logger.warning("index job %s (kb %s) failed: %s", job["id"], job["kb_id"], detail)
+            self._finish(job["id"], JOB_FAILED, progress.state, None, str(detail))
+            succeeded = False
+        else:
+            self._finish(job["id"], JOB_SUCCEEDED, progress.state, stats, None)
+            succeeded = True
+        finally:
+            with self._cond:
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._running.discard(job["id"])
+                # A per-user or per-KB slot is free again
+                self._cond.notify_all()
+
+    def _work(self) -> None:
+        while not self._closed:
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                logger.exception("claiming an index job failed")
+                job = None
+            if job is None:
+                with self._cond:
+                    if not self._closed:
+                        self._cond.wait(self.heartbeat_interval)
+                continue
+            self._run(job)
+
+    def _heartbeat(self) -> None:
+        # Keeps beating after close() until abandoned builds finish in this process
+        while not self._closed or self._running:
+            with self._cond:
+                self._cond.wait(self.heartbeat_interval)
+                ids = list(self._running)
+            if not ids:
+                continue
+            try:
+                with get_conn() as conn:
+                    conn.executemany(
+                        "UPDATE index_jobs SET heartbeat_ts = ? WHERE id = ?",
+                        [(_now_ts_ms(), job_id) for job_id in ids],
+                    )
+            except sqlite3.Error:
+                logger.exception("index job heartbeat failed")
+
+
+_runner: Optional[IndexJobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_index_job_runner() -> IndexJobRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None or _runner.closed:
+            _runner = IndexJobRunner(
+                workers=int(_env_number("INDEX_JOB_WORKERS", DEFAULT_WORKERS)),
+                per_user=int(_env_number("INDEX_JOB_PER_USER", DEFAULT_PER_USER)),
+                stale_seconds=_env_number("INDEX_JOB_STALE_SECONDS", DEFAULT_STALE_SECONDS),
+            )
+        _runner.start()
+        return _runner
+
+
+def submit_index_job(user_id: str, kb_id: str) -> Dict[str, Any]:
+    kb_id = validate_kb_id(kb_id)
+    # Fail fast on KBs that cannot be built instead of queueing a doomed job
+    check_kb_buildable(user_id, kb_id)
+    kb = get_kb_detail(user_id, kb_id) or {}
+    result = enqueue_job(user_id, kb_id, kb_updated_at=kb.get("updated_at"))
+    get_index_job_runner().wake()
+    return result
+
+
+def resume_index_jobs() -> None:
+    """Start the runner at startup when the DB still holds unfinished jobs."""
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM index_jobs WHERE status IN (?, ?) LIMIT 1", (JOB_QUEUED, JOB_RUNNING)
+        ).fetchone()
+    if row is not None:
+        get_index_job_runner()
+
+
+def shutdown_index_jobs() -> None:
+    runner = _runner
+    if runner is not None:
+        runner.close()
+
+
+def index_job_stats() -> Dict[str, Any]:
+    runner = _runner
+    return runner.stats() if runner is not None else {"running": 0, "completed": 0, "failed": 0}
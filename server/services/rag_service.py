@@ -1,16 +1,50 @@
-﻿from datetime import datetime, timezone
+﻿import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 from fastapi import HTTPException
+from openai import APIError
 
-from app.rag import build_index, generate_answer, load_index, load_kb_files, retrieve, should_refuse
+from app.ann import DEFAULT_ANN_MIN_CHUNKS
+from app.embedder import DEFAULT_MAX_BATCH_TOKENS, DEFAULT_MAX_IN_FLIGHT
+from app.index_store import current_build_id, detect_format
+from app.rag import (
+    RETRIEVAL_HYBRID,
+    RETRIEVAL_LEXICAL,
+    RETRIEVAL_MODES,
+    RETRIEVAL_VECTOR,
+    ProgressFn,
+    RetrievedChunk,
+    build_index,
+    embed_query,
+    embed_query_async,
+    generate_answer,
+    generate_answer_async,
+    generate_answer_stream,
+    has_lexical,
+    load_kb_files,
+    retrieve_by_embedding,
+    retrieve_hybrid,
+    retrieve_lexical,
+    should_refuse,
+)
+from server.services.answer_cache import GroupKey, get_answer_cache, invalidate_answers, make_group_key
 from server.services.external_errors import raise_external_error
+from server.services.index_cache import get_index_cache, index_version, invalidate_kb
 from server.services.kb_store import get_kb_dir, get_kb_index_paths
 from server.services.paths import BASE_DIR
 from server.services.user_store import get_kb_detail, set_kb_index
 
 
+logger = logging.getLogger(__name__)
+
+
 def _relative_to_base(path: Path) -> str:
     try:
         return path.resolve().relative_to(BASE_DIR.resolve()).as_posix()
@@ -22,15 +56,91 @@ def _now_iso() -> str:
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
-def build_index_for_kb(
-    *,
-    user_id: str,
-    kb_id: str,
-    embedding_model: str = "text-embedding-3-small",
-    max_len: int = 800,
-    overlap: int = 120,
-    batch_size: int = 16,
-) -> Dict:
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        return default
+
+
+def _ann_options() -> Dict:
+    return {
+        "ann": (os.getenv("INDEX_ANN") or "").strip().lower() or None,
+        "ann_min_chunks": _env_int("INDEX_ANN_MIN_CHUNKS", DEFAULT_ANN_MIN_CHUNKS),
+        "ivf_nlist": _env_int("INDEX_ANN_NLIST", None),
+        "nprobe": _env_int("INDEX_ANN_NPROBE", None),
+    }
+
+
+def _quant_options() -> Dict:
+    return {
+        "quantize": (os.getenv("INDEX_QUANTIZE") or "").strip().lower() or None,
+        "rescore": _env_int("INDEX_QUANT_RESCORE", None),
+    }
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+def _retrieval_mode(requested: Optional[str]) -> str:
+    mode = (requested or os.getenv("RAG_RETRIEVAL") or RETRIEVAL_VECTOR).strip().lower()
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"Unsupported retrieval mode: {mode}")
+    return mode
+
+
+def _lexical_fallback_enabled(embeddings) -> bool:
+    enabled = (os.getenv("RAG_LEXICAL_FALLBACK") or "1").strip().lower() not in ("0", "false", "no", "off")
+    return enabled and has_lexical(embeddings)
+
+
+def _embed_timeout(embeddings) -> Optional[float]:
+    # Only worth giving up on the embedding call when BM25 can answer instead
+    timeout = _env_number("RAG_EMBED_TIMEOUT_SECONDS", 0.0)
+    return timeout if timeout > 0 and _lexical_fallback_enabled(embeddings) else None
+
+
+_embed_pool: Optional[ThreadPoolExecutor] = None
+_embed_pool_lock = threading.Lock()
+
+
+def _get_embed_pool() -> ThreadPoolExecutor:
+    global _embed_pool
+    if _embed_pool is None:
+        with _embed_pool_lock:
+            # Concurrent first requests must not each start a pool that is never shut down
+            if _embed_pool is None:
+                _embed_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="embed-query")
+    return _embed_pool
+
+
+def _embed_query_with_deadline(question: str, embedding_model: str, timeout: Optional[float]) -> List[float]:
+    if timeout is None:
+        return embed_query(question, embedding_model)
+    # A timed-out call keeps running in the pool; its result still fills the query cache
+    return _get_embed_pool().submit(embed_query, question, embedding_model).result(timeout=timeout)
+
+
+def _fallback_reason(embeddings, exc: Exception) -> str:
+    """Why retrieval switched to BM25, or re-raise when it cannot."""
+    if not isinstance(exc, (APIError, TimeoutError)) or not _lexical_fallback_enabled(embeddings):
+        raise_external_error(exc, action="retrieval")
+    reason = "embedding_timeout" if isinstance(exc, TimeoutError) else "embedding_error"
+    logger.warning("query embedding failed (%s), answering from the lexical index: %r", reason, exc)
+    return reason
+
+
+def check_kb_buildable(user_id: str, kb_id: str) -> Path:
     kb = get_kb_detail(user_id, kb_id)
     if not kb:
         raise HTTPException(status_code=404, detail="KB not found")
@@ -41,7 +151,21 @@ def build_index_for_kb(
 
     if not load_kb_files(str(kb_dir)):
         raise HTTPException(status_code=400, detail="KB has no valid files")
+    return kb_dir
 
+
+def build_index_for_kb(
+    *,
+    user_id: str,
+    kb_id: str,
+    embedding_model: str = "text-embedding-3-small",
+    max_len: int = 800,
+    overlap: int = 120,
+    batch_size: int = 128,
+    incremental: bool = True,
+    progress: Optional[ProgressFn] = None,
+) -> Dict:
+    kb_dir = check_kb_buildable(user_id, kb_id)
     index_dir, chunks_path = get_kb_index_paths(user_id, kb_id)
     try:
         stats = build_index(
@@ -52,17 +176,25 @@ def build_index_for_kb(
             max_len=max_len,
             overlap=overlap,
             batch_size=batch_size,
+            incremental=incremental,
+            max_in_flight=_env_int("EMBED_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT),
+            max_batch_tokens=_env_int("EMBED_MAX_BATCH_TOKENS", DEFAULT_MAX_BATCH_TOKENS),
+            **_ann_options(),
+            **_quant_options(),
+            progress=progress,
         )
     except Exception as exc:
         raise_external_error(exc, action="index build")
 
+    invalidate_kb(user_id, kb_id)
+    invalidate_answers(user_id, kb_id)
     set_kb_index(
         user_id,
         kb_id,
         built=True,
         chunks=stats.get("chunks"),
         index_dir=_relative_to_base(index_dir),
-        chunks_path=_relative_to_base(chunks_path),
+        build_id=stats.get("build_id"),
     )
 
     return stats
@@ -83,7 +215,34 @@ def _format_citations(retrieved, preview_len: int = 80) -> List[Dict]:
     return citations
 
 
-def ask_kb(
+@dataclass
+class PreparedAsk:
+    """Everything ask needs before (or instead of) calling the model."""
+
+    result: Dict
+    retrieved: List[RetrievedChunk] = field(default_factory=list)
+    q_emb: Optional[List[float]] = None
+    cache_group: Optional[GroupKey] = None
+    needs_generation: bool = False
+
+
+def _open_kb_index(user_id: str, kb_id: str) -> Tuple[Tuple, Callable[[], None]]:
+    """Open a KB's index with its version pinned; call the returned release once retrieval is done."""
+    if not get_kb_detail(user_id, kb_id):
+        raise HTTPException(status_code=404, detail="KB not found")
+
+    index_dir, chunks_path = get_kb_index_paths(user_id, kb_id)
+
+    # Flat indexes from before versioned publishing still keep chunks.json outside the index dir
+    flat_without_chunks = current_build_id(str(index_dir)) is None and not chunks_path.exists()
+    if detect_format(str(index_dir)) is None or flat_without_chunks:
+        raise HTTPException(status_code=404, detail="Index not found")
+
+    (chunks, embeddings), release = get_index_cache().acquire(user_id, kb_id, index_dir, chunks_path)
+    return (chunks, embeddings, index_dir, chunks_path), release
+
+
+def prepare_ask(
     *,
     user_id: str,
     kb_id: str,
@@ -92,69 +251,281 @@ def ask_kb(
     threshold: float = 0.35,
     embedding_model: str = "text-embedding-3-small",
     model: str = "gpt-4o-mini",
-) -> Dict:
-    if not get_kb_detail(user_id, kb_id):
-        raise HTTPException(status_code=404, detail="KB not found")
+    retrieval: Optional[str] = None,
+) -> PreparedAsk:
+    mode = _retrieval_mode(retrieval)
+    opened, release = _open_kb_index(user_id, kb_id)
+    try:
+        embeddings = opened[1]
 
-    index_dir, chunks_path = get_kb_index_paths(user_id, kb_id)
+        q_emb = None
+        fallback = None
+        if mode != RETRIEVAL_LEXICAL:
+            try:
+                q_emb = _embed_query_with_deadline(question, embedding_model, _embed_timeout(embeddings))
+            except Exception as exc:
+                fallback = _fallback_reason(embeddings, exc)
+                mode = RETRIEVAL_LEXICAL
 
-    if not chunks_path.exists() or not index_dir.exists():
-        raise HTTPException(status_code=404, detail="Index not found")
+        return _prepare_with_embedding(
+            opened,
+            user_id=user_id,
+            kb_id=kb_id,
+            question=question,
+            q_emb=q_emb,
+            topk=topk,
+            threshold=threshold,
+            model=model,
+            mode=mode,
+            fallback=fallback,
+        )
+    finally:
+        release()
 
-    chunks, embeddings = load_index(
-        index_dir=str(index_dir),
-        chunks_path=str(chunks_path),
-    )
 
+async def prepare_ask_async(
+    *,
+    user_id: str,
+    kb_id: str,
+    question: str,
+    topk: int = 5,
+    threshold: float = 0.35,
+    embedding_model: str = "text-embedding-3-small",
+    model: str = "gpt-4o-mini",
+    retrieval: Optional[str] = None,
+) -> PreparedAsk:
+    mode = _retrieval_mode(retrieval)
+    # SQLite lookups, index loads and the NumPy search stay off the event loop
+    opened, release = await asyncio.to_thread(_open_kb_index, user_id, kb_id)
     try:
-        retrieved = retrieve(
+        embeddings = opened[1]
+
+        q_emb = None
+        fallback = None
+        if mode != RETRIEVAL_LEXICAL:
+            try:
+                q_emb = await asyncio.wait_for(
+                    embed_query_async(question, embedding_model),
+                    timeout=_embed_timeout(embeddings),
+                )
+            except Exception as exc:
+                fallback = _fallback_reason(embeddings, exc)
+                mode = RETRIEVAL_LEXICAL
+
+        return await asyncio.to_thread(
+            _prepare_with_embedding,
+            opened,
+            user_id=user_id,
+            kb_id=kb_id,
             question=question,
-            chunks=chunks,
-            embeddings=embeddings,
+            q_emb=q_emb,
             topk=topk,
-            embedding_model=embedding_model,
+            threshold=threshold,
+            model=model,
+            mode=mode,
+            fallback=fallback,
         )
+    finally:
+        # The last release of a superseded version deletes it from disk
+        await asyncio.to_thread(release)
+
+
+def _prepare_with_embedding(
+    opened: Tuple,
+    *,
+    user_id: str,
+    kb_id: str,
+    question: str,
+    q_emb: Optional[List[float]],
+    topk: int,
+    threshold: float,
+    model: str,
+    mode: str = RETRIEVAL_VECTOR,
+    fallback: Optional[str] = None,
+) -> PreparedAsk:
+    chunks, embeddings, index_dir, chunks_path = opened
+
+    if mode == RETRIEVAL_LEXICAL and not has_lexical(embeddings):
+        raise HTTPException(status_code=409, detail="Index has no lexical index; rebuild the KB index")
+    try:
+        if mode == RETRIEVAL_LEXICAL:
+            retrieved = retrieve_lexical(question, chunks, embeddings, topk=topk)
+        elif mode == RETRIEVAL_HYBRID:
+            retrieved = retrieve_hybrid(question, q_emb, chunks, embeddings, topk=topk)
+        else:
+            retrieved = retrieve_by_embedding(q_emb, chunks, embeddings, topk=topk)
     except Exception as exc:
         raise_external_error(exc, action="retrieval")
 
-    top_score: Optional[float] = retrieved[0].score if retrieved else None
+    top_score: Optional[float] = max(r.score for r in retrieved) if retrieved else None
+    meta = {"retrieval": mode}
+    if fallback:
+        meta["retrieval_fallback"] = fallback
 
     if not retrieved:
-        return {
-            "question": question,
-            "refused": True,
-            "answer": "知识库未覆盖或无法确认。",
-            "top_score": None,
-            "threshold": threshold,
-            "citations": [],
-            "reason": "no_retrieval",
-        }
-
-    if should_refuse(retrieved, threshold=threshold):
-        return {
-            "question": question,
-            "refused": True,
-            "answer": "知识库未覆盖或无法确认。",
-            "top_score": top_score,
-            "threshold": threshold,
-            "citations": [],
-            "reason": "below_threshold",
-        }
+        return PreparedAsk(
+            result={
+                "question": question,
+                "refused": True,
+                "answer": "知识库未覆盖或无法确认。",
+                "top_score": None,
+                "threshold": threshold,
+                "citations": [],
+                "reason": "no_retrieval",
+                "cached": False,
+                **meta,
+            }
+        )
 
-    try:
-        answer = generate_answer(
-            question=question,
-            retrieved=retrieved,
-            model=model,
+    # BM25 scores are not on the cosine scale; lexical mode only refuses when nothing matched
+    if mode != RETRIEVAL_LEXICAL and should_refuse(retrieved, threshold=threshold):
+        return PreparedAsk(
+            result={
+                "question": question,
+                "refused": True,
+                "answer": "知识库未覆盖或无法确认。",
+                "top_score": top_score,
+                "threshold": threshold,
+                "citations": [],
+                "reason": "below_threshold",
+                "cached": False,
+                **meta,
+            }
         )
-    except Exception as exc:
-        raise_external_error(exc, action="answer generation")
 
-    return {
+    result = {
         "question": question,
         "refused": False,
-        "answer": answer,
+        "answer": None,
         "top_score": top_score,
         "threshold": threshold,
         "citations": _format_citations(retrieved),
+        "cached": False,
+        **meta,
     }
+
+    answer_cache = get_answer_cache()
+    cache_group = None
+    # Semantic answer matching needs the question embedding
+    if answer_cache is not None and q_emb is not None:
+        # The build id changes on every rebuild, so stale answers are never served
+        version = getattr(embeddings, "meta", {}).get("build_id") or repr(index_version(index_dir, chunks_path))
+        cache_group = make_group_key(
+            user_id, kb_id, version, model, [r.chunk.chunk_id for r in retrieved]
+        )
+        hit = answer_cache.get(cache_group, question, q_emb)
+        if hit is not None:
+            result.update(answer=hit[0], cached=True, cache_match=hit[1])
+            return PreparedAsk(result=result, retrieved=retrieved, q_emb=q_emb, cache_group=cache_group)
+
+    return PreparedAsk(
+        result=result,
+        retrieved=retrieved,
+        q_emb=q_emb,
+        cache_group=cache_group,
+        needs_generation=True,
+    )
+
+
+def _remember_answer(prepared: PreparedAsk, question: str, answer: str) -> None:
+    answer_cache = get_answer_cache()
+    if answer_cache is not None and prepared.cache_group is not None and answer:
+        answer_cache.put(prepared.cache_group, question, prepared.q_emb, answer)
+
+
+def ask_kb(
+    *,
+    user_id: str,
+    kb_id: str,
+    question: str,
+    topk: int = 5,
+    threshold: float = 0.35,
+    embedding_model: str = "text-embedding-3-small",
+    model: str = "gpt-4o-mini",
+    retrieval: Optional[str] = None,
+) -> Dict:
+    prepared = prepare_ask(
+        user_id=user_id,
+        kb_id=kb_id,
+        question=question,
+        topk=topk,
+        threshold=threshold,
+        embedding_model=embedding_model,
+        model=model,
+        retrieval=retrieval,
+    )
+    if not prepared.needs_generation:
+        return prepared.result
+
+    try:
+        answer = generate_answer(
+            question=question,
+            retrieved=prepared.retrieved,
+            model=model,
+        )
+    except Exception as exc:
+        raise_external_error(exc, action="answer generation")
+
+    _remember_answer(prepared, question, answer)
+    return {**prepared.result, "answer": answer}
+
+
+async def ask_kb_async(
+    *,
+    user_id: str,
+    kb_id: str,
+    question: str,
+    topk: int = 5,
+    threshold: float = 0.35,
+    embedding_model: str = "text-embedding-3-small",
+    model: str = "gpt-4o-mini",
+    retrieval: Optional[str] = None,
+) -> Dict:
+    prepared = await prepare_ask_async(
+        user_id=user_id,
+        kb_id=kb_id,
+        question=question,
+        topk=topk,
+        threshold=threshold,
+        embedding_model=embedding_model,
+        model=model,
+        retrieval=retrieval,
+    )
+    if not prepared.needs_generation:
+        return prepared.result
+
+    try:
+        answer = await generate_answer_async(
+            question=question,
+            retrieved=prepared.retrieved,
+            model=model,
+        )
+    except Exception as exc:
+        raise_external_error(exc, action="answer generation")
+
+    _remember_answer(prepared, question, answer)
+    return {**prepared.result, "answer": answer}
+
+
+def stream_answer(prepared: PreparedAsk, *, question: str, model: str) -> Iterator[Tuple[str, Dict]]:
+    """Yield ("citations" | "delta" | "done", payload) events for one ask.
+
+    Citations go out before the model is called; refusals and cache hits
+    finish without calling it at all.
+    """
+    yield "citations", {k: v for k, v in prepared.result.items() if k != "answer"}
+
+    if not prepared.needs_generation:
+        if prepared.result.get("answer"):
+            yield "delta", {"text": prepared.result["answer"]}
+        yield "done", prepared.result
+        return
+
+    parts: List[str] = []
+    for delta in generate_answer_stream(question, prepared.retrieved, model):
+        parts.append(delta)
+        yield "delta", {"text": delta}
+
+    answer = "".join(parts).strip()
+    _remember_answer(prepared, question, answer)
+    yield "done", {**prepared.result, "answer": answer}
@@ -5,6 +5,9 @@ from typing import Dict, List, Optional
 from fastapi import HTTPException
 
 from server.services.db import get_conn
+from server.services.history_store import flush_history
+from server.services.answer_cache import invalidate_answers
+from server.services.index_cache import invalidate_kb
 
 
 def _now_iso() -> str:
@@ -56,12 +59,17 @@ def get_user_by_id(user_id: str) -> Optional[Dict]:
 def delete_user(user_id: str) -> None:
     if not user_id:
         return
+    # Queued history rows must land before they are deleted, not after
+    flush_history()
     with get_conn() as conn:
         conn.execute("DELETE FROM history_text WHERE user_id = ?", (user_id,))
         conn.execute("DELETE FROM history_rag WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM index_jobs WHERE user_id = ?", (user_id,))
         conn.execute("DELETE FROM kb_files WHERE user_id = ?", (user_id,))
         conn.execute("DELETE FROM kb WHERE user_id = ?", (user_id,))
         conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    invalidate_kb(user_id)
+    invalidate_answers(user_id)
 
 
 def _get_kb_row(user_id: str, kb_id: str) -> Optional[Dict]:
@@ -77,13 +85,15 @@ def upsert_kb_for_upload(user_id: str, kb_id: str, kb_name: Optional[str]) -> No
     now = _now_iso()
     existing = _get_kb_row(user_id, kb_id)
     name = kb_name or kb_id
+    invalidate_kb(user_id, kb_id)
     if existing:
         with get_conn() as conn:
             conn.execute(
                 """
                 UPDATE kb
                 SET name = ?, updated_at = ?, index_built = 0,
-                    index_chunks = NULL, index_dir = NULL, chunks_path = NULL, index_updated_at = NULL
+                    index_chunks = NULL, index_dir = NULL, chunks_path = NULL,
+                    index_build_id = NULL, index_updated_at = NULL
                 WHERE user_id = ? AND id = ?
                 """,
                 (name if kb_name else existing.get("name", kb_id), now, user_id, kb_id),
@@ -129,15 +139,17 @@ def set_kb_index(
     built: bool,
     chunks: Optional[int] = None,
     index_dir: Optional[str] = None,
+    build_id: Optional[str] = None,
     chunks_path: Optional[str] = None,
 ) -> None:
+    """Record a KB's index; versioned builds pass ``build_id`` (their chunks live in the version dir)."""
     now = _now_iso()
     with get_conn() as conn:
         conn.execute(
             """
             UPDATE kb
             SET updated_at = ?, index_built = ?, index_chunks = ?, index_dir = ?,
-                chunks_path = ?, index_updated_at = ?
+                index_build_id = ?, chunks_path = ?, index_updated_at = ?
             WHERE user_id = ? AND id = ?
             """,
             (
@@ -145,6 +157,7 @@ def set_kb_index(
                 1 if built else 0,
                 chunks,
                 index_dir,
+                build_id,
                 chunks_path,
                 now,
                 user_id,
@@ -164,6 +177,7 @@ def _kb_row_to_dict(row: Dict, files: List[Dict]) -> Dict:
             "built": bool(row.get("index_built")),
             "chunks": row.get("index_chunks"),
             "index_dir": row.get("index_dir"),
+            "build_id": row.get("index_build_id"),
             "chunks_path": row.get("chunks_path"),
             "updated_at": row.get("index_updated_at"),
         },
@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _isolated_embed_cache(tmp_path, monkeypatch):
+    # Never write the shared embedding cache under data/ during tests
+    monkeypatch.setenv("EMBED_CACHE_PATH", str(tmp_path / "embed_cache.db"))
+    # A per-test path also gives each test a fresh query embedding cache
+    monkeypatch.setenv("QUERY_CACHE_PATH", str(tmp_path / "query_cache.db"))
+    monkeypatch.setenv("RESULT_CACHE_PATH", str(tmp_path / "result_cache.db"))
+    # History rows are written in the request so tests can read them back immediately
+    monkeypatch.setenv("HISTORY_WRITE_MODE", "sync")
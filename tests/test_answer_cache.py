@@ -0,0 +1,82 @@
+import sqlite3
+
+from server.services.answer_cache import (
+    MATCH_EXACT,
+    MATCH_SEMANTIC,
+    AnswerCache,
+    make_group_key,
+)
+from server.services.db import SCHEMA_VERSION, get_conn
+from server.services.history_store import get_rag_history, record_rag_history
+
+
+def test_answer_cache_exact_and_semantic_hits():
+    cache = AnswerCache(max_entries=10, ttl_seconds=60, sim_threshold=0.95)
+    group = make_group_key("u", "kb", "build-1", "gpt-4o-mini", ["chunk_000001", "chunk_000002"])
+    cache.put(group, "什么是 RAG?", [1.0, 0.0, 0.0], "answer")
+
+    assert cache.get(group, "  什么是   rag? ") == ("answer", MATCH_EXACT)
+    assert cache.get(group, "解释一下 RAG", [0.99, 0.05, 0.0]) == ("answer", MATCH_SEMANTIC)
+    assert cache.get(group, "完全无关的问题", [0.0, 1.0, 0.0]) is None
+
+    # Different evidence or a rebuilt index never reuses the answer
+    other_chunks = make_group_key("u", "kb", "build-1", "gpt-4o-mini", ["chunk_000003"])
+    rebuilt = make_group_key("u", "kb", "build-2", "gpt-4o-mini", ["chunk_000001", "chunk_000002"])
+    assert cache.get(other_chunks, "什么是 RAG?", [1.0, 0.0, 0.0]) is None
+    assert cache.get(rebuilt, "什么是 RAG?", [1.0, 0.0, 0.0]) is None
+
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 3)
+
+    assert cache.invalidate("u", "kb") == 1
+    assert cache.get(group, "什么是 RAG?") is None
+
+
+def test_answer_cache_threshold_zero_is_exact_only_and_lru():
+    cache = AnswerCache(max_entries=2, ttl_seconds=60, sim_threshold=0)
+    group = make_group_key("u", "kb", "b", "m", ["c1"])
+    cache.put(group, "q1", [1.0, 0.0], "a1")
+    assert cache.get(group, "q1 again", [1.0, 0.0]) is None
+
+    cache.put(group, "q2", [0.0, 1.0], "a2")
+    cache.put(group, "q3", [0.5, 0.5], "a3")
+    assert cache.get(group, "q1") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_history_rag_cached_column_and_v2_migration(tmp_path, monkeypatch):
+    db_path = tmp_path / "app.db"
+    conn = sqlite3.connect(str(db_path))
+    conn.executescript(
+        """
+        CREATE TABLE history_rag (
+            id TEXT PRIMARY KEY, user_id TEXT NOT NULL, kb_id TEXT NOT NULL,
+            created_at TEXT NOT NULL, created_ts INTEGER NOT NULL,
+            duration_ms INTEGER NOT NULL, status TEXT NOT NULL,
+            question TEXT NOT NULL, question_preview TEXT NOT NULL,
+            topk INTEGER, threshold REAL, embedding_model TEXT, model TEXT,
+            refused INTEGER, answer TEXT, answer_preview TEXT, top_score REAL,
+            citations_json TEXT, reason TEXT, error_type TEXT,
+            error_message TEXT, error_trace TEXT
+        );
+        PRAGMA user_version = 2;
+        """
+    )
+    conn.close()
+    monkeypatch.setenv("DB_PATH", str(db_path))
+
+    history_id = record_rag_history(
+        user_id="u",
+        kb_id="kb",
+        question="q",
+        topk=5,
+        threshold=0.35,
+        embedding_model="text-embedding-3-small",
+        model="gpt-4o-mini",
+        result={"answer": "a", "refused": False, "top_score": 0.9, "citations": [], "cached": True},
+        status="success",
+        duration_ms=1,
+    )
+    assert get_rag_history("u", history_id)["cached"] is True
+    with get_conn() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app import batch
+from server.api.routers import text as text_router
+from server.main import create_app
+
+
+def test_process_many_bounds_concurrency_and_retries(monkeypatch):
+    monkeypatch.setattr(batch, "RETRY_BASE_SECONDS", 0.001)
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0, "attempts": {}}
+
+    def fn(text):
+        with lock:
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+            state["attempts"][text] = state["attempts"].get(text, 0) + 1
+            attempt = state["attempts"][text]
+        time.sleep(0.01)
+        with lock:
+            state["in_flight"] -= 1
+        if text == "bad" or (text == "flaky" and attempt == 1):
+            raise ValueError(f"failed {text}")
+        return {"summary_short": text}
+
+    texts = [f"t{i}" for i in range(10)] + ["flaky", "bad"]
+    items = list(batch.process_many(texts, concurrency=3, max_retries=2, fn=fn))
+
+    assert sorted(i.index for i in items) == list(range(len(texts)))
+    assert state["peak"] <= 3
+    by_text = {i.text: i for i in items}
+    assert by_text["flaky"].ok and by_text["flaky"].attempts == 2
+    assert not by_text["bad"].ok and by_text["bad"].attempts == 3
+    assert by_text["bad"].to_json()["error"]["type"] == "ValueError"
+
+
+def test_process_batch_streams_ndjson_and_writes_history(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    monkeypatch.setattr(batch, "RETRY_BASE_SECONDS", 0.001)
+
+    async def fake_process(text, use_cache=True):
+        if text == "bad":
+            raise ValueError("No valid JSON found")
+        return {"summary_short": text.upper()}, False
+
+    monkeypatch.setattr(text_router, "process_text_cached_async", fake_process)
+
+    client = TestClient(create_app())
+    res = client.post("/api/auth/register", json={"username": f"user_{uuid.uuid4().hex[:8]}", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {res.json()['token']}"}
+
+    payload = {
+        "items": [{"id": "a", "text": "hello"}, {"text": "world"}, {"id": "c", "text": "bad"}],
+        "concurrency": 2,
+        "max_retries": 1,
+    }
+    res = client.post("/api/text/process_batch", json=payload, headers=headers)
+    assert res.status_code == 200
+    lines = [json.loads(line) for line in res.text.splitlines()]
+
+    assert lines[-1] == {"summary": {"total": 3, "succeeded": 2, "failed": 1}}
+    items = {line["index"]: line for line in lines[:-1]}
+    assert items[0]["id"] == "a" and items[0]["result"]["summary_short"] == "HELLO"
+    assert "id" not in items[1]
+    assert items[2]["status"] == "error" and items[2]["attempts"] == 2
+
+    history = client.get("/api/text/history", headers=headers).json()["items"]
+    assert sorted(h["status"] for h in history) == ["error", "success", "success"]
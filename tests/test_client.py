@@ -0,0 +1,62 @@
+import asyncio
+
+import client
+
+
+def test_get_client_is_shared_until_config_changes(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+    monkeypatch.setenv("OPENAI_TIMEOUT", "60")
+
+    first = client.get_client()
+    assert client.get_client() is first
+
+    monkeypatch.setenv("OPENAI_TIMEOUT", "5")
+    second = client.get_client()
+    assert second is not first
+    assert second.timeout == 5.0
+    # The old client is not closed under callers that still hold it
+    assert not first._client.is_closed
+
+
+def test_evicted_clients_are_closed_after_a_grace_period(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+    monkeypatch.setenv("OPENAI_MAX_RETRIES", "0")
+    timers = []
+
+    class FakeTimer:
+        def __init__(self, delay, fn):
+            self.delay, self.fn, self.daemon = delay, fn, False
+
+        def start(self):
+            timers.append(self)
+
+    monkeypatch.setattr(client.threading, "Timer", FakeTimer)
+    client.close_clients()
+    made = []
+    for timeout in range(1, client.MAX_CLIENTS_PER_REGISTRY + 2):
+        monkeypatch.setenv("OPENAI_TIMEOUT", str(timeout))
+        made.append(client.get_client())
+    # Only the oldest config fell out of the registry; it closes once its calls could be done
+    assert len(timers) == 1 and timers[0].delay == 1.0 and timers[0].daemon
+    assert not made[0]._client.is_closed
+    timers[0].fn()
+    assert made[0]._client.is_closed
+    assert not any(c._client.is_closed for c in made[1:])
+    client.close_clients()
+
+
+def test_get_async_client_is_per_event_loop(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+
+    async def twice():
+        a, b = client.get_async_client(), client.get_async_client()
+        await client.aclose_clients()
+        return a, b
+
+    a1, b1 = asyncio.run(twice())
+    a2, _ = asyncio.run(twice())
+    assert a1 is b1
+    assert a2 is not a1
@@ -0,0 +1,36 @@
+import threading
+
+from server.services import db
+
+
+def test_get_conn_reuses_per_thread_connection_and_sets_schema_once(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    calls = []
+    original = db._ensure_schema
+    monkeypatch.setattr(db, "_ensure_schema", lambda conn: (calls.append(1), original(conn)))
+
+    first = db.get_conn()
+    with db.get_conn() as conn:
+        conn.execute("INSERT INTO users (id, username, password_hash, created_at) VALUES ('u', 'a', 'h', 'now')")
+    assert db.get_conn() is first
+    assert first.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert first.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert first.execute("PRAGMA busy_timeout").fetchone()[0] == db.DEFAULT_BUSY_TIMEOUT_MS
+
+    other = {}
+
+    def worker():
+        conn = db.get_conn()
+        other["conn"] = conn
+        other["count"] = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    assert other["conn"] is not first and other["count"] == 1
+    assert len(calls) == 1
+
+    db.close_connections()
+    with db.get_conn() as conn:
+        assert conn is not first
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai import RateLimitError
+
+from app import rag
+from app.embedder import embed_concurrent, make_batches
+
+
+class _FakeEmbeddings:
+    def __init__(self, fail_first: int = 0, delay: float = 0.05):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.fail_first = fail_first
+        self.delay = delay
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake.lock:
+                    fake.requests += 1
+                    limited = fake.rate_limited < fake.fail_first
+                    if limited:
+                        fake.rate_limited += 1
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    time.sleep(fake.delay)
+                    if limited:
+                        self._send(429, {"error": {"message": "slow down", "type": "rate_limit"}},
+                                   {"retry-after-ms": "10"})
+                        return
+                    data = [
+                        {"object": "embedding", "index": i, "embedding": [float(len(t)), float(ord(t[0])), 1.0]}
+                        for i, t in enumerate(body["input"])
+                    ]
+                    self._send(200, {
+                        "object": "list",
+                        "data": data,
+                        "model": body["model"],
+                        "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                    })
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+        return Handler
+
+
+def _serve(fake, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setenv("OPENAI_MAX_RETRIES", "0")
+    return server
+
+
+def test_make_batches_bounds_tokens_and_items():
+    texts = ["a" * 40, "b" * 40, "c" * 40, "中文" * 10]
+    assert make_batches(texts, max_batch_tokens=20, max_batch_items=10) == [[0, 1], [2], [3]]
+    assert make_batches(texts, max_batch_tokens=1000, max_batch_items=3) == [[0, 1, 2], [3]]
+
+
+def test_embed_concurrent_against_fake_server(monkeypatch):
+    fake = _FakeEmbeddings(fail_first=2)
+    server = _serve(fake, monkeypatch)
+    try:
+        texts = [chr(ord("a") + i % 26) * (i + 1) for i in range(40)]
+        vectors = embed_concurrent(
+            texts,
+            "text-embedding-3-small",
+            embed_fn=rag._embed_texts,
+            max_in_flight=4,
+            max_batch_items=4,
+        )
+    finally:
+        server.shutdown()
+
+    assert [v[0] for v in vectors] == [float(len(t)) for t in texts]
+    assert [v[1] for v in vectors] == [float(ord(t[0])) for t in texts]
+    assert fake.rate_limited == 2
+    assert fake.requests == 10 + 2
+    assert 1 < fake.max_in_flight <= 4
+
+
+def test_sustained_429_is_retried_by_the_limiter_only(monkeypatch):
+    fake = _FakeEmbeddings(fail_first=100, delay=0.0)
+    server = _serve(fake, monkeypatch)
+    # SDK retries left at their default: the limiter must still be the only retry layer
+    monkeypatch.setenv("OPENAI_MAX_RETRIES", "5")
+    monkeypatch.setenv("RATE_LIMIT_MAX_RETRIES", "2")
+    try:
+        with pytest.raises(RateLimitError):
+            embed_concurrent(["alpha"], "text-embedding-3-small", embed_fn=rag._embed_texts)
+    finally:
+        server.shutdown()
+
+    assert fake.requests == 3
@@ -38,3 +38,140 @@ def test_history_endpoints_empty(tmp_path, monkeypatch):
 
     res = client.get("/api/text/history/not-found", headers=headers)
     assert res.status_code == 404
+
+
+def test_rag_history_keyset_pagination_and_filters(tmp_path, monkeypatch):
+    from server.services.history_store import record_rag_history
+
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("HISTORY_LIMIT", "100")
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    client = TestClient(create_app())
+    res = client.post("/api/auth/register", json={"username": f"user_{uuid.uuid4().hex[:8]}", "password": "pass1234"})
+    user_id = res.json()["user"]["id"]
+    headers = {"Authorization": f"Bearer {res.json()['token']}"}
+
+    for i in range(25):
+        refused = i % 5 == 0
+        record_rag_history(
+            user_id=user_id,
+            kb_id="kb_a" if i % 2 else "kb_b",
+            question=f"q{i}",
+            topk=5,
+            threshold=0.35,
+            embedding_model="text-embedding-3-small",
+            model="gpt-4o-mini",
+            result={"answer": "a", "refused": refused, "top_score": 0.5, "citations": []},
+            status="refused" if refused else "success",
+            duration_ms=1,
+        )
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 10, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/rag/history", params=params, headers=headers).json()
+        seen.extend(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert len(seen) == 25 and len({it["id"] for it in seen}) == 25
+    keys = [(it["created_ts"], it["id"]) for it in seen]
+    assert keys == sorted(keys, reverse=True)
+
+    page = client.get("/api/rag/history", params={"kb_id": "kb_a", "limit": 100}, headers=headers).json()
+    assert len(page["items"]) == 12 and page["next_cursor"] is None
+    page = client.get("/api/rag/history", params={"refused": "true"}, headers=headers).json()
+    assert {it["status"] for it in page["items"]} == {"refused"} and len(page["items"]) == 5
+    page = client.get("/api/rag/history", params={"until": "2000-01-01T00:00:00"}, headers=headers).json()
+    assert page["items"] == []
+
+    res = client.get("/api/rag/history", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert res.status_code == 400
+
+
+def test_history_search_ranked_per_user_and_synced(tmp_path, monkeypatch):
+    from server.services.history_store import record_rag_history, record_text_history
+    from server.services.user_store import delete_user
+
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("HISTORY_LIMIT", "100")
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    # Use the FTS index even for these tiny histories
+    monkeypatch.setenv("HISTORY_SEARCH_SCAN_ROWS", "0")
+    client = TestClient(create_app())
+    users = []
+    for _ in range(2):
+        res = client.post("/api/auth/register", json={"username": f"user_{uuid.uuid4().hex[:8]}", "password": "pass1234"})
+        users.append((res.json()["user"]["id"], {"Authorization": f"Bearer {res.json()['token']}"}))
+    (alice, alice_headers), (bob, bob_headers) = users
+
+    def ask(user_id, question, answer):
+        record_rag_history(
+            user_id=user_id,
+            kb_id="kb",
+            question=question,
+            topk=5,
+            threshold=0.35,
+            embedding_model="text-embedding-3-small",
+            model="gpt-4o-mini",
+            result={"answer": answer, "refused": False, "top_score": 0.5, "citations": []},
+            status="success",
+            duration_ms=1,
+        )
+
+    ask(alice, "如何配置向量索引", "在知识库页面点击构建索引")
+    ask(alice, "天气怎么样", "无关问题，索引里没有天气")
+    ask(alice, "索引构建失败", "索引构建日志里能看到索引构建失败的原因")
+    ask(alice, "索引构建要多久", "取决于文档数量")
+    for i in range(3):
+        ask(alice, f"闲聊 {i}", "没有相关内容")
+    ask(bob, "向量索引在哪里", "bob 的记录")
+
+    res = client.get("/api/rag/history/search", params={"q": "向量索引"}, headers=alice_headers)
+    assert res.status_code == 200
+    body = res.json()
+    assert body["mode"] == "fts"
+    assert [it["question_preview"] for it in body["items"]] == ["如何配置向量索引"]
+
+    # Best match first, even when it is older; small histories are scanned and ranked the same way
+    for scan_rows, mode in (("0", "fts"), ("2000", "scan")):
+        monkeypatch.setenv("HISTORY_SEARCH_SCAN_ROWS", scan_rows)
+        body = client.get("/api/rag/history/search", params={"q": "索引构建"}, headers=alice_headers).json()
+        assert body["mode"] == mode
+        assert [it["question_preview"] for it in body["items"]] == ["索引构建失败", "索引构建要多久"]
+    monkeypatch.setenv("HISTORY_SEARCH_SCAN_ROWS", "0")
+
+    # Terms shorter than a trigram fall back to a scan of the user's rows
+    body = client.get("/api/rag/history/search", params={"q": "索引"}, headers=alice_headers).json()
+    assert body["mode"] == "scan" and len(body["items"]) == 4
+    body = client.get("/api/rag/history/search", params={"q": "没有相关内容", "limit": 2}, headers=alice_headers).json()
+    assert len(body["items"]) == 2 and body["next_cursor"]
+    rest = client.get(
+        "/api/rag/history/search",
+        params={"q": "没有相关内容", "limit": 2, "cursor": body["next_cursor"]},
+        headers=alice_headers,
+    ).json()
+    assert len(rest["items"]) == 1 and rest["next_cursor"] is None
+
+    assert client.get("/api/rag/history/search", params={"q": "  "}, headers=alice_headers).status_code == 400
+    assert client.get("/api/rag/history/search", params={"q": "x", "cursor": "!!"}, headers=alice_headers).status_code == 400
+
+    record_text_history(
+        user_id=bob,
+        input_text="Quarterly revenue report for the Shanghai office",
+        result={"summary_short": "revenue up"},
+        status="success",
+        duration_ms=1,
+    )
+    body = client.get("/api/text/history/search", params={"q": "shanghai REVENUE"}, headers=bob_headers).json()
+    assert len(body["items"]) == 1 and body["items"][0]["score"] is not None
+    assert client.get("/api/text/history/search", params={"q": "shanghai"}, headers=alice_headers).json()["items"] == []
+
+    # Deletes reach the index through triggers
+    delete_user(bob)
+    from server.services.db import get_conn
+
+    with get_conn() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM history_text_fts WHERE history_text_fts MATCH 'shanghai'").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM history_rag_fts WHERE history_rag_fts MATCH '\"向量索引\"'").fetchone()[0] == 1
@@ -0,0 +1,89 @@
+import time
+
+from server.services import history_store
+from server.services.db import get_conn
+from server.services.history_store import compact_history, record_text_history
+
+
+def _record(user_id: str, i: int) -> None:
+    record_text_history(
+        user_id=user_id,
+        input_text=f"text {i}",
+        result={"summary_short": str(i)},
+        status="success",
+        duration_ms=1,
+    )
+
+
+def _count(user_id: str = None) -> int:
+    with get_conn() as conn:
+        if user_id is None:
+            return conn.execute("SELECT COUNT(*) FROM history_text").fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM history_text WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_per_user_trim_is_amortized_and_keeps_newest(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("HISTORY_LIMIT", "10")
+    monkeypatch.setenv("HISTORY_TRIM_EVERY", "5")
+    history_store._inserts_since_trim.clear()
+
+    for i in range(14):
+        _record("u", i)
+    # Checked every 5th insert only: up to HISTORY_TRIM_EVERY rows over the limit in between
+    assert _count("u") == 14
+    _record("u", 14)
+    assert _count("u") == 10
+
+    items = history_store.list_text_history("u", 100)
+    assert len(items) == 10
+    assert "14" in {it["summary_short"] for it in items}
+
+
+def test_compaction_applies_user_global_and_age_limits(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("HISTORY_LIMIT", "8")
+    monkeypatch.setenv("HISTORY_TRIM_EVERY", "1000")
+    for user_id in ("a", "b", "c"):
+        for i in range(10):
+            _record(user_id, i)
+    with get_conn() as conn:
+        conn.execute("UPDATE history_text SET created_ts = created_ts - ? WHERE user_id = 'c'", (40 * 86400 * 1000,))
+
+    monkeypatch.setenv("HISTORY_GLOBAL_MAX_RECORDS", "12")
+    monkeypatch.setenv("HISTORY_MAX_AGE_DAYS", "30")
+    deleted = compact_history()
+
+    assert _count("c") == 0
+    assert _count() == 12
+    assert deleted["history_text"] == 30 - 12
+    assert history_store.history_writer_stats()["retention"]["compactions"] >= 1
+
+
+def test_pages_stop_at_history_limit_and_compaction_runs_in_background(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("HISTORY_LIMIT", "4")
+    monkeypatch.setenv("HISTORY_TRIM_EVERY", "1000")
+    monkeypatch.setenv("HISTORY_COMPACT_INTERVAL", "0.05")
+    history_store._inserts_since_trim.clear()
+    ticks = iter(range(1_000, 2_000))
+    monkeypatch.setattr(history_store, "_now_ts_ms", lambda: next(ticks))
+    for i in range(7):
+        _record("u", i)
+    # Untrimmed rows past the limit are still stored but no page or search reaches them
+    assert _count("u") == 7
+    first = history_store.page_text_history("u", 3)
+    rest = history_store.page_text_history("u", 3, cursor=first["next_cursor"])
+    assert rest["next_cursor"] is None
+    assert [it["summary_short"] for it in first["items"] + rest["items"]] == ["6", "5", "4", "3"]
+    assert len(history_store.search_text_history("u", "text", 100)["items"]) == 4
+
+    # Writes never compact inline; the maintenance thread does
+    history_store.start_history_maintenance()
+    try:
+        deadline = time.monotonic() + 5
+        while _count("u") > 4 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        history_store.stop_history_maintenance()
+    assert _count("u") == 4
@@ -0,0 +1,72 @@
+import threading
+
+from server.services import history_store
+from server.services.history_store import (
+    get_history_writer,
+    history_writer_stats,
+    list_text_history,
+    record_text_history,
+    shutdown_history_writer,
+)
+
+
+def _record(i: int) -> str:
+    return record_text_history(
+        user_id="u",
+        input_text=f"text {i}",
+        result={"summary_short": str(i)},
+        status="success",
+        duration_ms=1,
+    )
+
+
+def test_async_writer_batches_flushes_for_reads_and_drains(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("HISTORY_WRITE_MODE", "async")
+    monkeypatch.setenv("HISTORY_WRITE_INTERVAL_MS", "500")
+    monkeypatch.setenv("HISTORY_LIMIT", "1000")
+    writer = get_history_writer()
+    try:
+        for i in range(50):
+            _record(i)
+        assert history_writer_stats()["queue_depth"] > 0
+
+        # Reads wait for queued rows of this process
+        assert len(list_text_history("u", 1000)) == 50
+        stats = writer.stats()
+        assert stats["queue_depth"] == 0 and stats["written"] == 50
+        assert stats["batches"] <= 2
+
+        for i in range(50, 60):
+            _record(i)
+    finally:
+        shutdown_history_writer()
+
+    assert writer.stats()["written"] == 60
+    # After shutdown, records are written synchronously by the closed writer: no new thread
+    threads = threading.active_count()
+    _record(60)
+    assert get_history_writer() is writer and threading.active_count() == threads
+    assert writer.stats()["enqueued"] == 60
+    monkeypatch.setenv("HISTORY_WRITE_MODE", "sync")
+    assert len(list_text_history("u", 1000)) == 61
+
+    # An app startup opts back in to a background writer
+    monkeypatch.setenv("HISTORY_WRITE_MODE", "async")
+    history_store.start_history_writer()
+    assert get_history_writer() is not writer
+    shutdown_history_writer()
+
+
+def test_writer_failure_is_counted_not_raised(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("HISTORY_WRITE_MODE", "async")
+
+    def broken(items):
+        raise RuntimeError("disk full")
+
+    writer = history_store.HistoryWriter(broken, flush_interval=0)
+    writer.submit(("history_text", "u", [("row",)]))
+    assert writer.flush()
+    writer.close()
+    assert writer.stats()["failed"] == 1 and writer.stats()["queue_depth"] == 0
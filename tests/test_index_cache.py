@@ -0,0 +1,57 @@
+import numpy as np
+
+from app.rag import Chunk
+from app.vector_index import VectorIndex
+from server.services.index_cache import IndexCache
+
+
+def _fake_loader(calls):
+    def load(index_dir, chunks_path):
+        calls.append(index_dir)
+        chunks = {"c0": Chunk(chunk_id="c0", source_file="a.md", section_id=0, text="x" * 10)}
+        return chunks, VectorIndex(["c0"], np.ones((1, 64), dtype=np.float32))
+    return load
+
+
+def test_index_cache_hit_miss_and_lru_eviction(tmp_path):
+    calls = []
+    loader = _fake_loader(calls)
+    cache = IndexCache(max_bytes=700)
+    paths = {}
+    for kb in ("kb1", "kb2"):
+        (tmp_path / kb / "index").mkdir(parents=True)
+        (tmp_path / kb / "chunks.json").write_text("[]", encoding="utf-8")
+        paths[kb] = (tmp_path / kb / "index", tmp_path / kb / "chunks.json")
+
+    cache.get_or_load("u", "kb1", *paths["kb1"], loader=loader)
+    cache.get_or_load("u", "kb1", *paths["kb1"], loader=loader)
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+    # Each entry is ~532 bytes, so loading kb2 evicts kb1
+    cache.get_or_load("u", "kb2", *paths["kb2"], loader=loader)
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["evictions"] == 1
+    assert stats["bytes"] <= stats["max_bytes"]
+
+    assert cache.invalidate("u", "kb2") == 1
+    cache.get_or_load("u", "kb2", *paths["kb2"], loader=loader)
+    assert len(calls) == 3
+
+
+def test_index_cache_reloads_when_index_rewritten(tmp_path):
+    calls = []
+    loader = _fake_loader(calls)
+    cache = IndexCache()
+    index_dir = tmp_path / "index"
+    index_dir.mkdir()
+    chunks_path = tmp_path / "chunks.json"
+    chunks_path.write_text("[]", encoding="utf-8")
+
+    cache.get_or_load("u", "kb", index_dir, chunks_path, loader=loader)
+    chunks_path.write_text("[ ]", encoding="utf-8")
+    cache.get_or_load("u", "kb", index_dir, chunks_path, loader=loader)
+
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 1
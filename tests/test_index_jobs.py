@@ -0,0 +1,139 @@
+import threading
+import time
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app import rag
+from server.main import create_app
+from server.services import index_jobs, kb_store
+from server.services.db import get_conn
+from server.services.index_jobs import IndexJobRunner, enqueue_job, get_index_status
+
+
+def _fake_embed(texts, model):
+    return [[float(len(t)), float(sum(map(ord, t)) % 97), 1.0] for t in texts]
+
+
+def test_index_job_api_builds_in_background_with_progress(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    monkeypatch.setattr(kb_store, "KBS_DIR", tmp_path / "kbs")
+    monkeypatch.setattr(rag, "_embed_texts", _fake_embed)
+
+    with TestClient(create_app()) as client:
+        res = client.post("/api/auth/register", json={"username": f"user_{uuid.uuid4().hex[:8]}", "password": "pass1234"})
+        headers = {"Authorization": f"Bearer {res.json()['token']}"}
+        res = client.post(
+            "/api/kb/upload",
+            files=[("files", ("a.md", "# A\nalpha policy\n\n# B\nbeta rules".encode("utf-8"), "text/markdown"))],
+            data={"kb_id": "kb_jobs"},
+            headers=headers,
+        )
+        assert res.status_code == 200
+
+        assert client.post("/api/kb/kb_missing/index", headers=headers).status_code == 404
+        assert client.get("/api/kb/kb_missing/index/status", headers=headers).status_code == 404
+
+        res = client.post("/api/kb/kb_jobs/index", headers=headers)
+        assert res.status_code == 202
+        job_id = res.json()["job_id"]
+        assert res.json()["status"] in ("queued", "running", "succeeded")
+
+        deadline = time.monotonic() + 10
+        while True:
+            status = client.get("/api/kb/kb_jobs/index/status", headers=headers).json()
+            if status["job"]["status"] in ("succeeded", "failed") or time.monotonic() > deadline:
+                break
+            time.sleep(0.02)
+        job = status["job"]
+        assert job["id"] == job_id and job["status"] == "succeeded", job
+        assert job["stats"]["chunks"] == 2
+        assert job["progress"]["stage"] == "succeeded"
+        assert job["progress"]["files_total"] == 1
+        assert job["progress"]["chunks_embedded"] == job["progress"]["chunks_to_embed"] == 2
+        assert status["index"]["built"] is True and status["index"]["chunks"] == 2
+        # The DB names the published version, not a chunks file outside it
+        assert status["index"]["build_id"] == job["stats"]["build_id"]
+        assert status["index"]["chunks_path"] is None
+
+        # Other users cannot see the job
+        res = client.post("/api/auth/register", json={"username": f"user_{uuid.uuid4().hex[:8]}", "password": "pass1234"})
+        other = {"Authorization": f"Bearer {res.json()['token']}"}
+        assert client.get("/api/kb/kb_jobs/index/status", headers=other).status_code == 404
+
+
+def test_index_jobs_coalesce_limit_per_user_and_resume_after_restart(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+
+    release = threading.Event()
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+    calls = []
+
+    def build(*, user_id, kb_id, progress):
+        with lock:
+            calls.append((user_id, kb_id))
+            running[user_id] = running.get(user_id, 0) + 1
+            peak[user_id] = max(peak.get(user_id, 0), running[user_id])
+        progress({"stage": "embedding", "chunks_to_embed": 10, "chunks_embedded": 0, "chunks_cached": 0})
+        release.wait(5)
+        with lock:
+            running[user_id] -= 1
+        return {"chunks": 10}
+
+    first = enqueue_job("u", "kb1")
+    assert first["coalesced"] is False
+    again = enqueue_job("u", "kb1")
+    assert again["coalesced"] is True and again["job"]["id"] == first["job"]["id"]
+    assert again["job"]["submissions"] == 2
+    enqueue_job("u", "kb2")
+    enqueue_job("v", "kb3")
+
+    runner = IndexJobRunner(build=build, workers=3, per_user=1)
+    runner.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(calls) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        # One build per user at a time: kb2 waits for kb1, v's build runs alongside
+        assert sorted(calls) == [("u", "kb1"), ("v", "kb3")]
+        assert get_index_status("u", "kb2")["job"]["status"] == "queued"
+        assert get_index_status("u", "kb1")["job"]["progress"]["stage"] == "embedding"
+
+        # The KB has not changed since kb1 started: a resubmit joins the running build
+        joined = enqueue_job("u", "kb1", kb_updated_at="2000-01-01T00:00:00Z")
+        assert joined["coalesced"] is True and joined["job"]["status"] == "running"
+        # Files uploaded after the build started: one follow-up job, later submits join it
+        follow = enqueue_job("u", "kb1", kb_updated_at="2999-01-01T00:00:00Z")
+        assert follow["coalesced"] is False
+        assert enqueue_job("u", "kb1", kb_updated_at="2999-01-01T00:00:00Z")["job"]["id"] == follow["job"]["id"]
+        assert get_index_status("u", "kb1")["next_job"]["id"] == follow["job"]["id"]
+
+        release.set()
+        assert runner.wait_idle(5)
+    finally:
+        release.set()
+        runner.close()
+    assert peak == {"u": 1, "v": 1}
+    assert sorted(calls) == [("u", "kb1"), ("u", "kb1"), ("u", "kb2"), ("v", "kb3")]
+    assert get_index_status("u", "kb2")["job"]["stats"] == {"chunks": 10}
+
+    # A build interrupted by a crash: still "running" with a stale heartbeat
+    stale = enqueue_job("w", "kb4")["job"]["id"]
+    with get_conn() as conn:
+        conn.execute(
+            "UPDATE index_jobs SET status = 'running', attempts = 1, started_ts = 1, heartbeat_ts = 1 WHERE id = ?",
+            (stale,),
+        )
+    runner = IndexJobRunner(build=build, workers=1, stale_seconds=1)
+    runner.start()
+    try:
+        assert runner.wait_idle(5)
+    finally:
+        runner.close()
+    job = get_index_status("w", "kb4")["job"]
+    assert job["id"] == stale and job["status"] == "succeeded" and job["attempts"] == 2
+    assert index_jobs.index_job_stats()["running"] == 0
@@ -1,3 +1,4 @@
+import asyncio
 import json
 
 from app import pipeline
@@ -34,7 +35,7 @@ def test_safe_json_loads_supports_markdown_code_fence():
 
 
 def test_process_text_uses_lazy_client(monkeypatch):
-    monkeypatch.setattr(pipeline, "get_client", lambda: _FakeClient())
+    monkeypatch.setattr(pipeline, "get_client", lambda **_: _FakeClient())
     monkeypatch.setattr(pipeline, "load_prompt", lambda _: "{TEXT}")
     monkeypatch.setattr(pipeline, "render_prompt", lambda tpl, **kwargs: kwargs["TEXT"])
 
@@ -42,3 +43,86 @@ def test_process_text_uses_lazy_client(monkeypatch):
 
     assert out["summary_short"] == "ok"
     assert out["entities"]["people"] == []
+
+
+class _FakeAsyncResponses:
+    async def create(self, model: str, input: str):
+        return _FakeResponses().create(model=model, input=input)
+
+
+class _FakeAsyncClient:
+    responses = _FakeAsyncResponses()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return None
+
+
+def test_process_text_async_matches_sync(monkeypatch):
+    monkeypatch.setattr(pipeline, "get_client", lambda **_: _FakeClient())
+    monkeypatch.setattr(pipeline, "get_async_client", lambda **_: _FakeAsyncClient())
+    monkeypatch.setattr(pipeline, "load_prompt", lambda _: "{TEXT}")
+    monkeypatch.setattr(pipeline, "render_prompt", lambda tpl, **kwargs: kwargs["TEXT"])
+
+    out = asyncio.run(pipeline.process_text_async("hello"))
+
+    assert out == pipeline.process_text("hello")
+
+
+def test_split_long_text_packs_sections_within_chunk_size():
+    text = "\n\n".join(f"# 第{i}节\n" + "内容" * 300 for i in range(5))
+
+    chunks = pipeline.split_long_text(text, chunk_chars=1500, overlap=50)
+
+    assert len(chunks) > 1
+    assert all(len(c) <= 1500 for c in chunks)
+    assert "第0节" in chunks[0] and "第4节" in chunks[-1]
+
+
+class _MapReduceResponses:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, model: str, input: str):
+        self.calls.append(input)
+        if "各片段结果如下" in input:
+            payload = {
+                "summary_short": "全文摘要",
+                "summary_bullets": ["x", "y", "z"],
+                "topic": "科技",
+                "sentiment": "中性",
+                "keywords": ["k1", "k2", "k3"],
+            }
+        else:
+            n = len(self.calls)
+            payload = {
+                "summary_short": f"part{n}",
+                "summary_bullets": ["a", "b", "c"],
+                "topic": "其他",
+                "sentiment": "中性",
+                "keywords": [f"w{n}"],
+                "entities": {"time": None if n == 1 else "2024年", "location": None, "people": ["张三", f"p{n}"], "orgs": []},
+                "rewrite_formal": f"rewrite{n}",
+            }
+        return _FakeResp(json.dumps(payload, ensure_ascii=False))
+
+
+def test_process_text_long_maps_chunks_and_reduces(monkeypatch):
+    responses = _MapReduceResponses()
+    client = type("C", (), {"responses": responses})()
+    monkeypatch.setattr(pipeline, "get_client", lambda **_: client)
+    monkeypatch.setenv("PROCESS_CHUNK_CHARS", "1300")
+    text = "\n\n".join(f"# 第{i}节\n" + "内容" * 300 for i in range(3))
+
+    out = pipeline.process_text(text, long_mode=True)
+
+    map_calls = [c for c in responses.calls if "各片段结果如下" not in c]
+    assert len(map_calls) == len(pipeline.split_long_text(text, 1300, 200)) == 2
+    assert len(responses.calls) == 3
+    assert out["summary_short"] == "全文摘要"
+    assert out["keywords"] == ["k1", "k2", "k3"]
+    assert out["entities"]["time"] == "2024年"
+    assert out["entities"]["people"][0] == "张三" and len(out["entities"]["people"]) == 3
+    assert out["rewrite_formal"].count("rewrite") == 2
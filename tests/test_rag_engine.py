@@ -0,0 +1,592 @@
+import json
+import random
+import time
+
+import numpy as np
+
+from app import index_store, rag
+from app.ann import IVFIndex
+from app.embed_cache import EmbeddingCache
+from app.quantize import QuantizedIndex
+from app.query_cache import QueryEmbeddingCache
+from app.vector_index import VectorIndex
+
+
+def _random_embeddings(n: int, dim: int, seed: int = 7):
+    rnd = random.Random(seed)
+    return {f"chunk_{i:06d}": [rnd.uniform(-1, 1) for _ in range(dim)] for i in range(n)}
+
+
+def _chunks_for(embeddings):
+    return {
+        cid: rag.Chunk(chunk_id=cid, source_file="a.md", section_id=0, text=cid)
+        for cid in embeddings
+    }
+
+
+def test_vector_index_matches_python_cosine():
+    embeddings = _random_embeddings(200, 16)
+    query = [random.Random(1).uniform(-1, 1) for _ in range(16)]
+
+    expected = sorted(
+        ((cid, rag._cosine_similarity(query, emb)) for cid, emb in embeddings.items()),
+        key=lambda x: x[1],
+        reverse=True,
+    )[:5]
+    got = VectorIndex.from_embeddings(embeddings).search(query, 5)
+
+    assert [cid for cid, _ in got] == [cid for cid, _ in expected]
+    for (_, a), (_, b) in zip(got, expected):
+        assert abs(a - b) < 1e-5
+
+
+def test_retrieve_wrapper_accepts_dict_and_skips_unknown_chunks(monkeypatch):
+    embeddings = _random_embeddings(20, 8)
+    chunks = _chunks_for(embeddings)
+    query = embeddings["chunk_000003"]
+    monkeypatch.setattr(rag, "_embed_texts", lambda texts, model: [query])
+
+    out = rag.retrieve("q", chunks=chunks, embeddings=embeddings, topk=3, embedding_model="m")
+    assert len(out) == 3
+    assert out[0].chunk.chunk_id == "chunk_000003"
+    assert abs(out[0].score - 1.0) < 1e-5
+
+    del chunks["chunk_000003"]
+    out = rag.retrieve("q", chunks=chunks, embeddings=embeddings, topk=3, embedding_model="m")
+    assert len(out) == 3
+    assert all(r.chunk.chunk_id != "chunk_000003" for r in out)
+
+
+def test_vector_index_empty_and_zero_vectors():
+    assert VectorIndex.from_embeddings({}).search([1.0, 0.0], 3) == []
+
+    index = VectorIndex.from_embeddings({"a": [0.0, 0.0], "b": [1.0, 0.0]})
+    hits = index.search([1.0, 0.0], 2)
+    assert hits[0] == ("b", 1.0)
+    assert hits[1] == ("a", 0.0)
+
+
+def _fake_embed(texts, model):
+    return [[float(len(t)), float(sum(map(ord, t)) % 97), 1.0] for t in texts]
+
+
+def _make_kb(tmp_path):
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "a.md").write_text("# A\nalpha policy\n\n# B\nbeta rules", encoding="utf-8")
+    (kb / "b.txt").write_text("gamma notes", encoding="utf-8")
+    return kb
+
+
+def test_build_index_writes_binary_and_loads_mmap(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag, "_embed_texts", _fake_embed)
+    kb = _make_kb(tmp_path)
+    index_dir = tmp_path / "index"
+    chunks_path = tmp_path / "chunks.json"
+
+    stats = rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))
+    assert stats["chunks"] == 3
+    assert index_store.detect_format(str(index_dir)) == "binary"
+    header = index_store.read_header(str(index_dir))
+    assert header["dim"] == 3
+    assert header["chunking"] == {"max_len": 800, "overlap": 120}
+
+    chunks, vectors = rag.load_index(str(index_dir), str(chunks_path))
+    assert isinstance(vectors.matrix, np.memmap)
+    assert sorted(vectors) == sorted(chunks)
+
+
+def test_builds_publish_new_versions_and_gc_waits_for_readers(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag, "_embed_texts", _fake_embed)
+    kb = _make_kb(tmp_path)
+    index_dir = tmp_path / "index"
+    chunks_path = tmp_path / "chunks.json"
+    versions = index_dir / index_store.VERSIONS_DIR
+
+    # An index in the old flat layout, chunk table included, is replaced by the first versioned build
+    index_store.write_index(str(index_dir), ["x"], [[1.0, 0.0, 0.0]], embedding_model="m", max_len=1, overlap=0)
+    chunks_path.write_text(
+        json.dumps([{"chunk_id": "x", "source_file": "old.md", "section_id": 0, "text": "old"}]), encoding="utf-8"
+    )
+    first = rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))["build_id"]
+    assert index_store.current_build_id(str(index_dir)) == first
+    assert not (index_dir / index_store.HEADER_FILE).exists() and not chunks_path.exists()
+    chunks, _ = rag.load_index(str(index_dir), str(chunks_path))
+    assert len(chunks) == 3
+
+    # A reader holding the first version keeps it alive across two more publishes
+    with index_store.pin_index(str(index_dir)) as pinned:
+        assert pinned.name == first
+        (kb / "c.md").write_text("delta", encoding="utf-8")
+        second = rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))["build_id"]
+        third = rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))["build_id"]
+        assert {p.name for p in versions.iterdir()} == {first, second, third}
+        assert json.loads((pinned / index_store.CHUNKS_FILE).read_text(encoding="utf-8"))[0]["text"]
+    # Released: only the live version and the newest superseded one remain
+    assert {p.name for p in versions.iterdir()} == {second, third}
+    chunks, vectors = rag.load_index(str(index_dir), str(chunks_path))
+    assert len(chunks) == 4 and sorted(chunks) == sorted(vectors)
+    assert vectors.meta["build_id"] == third
+
+    # A failed build leaves the live version untouched and no staging dir behind
+    monkeypatch.setattr(rag, "write_manifest", lambda *a, **k: (_ for _ in ()).throw(OSError("disk full")))
+    (kb / "d.md").write_text("epsilon", encoding="utf-8")
+    try:
+        rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))
+    except OSError:
+        pass
+    assert index_store.current_build_id(str(index_dir)) == third
+    assert {p.name for p in versions.iterdir()} == {second, third}
+
+
+def test_publish_keeps_chunks_path_of_another_flat_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag, "_embed_texts", _fake_embed)
+    kb = _make_kb(tmp_path)
+    shared = tmp_path / "chunks.json"
+    flat, other = tmp_path / "flat", tmp_path / "other"
+    index_store.write_index(str(flat), ["x"], [[1.0, 0.0, 0.0]], embedding_model="m", max_len=1, overlap=0)
+    shared.write_text(
+        json.dumps([{"chunk_id": "x", "source_file": "old.md", "section_id": 0, "text": "old"}]), encoding="utf-8"
+    )
+
+    # Both indexes use the same (default) chunks path; only the flat one owns it
+    rag.build_index(str(kb), index_dir=str(other), chunks_path=str(shared))
+    assert shared.exists()
+    chunks, _ = rag.load_index(str(flat), str(shared))
+    assert list(chunks) == ["x"]
+
+    rag.build_index(str(kb), index_dir=str(flat), chunks_path=str(shared))
+    assert not shared.exists()
+
+
+def test_cached_index_keeps_its_version_until_evicted_and_released(tmp_path, monkeypatch):
+    from server.services.index_cache import IndexCache
+
+    monkeypatch.setattr(rag, "_embed_texts", _fake_embed)
+    kb = _make_kb(tmp_path)
+    index_dir = tmp_path / "index"
+    chunks_path = tmp_path / "chunks.json"
+    versions = index_dir / index_store.VERSIONS_DIR
+    first = rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))["build_id"]
+
+    cache = IndexCache()
+    cache.get_or_load("u", "kb", index_dir, chunks_path)
+    with cache.lease("u", "kb", index_dir, chunks_path) as (_, vectors):
+        (kb / "c.md").write_text("delta", encoding="utf-8")
+        for _ in range(2):
+            rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))
+        # Two builds later the cached version would normally be collected
+        assert first in {p.name for p in versions.iterdir()}
+        # The next lookup loads the new build; the in-flight query still reads the old mmaps
+        cache.get_or_load("u", "kb", index_dir, chunks_path)
+        assert first in {p.name for p in versions.iterdir()}
+        assert len(vectors.search([1.0, 0.0, 0.0], 3)) == 3
+    assert first not in {p.name for p in versions.iterdir()}
+
+    live = index_store.current_build_id(str(index_dir))
+    cache.clear()
+    rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))
+    assert live in {p.name for p in versions.iterdir()}
+    rag.build_index(str(kb), index_dir=str(index_dir), chunks_path=str(chunks_path))
+    assert live not in {p.name for p in versions.iterdir()}
+
+
+def test_convert_jsonl_index_roundtrip(tmp_path):
+    embeddings = _random_embeddings(10, 4)
+    index_dir = tmp_path / "index"
+    index_dir.mkdir()
+    with (index_dir / "embeddings.jsonl").open("w", encoding="utf-8") as f:
+        for cid, emb in embeddings.items():
+            f.write(json.dumps({"chunk_id": cid, "embedding": emb}) + "\n")
+
+    assert index_store.detect_format(str(index_dir)) == "jsonl"
+    legacy = index_store.load_vectors(str(index_dir))
+
+    converted = index_store.migrate_tree(str(tmp_path), embedding_model="m", remove_jsonl=True)
+    assert converted == [str(index_dir)]
+    assert index_store.detect_format(str(index_dir)) == "binary"
+    assert not (index_dir / "embeddings.jsonl").exists()
+
+    binary = index_store.load_vectors(str(index_dir))
+    assert binary.ids == legacy.ids
+    assert np.allclose(np.asarray(binary.matrix), legacy.matrix)
+
+
+def test_ivf_full_probe_matches_exact_and_falls_back_for_small_kbs(tmp_path, monkeypatch):
+    rng = np.random.default_rng(3)
+    centers = rng.standard_normal((8, 16))
+    data = np.concatenate([c + 0.1 * rng.standard_normal((50, 16)) for c in centers])
+    embeddings = {f"chunk_{i:06d}": row.tolist() for i, row in enumerate(data)}
+    index = VectorIndex.from_embeddings(embeddings)
+    index.ann = IVFIndex.build(index.matrix, nlist=8)
+
+    query = data[17] + 0.05
+    exact = index.search(query, 10, exact=True)
+    assert index.search(query, 10, nprobe=8) == exact
+    approx = {cid for cid, _ in index.search(query, 10, nprobe=2)}
+    assert len(approx & {cid for cid, _ in exact}) >= 8
+
+    monkeypatch.setattr(rag, "_embed_texts", _fake_embed)
+    kb = _make_kb(tmp_path)
+    stats = rag.build_index(
+        str(kb), index_dir=str(tmp_path / "small"), chunks_path=str(tmp_path / "c1.json"), ann="ivf"
+    )
+    assert stats["ann"] is None
+    stats = rag.build_index(
+        str(kb), index_dir=str(tmp_path / "ivf"), chunks_path=str(tmp_path / "c2.json"),
+        ann="ivf", ann_min_chunks=1, ivf_nlist=2,
+    )
+    assert stats["ann"]["nlist"] == 2
+    _, vectors = rag.load_index(str(tmp_path / "ivf"), str(tmp_path / "c2.json"))
+    assert vectors.ann is not None and vectors.ann.nlist == 2
+
+
+def test_quantized_search_rescores_in_float_and_round_trips(tmp_path, monkeypatch):
+    rng = np.random.default_rng(5)
+    centers = rng.standard_normal((20, 64))
+    data = np.concatenate([c + 0.3 * rng.standard_normal((50, 64)) for c in centers])
+    index = VectorIndex.from_embeddings({f"chunk_{i:06d}": row.tolist() for i, row in enumerate(data)})
+    queries = data[rng.choice(len(data), size=20, replace=False)] + 0.1 * rng.standard_normal((20, 64))
+
+    for kind, nbytes, min_recall in (("int8", 1000 * 64 + 64 * 4, 0.95), ("binary", 1000 * 8, 0.85)):
+        index.quant = QuantizedIndex.build(index.matrix, kind)
+        assert index.quant.nbytes == nbytes
+        recall = 0.0
+        for q in queries:
+            exact = index.search(q, 10, exact=True)
+            got = index.search(q, 10)
+            # Scores come from the float re-score, not from the codes
+            exact_scores = dict(exact)
+            for cid, score in got:
+                assert abs(score - float(np.dot(index[cid], index._query(q)))) < 1e-5
+            recall += len(set(exact_scores) & {cid for cid, _ in got}) / 10
+        assert recall / len(queries) >= min_recall
+
+    monkeypatch.setattr(rag, "_embed_texts", _fake_embed)
+    kb = _make_kb(tmp_path)
+    stats = rag.build_index(
+        str(kb), index_dir=str(tmp_path / "q"), chunks_path=str(tmp_path / "c.json"), quantize="binary", rescore=3
+    )
+    assert stats["quantization"]["type"] == "binary" and stats["quantization"]["rescore"] == 3
+    chunks, vectors = rag.load_index(str(tmp_path / "q"), str(tmp_path / "c.json"))
+    assert vectors.quant is not None and vectors.quant.kind == "binary" and vectors.quant.rescore == 3
+    query = np.asarray(vectors.matrix[0])
+    assert vectors.search(query, 1)[0][0] == vectors.ids[0]
+
+    # Rebuilding without quantization drops the codes again
+    stats = rag.build_index(str(kb), index_dir=str(tmp_path / "q"), chunks_path=str(tmp_path / "c.json"))
+    assert stats["quantization"] is None
+    assert not (index_store.resolve_index_dir(str(tmp_path / "q")) / index_store.QUANT_CODES_FILE).exists()
+    assert rag.load_index(str(tmp_path / "q"), str(tmp_path / "c.json"))[1].quant is None
+
+
+def test_ivf_candidates_are_shortlisted_on_quantized_codes(monkeypatch):
+    from app.ann import IVFIndex
+
+    rng = np.random.default_rng(9)
+    centers = rng.standard_normal((20, 64))
+    data = np.concatenate([c + 0.3 * rng.standard_normal((50, 64)) for c in centers])
+    index = VectorIndex.from_embeddings({f"chunk_{i:06d}": row.tolist() for i, row in enumerate(data)})
+    index.ann = IVFIndex.build(index.matrix, nlist=20, nprobe=4)
+    q = index._query(data[7] + 0.1 * rng.standard_normal(64))
+    ann_only = index.search(q, 5)
+
+    index.quant = QuantizedIndex.build(index.matrix, "int8", rescore=2)
+    seen = {}
+    approx = index.quant.approx_scores
+
+    def spy(query, rows=None):
+        seen["rows"] = rows
+        return approx(query, rows)
+
+    monkeypatch.setattr(index.quant, "approx_scores", spy)
+    got = index.search(q, 5)
+    # The codes score exactly the probed lists, and the float re-score keeps real cosines
+    assert np.array_equal(seen["rows"], index.ann.candidates(q))
+    assert 5 * 2 < seen["rows"].size < len(index)
+    for cid, score in got:
+        assert abs(score - float(np.dot(index[cid], q))) < 1e-5
+    assert got[0][0] == ann_only[0][0]
+    assert len({cid for cid, _ in got} & {cid for cid, _ in ann_only}) >= 4
+
+
+def test_incremental_build_only_embeds_changed_files(tmp_path, monkeypatch):
+    embedded = []
+
+    def counting_embed(texts, model):
+        embedded.extend(texts)
+        return _fake_embed(texts, model)
+
+    monkeypatch.setattr(rag, "_embed_texts", counting_embed)
+    kb = _make_kb(tmp_path)
+    opts = dict(index_dir=str(tmp_path / "index"), chunks_path=str(tmp_path / "chunks.json"))
+
+    stats = rag.build_index(str(kb), incremental=True, **opts)
+    assert stats["mode"] == "full"
+    assert stats["chunks_embedded"] == 3
+    chunks_before, vectors_before = rag.load_index(**opts)
+
+    embedded.clear()
+    (kb / "b.txt").write_text("gamma notes v2", encoding="utf-8")
+    (kb / "c.md").write_text("delta", encoding="utf-8")
+    stats = rag.build_index(str(kb), incremental=True, **opts)
+    assert stats["mode"] == "incremental"
+    assert embedded == ["gamma notes v2", "delta"]
+    assert (stats["files_unchanged"], stats["files_changed"], stats["files_added"]) == (1, 1, 1)
+    assert stats["chunks_reused"] == 2
+
+    chunks, vectors = rag.load_index(**opts)
+    for cid in ("chunk_000000", "chunk_000001"):
+        assert chunks[cid].text == chunks_before[cid].text
+        assert np.allclose(vectors[cid], vectors_before[cid])
+    assert "chunk_000002" not in chunks
+
+    embedded.clear()
+    (kb / "a.md").unlink()
+    stats = rag.build_index(str(kb), incremental=True, **opts)
+    assert embedded == []
+    assert stats["files_removed"] == 1
+    chunks, vectors = rag.load_index(**opts)
+    assert sorted(chunks) == sorted(vectors) == ["chunk_000003", "chunk_000004"]
+    manifest = index_store.read_manifest(opts["index_dir"])
+    assert {"chunk_000000", "chunk_000001", "chunk_000002"} <= set(manifest["tombstones"])
+
+
+def test_embedding_cache_shared_across_kbs(tmp_path, monkeypatch):
+    embedded = []
+
+    def counting_embed(texts, model):
+        embedded.extend(texts)
+        return _fake_embed(texts, model)
+
+    monkeypatch.setattr(rag, "_embed_texts", counting_embed)
+    kb = _make_kb(tmp_path)
+
+    stats = rag.build_index(str(kb), index_dir=str(tmp_path / "i1"), chunks_path=str(tmp_path / "c1.json"))
+    assert stats["embed_cache_hits"] == 0
+    assert len(embedded) == 3
+
+    embedded.clear()
+    (kb / "c.md").write_text("gamma notes", encoding="utf-8")
+    stats = rag.build_index(str(kb), index_dir=str(tmp_path / "i2"), chunks_path=str(tmp_path / "c2.json"))
+    assert embedded == []
+    assert stats["embed_cache_hits"] == 4
+    assert stats["embed_cache_hit_rate"] == 1.0
+
+    cache = EmbeddingCache(tmp_path / "small.db", max_entries=2)
+    cache.put_many("m", ["a", "b", "c"], [[1.0], [2.0], [3.0]])
+    assert sum(v is not None for v in cache.get_many("m", ["a", "b", "c"])) <= 2
+    assert cache.get_many("other", ["c"]) == [None]
+    cache.close()
+
+
+def test_embedding_cache_reuses_connection_and_counts_rows_rarely(tmp_path):
+    cache = EmbeddingCache(tmp_path / "embed.db", max_entries=10)
+    statements = []
+    cache.put_many("m", ["a"], [[1.0]])
+    conn = cache._conns.get()
+    conn.set_trace_callback(statements.append)
+    for i in range(5):
+        cache.put_many("m", [f"t{i}"], [[float(i)]])
+        cache.get_many("m", [f"t{i}"])
+    assert cache._conns.get() is conn
+    assert not any("COUNT(*)" in s for s in statements)
+
+    # Past the cap one exact count evicts down to EVICT_TO_RATIO of it
+    cache.put_many("m", [f"u{i}" for i in range(6)], [[0.0]] * 6)
+    assert sum("COUNT(*)" in s for s in statements) == 1
+    assert conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 9
+    cache.close()
+
+
+def test_query_embedding_cache_normalizes_and_persists(tmp_path, monkeypatch):
+    calls = []
+
+    def counting_embed(texts, model):
+        calls.append(texts)
+        return [[1.0, 2.0]]
+
+    monkeypatch.setattr(rag, "_embed_texts", counting_embed)
+    assert rag.embed_query("What is  Alpha?", "m") == [1.0, 2.0]
+    assert rag.embed_query(" what is alpha? ", "m") == [1.0, 2.0]
+    assert len(calls) == 1
+    rag.embed_query("What is Alpha?", "other-model")
+    assert len(calls) == 2
+
+    # A new process-level cache over the same file starts warm
+    cache = QueryEmbeddingCache(path=tmp_path / "query_cache.db")
+    assert cache.get("m", "WHAT IS ALPHA?") == [1.0, 2.0]
+    assert cache.stats()["disk_hits"] == 1
+
+    expired = QueryEmbeddingCache(ttl_seconds=0.0)
+    expired.put("m", "q", [1.0])
+    time.sleep(0.01)
+    assert expired.get("m", "q") is None
+
+
+def test_query_cache_reuses_connection_and_prunes_periodically(tmp_path, monkeypatch):
+    from app import query_cache
+
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: now[0])
+    cache = QueryEmbeddingCache(ttl_seconds=60, path=tmp_path / "q.db")
+    conn = cache._disk.get()
+
+    def rows():
+        return conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+    cache.put("m", "old", [1.0])
+    now[0] += 120
+    # Within the prune interval expired rows stay on disk but are never served
+    cache.put("m", "new", [2.0])
+    assert rows() == 2
+    assert QueryEmbeddingCache(ttl_seconds=60, path=tmp_path / "q.db").get("m", "old") is None
+    now[0] += query_cache.PRUNE_INTERVAL_SECONDS
+    cache.put("m", "newer", [3.0])
+    assert rows() == 1
+    assert cache._disk.get() is conn
+    cache.close()
+
+
+def test_query_cache_caps_rows_on_disk(tmp_path, monkeypatch):
+    from app import query_cache
+
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: now[0])
+    cache = QueryEmbeddingCache(max_entries=10, path=tmp_path / "q.db")
+    conn = cache._disk.get()
+    statements = []
+    conn.set_trace_callback(statements.append)
+
+    # A burst of distinct questions inside the TTL
+    for i in range(11):
+        now[0] += 1
+        cache.put("m", f"question {i}", [float(i)])
+    # One count seeds the estimate and one more runs the eviction
+    assert sum("COUNT(*)" in s for s in statements) == 2
+    assert conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0] == 9
+    assert QueryEmbeddingCache(path=tmp_path / "q.db").get("m", "question 0") is None
+    assert QueryEmbeddingCache(path=tmp_path / "q.db").get("m", "question 10") == [10.0]
+    cache.close()
+
+
+def test_tokenize_keeps_identifiers_and_splits_cjk_into_bigrams():
+    from app.lexical_index import tokenize
+
+    tokens = tokenize("遇到 ERR-1042 请重启服务")
+    assert {"err-1042", "err", "1042"} <= set(tokens)
+    assert {"遇到", "请重", "重启", "启服", "服务"} <= set(tokens)
+    # Full-width input is folded like half-width
+    assert "err-1042" in tokenize("ＥＲＲ－１０４２")
+
+
+def _make_ops_kb(tmp_path):
+    kb = tmp_path / "kb"
+    kb.mkdir()
+    (kb / "ops.txt").write_text("# 故障\n出现 ERR-1042 时先检查磁盘，再重启同步服务", encoding="utf-8")
+    (kb / "a.md").write_text("# 部署\n部署流程说明\n\n# 监控\n监控告警说明", encoding="utf-8")
+    (kb / "b.md").write_text("# 备份\n每天凌晨备份数据库", encoding="utf-8")
+    return kb
+
+
+def _identifier_blind_embed(texts, model):
+    # An embedding model that cannot tell the error code apart from the question
+    return [[0.0, 1.0, 0.0] if "检查磁盘" in t else [1.0, 0.1 * (i + 1), 0.0] for i, t in enumerate(texts)]
+
+
+def test_lexical_and_hybrid_retrieval_find_exact_identifiers(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag, "_embed_texts", _identifier_blind_embed)
+    kb = _make_ops_kb(tmp_path)
+    opts = dict(index_dir=str(tmp_path / "index"), chunks_path=str(tmp_path / "chunks.json"))
+    stats = rag.build_index(str(kb), **opts)
+    assert stats["lexical"]["terms"] > 0
+    assert index_store.read_header(opts["index_dir"])["lexical"]["type"] == "bm25"
+    chunks, vectors = rag.load_index(**opts)
+    assert vectors.lexical is not None and len(vectors.lexical) == len(vectors)
+
+    question = "ERR-1042 怎么处理"
+    vector_hits = rag.retrieve(question, chunks, vectors, topk=2, embedding_model="m")
+    assert all(r.chunk.source_file != "ops.txt" for r in vector_hits)
+
+    lexical_hits = rag.retrieve(question, chunks, vectors, topk=2, embedding_model="m", mode="lexical")
+    assert [r.chunk.source_file for r in lexical_hits] == ["ops.txt"]
+
+    hybrid_hits = rag.retrieve(question, chunks, vectors, topk=2, embedding_model="m", mode="hybrid")
+    assert "ops.txt" in [r.chunk.source_file for r in hybrid_hits]
+    # Hybrid keeps cosine scores, so the refusal threshold means the same thing
+    for r in hybrid_hits:
+        assert abs(r.score - float(np.dot(vectors[r.chunk.chunk_id], rag.normalize_vector(_identifier_blind_embed([question], "m")[0])))) < 1e-5
+
+    assert rag.fuse_rrf([["a", "b"], ["b", "c"]], k=1)[0][0] == "b"
+
+
+def test_prepare_ask_answers_from_lexical_index_when_embeddings_are_down(tmp_path, monkeypatch):
+    import time as _time
+
+    import httpx
+    import pytest
+    from fastapi import HTTPException
+    from openai import APIConnectionError
+
+    from server.services import rag_service
+
+    monkeypatch.setattr(rag, "_embed_texts", _identifier_blind_embed)
+    kb = _make_ops_kb(tmp_path)
+    opts = dict(index_dir=str(tmp_path / "index"), chunks_path=str(tmp_path / "chunks.json"))
+    rag.build_index(str(kb), **opts)
+    chunks, vectors = rag.load_index(**opts)
+    opened = (chunks, vectors, tmp_path / "index", tmp_path / "chunks.json")
+    monkeypatch.setattr(rag_service, "_open_kb_index", lambda user_id, kb_id: (opened, lambda: None))
+
+    def down(question, model):
+        raise APIConnectionError(request=httpx.Request("POST", "http://embeddings.invalid"))
+
+    monkeypatch.setattr(rag_service, "embed_query", down)
+    result = rag_service.prepare_ask(user_id="u", kb_id="kb", question="ERR-1042 怎么处理").result
+    assert result["refused"] is False
+    assert (result["retrieval"], result["retrieval_fallback"]) == ("lexical", "embedding_error")
+    assert result["citations"][0]["source_file"] == "ops.txt"
+
+    def slow(question, model):
+        _time.sleep(0.5)
+        return [1.0, 0.0, 0.0]
+
+    monkeypatch.setattr(rag_service, "embed_query", slow)
+    monkeypatch.setenv("RAG_EMBED_TIMEOUT_SECONDS", "0.05")
+    result = rag_service.prepare_ask(user_id="u", kb_id="kb", question="ERR-1042", retrieval="hybrid").result
+    assert result["retrieval_fallback"] == "embedding_timeout"
+
+    monkeypatch.setattr(rag_service, "embed_query", down)
+    monkeypatch.setenv("RAG_LEXICAL_FALLBACK", "0")
+    with pytest.raises(HTTPException) as exc_info:
+        rag_service.prepare_ask(user_id="u", kb_id="kb", question="ERR-1042")
+    assert exc_info.value.status_code == 503
+
+
+def test_query_embedding_pool_is_created_once_under_concurrency(monkeypatch):
+    import threading
+
+    from server.services import rag_service
+
+    created = []
+
+    class SlowPool:
+        def __init__(self, **kwargs):
+            time.sleep(0.02)
+            created.append(self)
+
+    monkeypatch.setattr(rag_service, "_embed_pool", None)
+    monkeypatch.setattr(rag_service, "ThreadPoolExecutor", SlowPool)
+    barrier = threading.Barrier(8)
+    pools = []
+
+    def first_request():
+        barrier.wait()
+        pools.append(rag_service._get_embed_pool())
+
+    threads = [threading.Thread(target=first_request) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(created) == 1 and all(p is created[0] for p in pools)
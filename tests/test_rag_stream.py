@@ -0,0 +1,68 @@
+import json
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app.rag import Chunk, RetrievedChunk
+from server.api.routers import rag as rag_router
+from server.main import create_app
+from server.services import rag_service
+
+
+def _parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_ask_stream_sends_citations_then_deltas_and_records_history(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+
+    chunk = Chunk(chunk_id="chunk_000001", source_file="a.md", section_id=0, text="RAG 是检索增强生成")
+    retrieved = [RetrievedChunk(chunk=chunk, score=0.9)]
+
+    def fake_prepare(**kwargs):
+        return rag_service.PreparedAsk(
+            result={
+                "question": kwargs["question"],
+                "refused": False,
+                "answer": None,
+                "top_score": 0.9,
+                "threshold": kwargs["threshold"],
+                "citations": rag_service._format_citations(retrieved),
+                "cached": False,
+            },
+            retrieved=retrieved,
+            needs_generation=True,
+        )
+
+    monkeypatch.setattr(rag_router, "prepare_ask", fake_prepare)
+    monkeypatch.setattr(
+        rag_service,
+        "generate_answer_stream",
+        lambda question, retrieved, model: iter(["RAG ", "是检索增强生成", " [a.md#chunk_000001]"]),
+    )
+
+    client = TestClient(create_app())
+    res = client.post("/api/auth/register", json={"username": f"user_{uuid.uuid4().hex[:8]}", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {res.json()['token']}"}
+
+    res = client.post("/api/rag/ask/stream", json={"kb_id": "kb", "question": "什么是 RAG"}, headers=headers)
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/event-stream")
+
+    events = _parse_sse(res.text)
+    assert [name for name, _ in events] == ["citations", "delta", "delta", "delta", "done"]
+    assert events[0][1]["citations"][0]["chunk_id"] == "chunk_000001"
+    assert "answer" not in events[0][1]
+    done = events[-1][1]
+    assert done["answer"] == "RAG 是检索增强生成 [a.md#chunk_000001]"
+
+    items = client.get("/api/rag/history", headers=headers).json()["items"]
+    assert len(items) == 1
+    assert items[0]["status"] == "success"
+    detail = client.get(f"/api/rag/history/{items[0]['id']}", headers=headers).json()
+    assert detail["answer"] == done["answer"]
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+from app.rate_limiter import ModelLimiter, RateLimiter, TokenBucket, parse_limits
+
+
+def _rate_limit_error(retry_after_ms: str) -> RateLimitError:
+    request = httpx.Request("POST", "http://upstream/v1/responses")
+    response = httpx.Response(429, headers={"retry-after-ms": retry_after_ms}, request=request)
+    return RateLimitError("slow down", response=response, body=None)
+
+
+def test_token_bucket_reservations_queue_in_order():
+    bucket = TokenBucket(per_minute=60, now=0.0)  # 1 token per second, burst 60
+    assert bucket.reserve(60, now=0.0) == 0.0
+    assert bucket.reserve(1, now=0.0) == pytest.approx(1.0)
+    assert bucket.reserve(1, now=0.0) == pytest.approx(2.0)
+    # Refunding unused tokens shortens the queue for later callers
+    bucket.adjust(-2, now=0.0)
+    assert bucket.reserve(1, now=0.0) == pytest.approx(1.0)
+
+
+def test_parse_limits():
+    assert parse_limits("gpt-4o-mini=500:200000, text-embedding-3-small=3000:0") == {
+        "gpt-4o-mini": (500, 200000),
+        "text-embedding-3-small": (3000, 0),
+    }
+
+
+def test_rpm_budget_paces_calls_and_records_wait():
+    limiter = RateLimiter(limits={"m": (1200, 0)})  # 20 requests per second after the burst
+    limiter.for_model("m")._requests.level = 1
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.call("m", 1, lambda: "ok")
+    assert time.monotonic() - start >= 0.09
+    stats = limiter.stats()["m"]
+    assert stats["acquired"] == 3
+    assert stats["max_wait_ms"] > 0
+    assert stats["queue_depth"] == 0
+
+
+def test_retry_after_pauses_and_retries():
+    limiter = RateLimiter(max_retries=2)
+    calls = []
+
+    def flaky():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise _rate_limit_error("100")
+        return "ok"
+
+    assert limiter.call("m", 10, flaky) == "ok"
+    assert calls[1] - calls[0] >= 0.09
+    assert limiter.stats()["m"]["rate_limited"] == 1
+
+    with pytest.raises(RateLimitError):
+        RateLimiter(max_retries=0).call("m", 1, lambda: (_ for _ in ()).throw(_rate_limit_error("1")))
+
+
+def test_concurrency_cap_is_fifo_across_threads_and_tasks():
+    limiter = ModelLimiter(max_concurrency=1)
+    order = []
+    limiter.acquire(1)
+
+    def worker(name):
+        limiter.acquire(1)
+        order.append(name)
+        limiter.release()
+
+    threads = []
+    for name in ("a", "b", "c"):
+        t = threading.Thread(target=worker, args=(name,))
+        t.start()
+        threads.append(t)
+        # Let each thread reach the queue before starting the next
+        while limiter.stats()["queue_depth"] < len(threads):
+            time.sleep(0.001)
+    assert limiter.stats()["in_flight"] == 1
+    limiter.release()
+    for t in threads:
+        t.join(timeout=5)
+    assert order == ["a", "b", "c"]
+
+    async def run_async():
+        results = []
+
+        async def task(name):
+            await limiter.acquire_async(1)
+            results.append(name)
+            await asyncio.sleep(0.01)
+            limiter.release()
+
+        await asyncio.gather(*(task(n) for n in ("x", "y", "z")))
+        return results
+
+    assert asyncio.run(run_async()) == ["x", "y", "z"]
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_answer_stream_leaves_429_retries_to_the_limiter(monkeypatch):
+    from app import rag
+
+    requested = []
+
+    class FakeResponses:
+        def create(self, **kwargs):
+            raise _rate_limit_error("10")
+
+    class FakeClient:
+        responses = FakeResponses()
+
+    def fake_get_client(max_retries=None):
+        requested.append(max_retries)
+        return FakeClient()
+
+    limiter = RateLimiter()
+    monkeypatch.setattr(rag, "get_client", fake_get_client)
+    monkeypatch.setattr(rag, "get_rate_limiter", lambda: limiter)
+    with pytest.raises(RateLimitError):
+        list(rag.generate_answer_stream("q", [], "m"))
+
+    assert requested == [0]
+    stats = limiter.for_model("m").stats()
+    assert stats["rate_limited"] == 1 and stats["in_flight"] == 0
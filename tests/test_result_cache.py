@@ -0,0 +1,86 @@
+import json
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app import pipeline
+from app.result_cache import ResultCache
+from server.main import create_app
+
+
+RESULT = {
+    "summary_short": "ok",
+    "summary_bullets": ["a", "b", "c"],
+    "topic": "其他",
+    "sentiment": "中性",
+    "keywords": [],
+    "entities": {"time": None, "location": None, "people": [], "orgs": []},
+    "rewrite_formal": "ok",
+}
+
+
+def test_result_cache_ttl_cap_and_prompt_hash(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path / "results.db", max_entries=10, ttl_seconds=60)
+    cache.put("p1", "m", "hello", {"a": 1})
+
+    assert cache.get("p1", "m", "hello") == {"a": 1}
+    assert cache.get("p2", "m", "hello") is None
+    assert cache.get("p1", "m", "hello ") is None
+
+    now = [1000.0]
+    monkeypatch.setattr("app.result_cache.time.time", lambda: now[0])
+    cache.put("p1", "m", "old", {"a": 2})
+    now[0] += 61
+    assert cache.get("p1", "m", "old") is None
+
+    for i in range(12):
+        cache.put("p1", "m", f"t{i}", {"i": i})
+    assert cache.evictions > 0
+    assert cache.get("p1", "m", "t11") == {"i": 11}
+    assert cache.stats()["hits"] == 2
+
+
+def test_process_caches_result_and_records_cached_history(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    calls = []
+
+    async def fake_complete(prompt):
+        calls.append(prompt)
+        return json.dumps(RESULT, ensure_ascii=False)
+
+    monkeypatch.setattr(pipeline, "_complete_async", fake_complete)
+
+    client = TestClient(create_app())
+    res = client.post("/api/auth/register", json={"username": f"user_{uuid.uuid4().hex[:8]}", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {res.json()['token']}"}
+
+    for payload in ({"text": "同一段文本"}, {"text": "同一段文本"}, {"text": "同一段文本", "bypass_cache": True}):
+        res = client.post("/api/text/process", json=payload, headers=headers)
+        assert res.status_code == 200
+        assert res.json()["summary_short"] == "ok"
+
+    assert len(calls) == 2
+    history = client.get("/api/text/history", headers=headers).json()["items"]
+    assert sorted(h["cached"] for h in history) == [False, False, True]
+
+    stats = client.get("/api/stats", headers=headers).json()["result_cache"]
+    assert stats["hits"] == 1
+
+
+def test_result_cache_reuses_connection_and_counts_rows_rarely(tmp_path):
+    cache = ResultCache(tmp_path / "results.db", max_entries=10, ttl_seconds=60)
+    conn = cache._conns.get()
+    statements = []
+    conn.set_trace_callback(statements.append)
+
+    for i in range(10):
+        cache.put("p", "m", f"t{i}", {"i": i})
+        assert cache.get("p", "m", f"t{i}") == {"i": i}
+    assert cache._conns.get() is conn
+    # One exact count to seed the estimate; no eviction pass while under the cap
+    assert sum("COUNT(*)" in s for s in statements) == 1
+    cache.put("p", "m", "t10", {"i": 10})
+    assert cache.evictions == 2
+    assert sum("COUNT(*)" in s for s in statements) == 2
+    cache.close()
@@ -29,6 +29,22 @@ function formatTime(value) {
   return Number.isNaN(date.getTime()) ? value : date.toLocaleString();
 }
 
+const INDEX_POLL_MS = 1000;
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+function formatIndexProgress(job) {
+  const progress = job?.progress || {};
+  if (job?.status === "queued") return "索引排队中…";
+  if (progress.stage !== "embedding") return "索引构建中…";
+  const done = progress.chunks_embedded ?? 0;
+  const total = progress.chunks_to_embed ?? 0;
+  const eta = job.eta_seconds != null ? `，预计剩余 ${Math.ceil(job.eta_seconds)} 秒` : "";
+  return `索引构建中：已向量化 ${done}/${total}${eta}`;
+}
+
 function AskResultSkeleton() {
   return (
     <div className="space-y-4">
@@ -63,6 +79,8 @@ export default function RAGLab() {
   const [historyDetailLoading, setHistoryDetailLoading] = useState(false);
   const [selectedHistoryId, setSelectedHistoryId] = useState("");
   const [historyError, setHistoryError] = useState("");
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [historyLoadingMore, setHistoryLoadingMore] = useState(false);
 
   const loadKbs = useCallback(async (silent = false) => {
     try {
@@ -95,6 +113,7 @@ export default function RAGLab() {
       const data = await fetchJson("/api/rag/history?limit=50");
       const items = data.items || [];
       setHistoryItems(items);
+      setHistoryCursor(data.next_cursor || null);
       return items;
     } catch (error) {
       if (!silent) {
@@ -108,6 +127,20 @@ export default function RAGLab() {
     }
   }, []);
 
+  const loadMoreHistory = useCallback(async () => {
+    if (!historyCursor) return;
+    setHistoryLoadingMore(true);
+    try {
+      const data = await fetchJson(`/api/rag/history?limit=50&cursor=${encodeURIComponent(historyCursor)}`);
+      setHistoryItems((prev) => [...prev, ...(data.items || [])]);
+      setHistoryCursor(data.next_cursor || null);
+    } catch (error) {
+      toast.error(error.message || "加载历史记录失败");
+    } finally {
+      setHistoryLoadingMore(false);
+    }
+  }, [historyCursor]);
+
   const loadHistoryDetail = useCallback(async (historyId) => {
     if (!historyId) return;
     setSelectedHistoryId(historyId);
@@ -208,10 +241,21 @@ export default function RAGLab() {
     setStatus("");
 
     try {
-      const data = await fetchJson(`/api/kb/${activeKb}/index`, {
+      const submitted = await fetchJson(`/api/kb/${activeKb}/index`, {
         method: "POST"
       });
-      setStatus(`索引完成，chunks=${data.stats?.chunks ?? "-"}`);
+      let job = submitted.job;
+      // The build runs in the background; poll until this job (or the one it joined) finishes
+      while (job && (job.status === "queued" || job.status === "running")) {
+        setStatus(formatIndexProgress(job));
+        await sleep(INDEX_POLL_MS);
+        const data = await fetchJson(`/api/kb/${activeKb}/index/status`);
+        job = data.job?.id === submitted.job_id ? data.job : data.next_job?.id === submitted.job_id ? data.next_job : data.job;
+      }
+      if (job?.status === "failed") {
+        throw new Error(job.error || "索引失败");
+      }
+      setStatus(`索引完成，chunks=${job?.stats?.chunks ?? "-"}`);
       toast.success("索引构建完成");
       await loadKbs(true);
     } catch (error) {
@@ -603,6 +647,14 @@ export default function RAGLab() {
                 )}
               </TableBody>
             </Table>
+            {historyCursor && !historyLoading ? (
+              <div className="border-t p-2 text-center">
+                <Button variant="outline" size="sm" onClick={loadMoreHistory} disabled={historyLoadingMore}>
+                  {historyLoadingMore ? <Loader2 className="mr-2 h-4 w-4 animate-spin" /> : null}
+                  加载更多
+                </Button>
+              </div>
+            ) : null}
             {historyError ? (
               <div className="border-t px-3 py-2 text-xs text-destructive">{historyError}</div>
             ) : null}
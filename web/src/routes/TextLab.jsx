@@ -56,6 +56,8 @@ export default function TextLab() {
   const [historyDetailLoading, setHistoryDetailLoading] = useState(false);
   const [selectedHistoryId, setSelectedHistoryId] = useState("");
   const [historyError, setHistoryError] = useState("");
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [historyLoadingMore, setHistoryLoadingMore] = useState(false);
 
   const entities = result?.entities || EMPTY_ENTITIES;
 
@@ -106,6 +108,7 @@ export default function TextLab() {
       const data = await fetchJson("/api/text/history?limit=50");
       const items = data.items || [];
       setHistoryItems(items);
+      setHistoryCursor(data.next_cursor || null);
       return items;
     } catch (error) {
       if (!silent) {
@@ -119,6 +122,20 @@ export default function TextLab() {
     }
   }, []);
 
+  const loadMoreHistory = useCallback(async () => {
+    if (!historyCursor) return;
+    setHistoryLoadingMore(true);
+    try {
+      const data = await fetchJson(`/api/text/history?limit=50&cursor=${encodeURIComponent(historyCursor)}`);
+      setHistoryItems((prev) => [...prev, ...(data.items || [])]);
+      setHistoryCursor(data.next_cursor || null);
+    } catch (error) {
+      toast.error(error.message || "加载历史记录失败");
+    } finally {
+      setHistoryLoadingMore(false);
+    }
+  }, [historyCursor]);
+
   const loadHistoryDetail = useCallback(async (historyId) => {
     if (!historyId) return;
     setSelectedHistoryId(historyId);
@@ -500,6 +517,14 @@ export default function TextLab() {
                 )}
               </TableBody>
             </Table>
+            {historyCursor && !historyLoading ? (
+              <div className="border-t p-2 text-center">
+                <Button variant="outline" size="sm" onClick={loadMoreHistory} disabled={historyLoadingMore}>
+                  {historyLoadingMore ? <Loader2 className="mr-2 h-4 w-4 animate-spin" /> : null}
+                  加载更多
+                </Button>
+              </div>
+            ) : null}
             {historyError ? (
               <div className="border-t px-3 py-2 text-xs text-destructive">{historyError}</div>
             ) : null}